@@ -1,4 +1,12 @@
-from .rst2dep import make_rsd
-from .dep2rst import rsd2rs3, conllu2rsd
-from .classes import read_rst, make_deterministic_nodes
-from .rst2rels import rst2conllu, rst2tok, rst2rels
+__version__ = "1.4.0.1"
+
+from .rst2dep import make_rsd, make_conllu, merge_discourse
+from .dep2rst import rsd2rs3, conllu2rsd, iter_conllu_docs, iter_documents, stream_conllu2rsd, stream_rsd2rs3, find_crossing_edges
+from .classes import read_rst, make_deterministic_nodes, get_parse_cache_stats, set_parse_cache_size, clear_parse_cache, open_file
+from .rst2rels import rst2conllu, rst2tok, rst2rels, export_disrpt
+from .incremental import IncrementalDocument
+from .docindex import DocumentIndex, build_offset_index
+from .corpus import save_corpus, load_corpus
+from .tensors import RelationVocab, document_arrays, batch_arrays, write_shards, load_shard
+from .search import SearchIndex, build_index
+from .intervals import IntervalIndex, extract_subtree
@@ -1,36 +1,86 @@
 try:
-    from .rst2dep import make_rsd
-    from .dep2rst import rsd2rs3, conllu2rsd
-    from .rst2rels import rst2conllu, rst2tok, rst2rels
+    from .rst2dep import make_rsd, merge_discourse
+    from .dep2rst import rsd2rs3, conllu2rsd, stream_conllu2rsd, stream_rsd2rs3, is_bundle, find_crossing_edges, format_crossing
+    from .rst2rels import rst2conllu, rst2tok, rst2rels, export_disrpt, read_splits
+    from .feature_extraction import load_corpus_index
+    from .profiling import enable_profiling, disable_profiling
+    from .classes import get_parse_cache_stats, open_file, split_compression, get_docname
+    from .batch import Manifest, file_hash, options_fingerprint, parse_shard, get_shard, merge_shards, Journal, DocumentBundle, atomic_open, limited_imap, format_error
 except ImportError:  # Running as a script
-    from rst2dep import make_rsd
-    from dep2rst import rsd2rs3, conllu2rsd
-    from rst2rels import rst2conllu, rst2tok, rst2rels
+    from rst2dep import make_rsd, merge_discourse
+    from dep2rst import rsd2rs3, conllu2rsd, stream_conllu2rsd, stream_rsd2rs3, is_bundle, find_crossing_edges, format_crossing
+    from rst2rels import rst2conllu, rst2tok, rst2rels, export_disrpt, read_splits
+    from feature_extraction import load_corpus_index
+    from profiling import enable_profiling, disable_profiling
+    from classes import get_parse_cache_stats, open_file, split_compression, get_docname
+    from batch import Manifest, file_hash, options_fingerprint, parse_shard, get_shard, merge_shards, Journal, DocumentBundle, atomic_open, limited_imap, format_error
 
 from argparse import ArgumentParser
-import sys, os, io, re
+import sys, os, io, re, copy, json
+from contextlib import nullcontext
 
 def run_conversion():
-    parser = ArgumentParser(usage="python -m rst2dep [-h] [-l] [-c ROOT] [-p] [-s] [-a {li,hirao,chain}] [-f {rsd,conllu,rs3,rs4}] [-o {rsd,conllu,tok,rels}] [-d {ltr,rtl,dist}] [-r] infiles")
+    parser = ArgumentParser(usage="python -m rst2dep [-h] [-l] [-c ROOT] [-p] [-s] [-a {li,hirao,chain}[,...]] [-f {rsd,conllu,rs3,rs4}] [-o {rsd,conllu,tok,rels}] [-d {ltr,rtl,dist}] [-r] [--check_projective] [--incremental] [--resume] [--timeout SECONDS] [--max_memory MB] [--concat FILE] [--shard I/N] [--merge_shards] [--profile [FILE]] infiles")
     parser.add_argument("infiles", action="store", help="file name or glob pattern, e.g. *.rs3")
     parser.add_argument("-l", "--language_code", action="store", default="en",
                         help="stanza language code for language of data being processed")
     parser.add_argument("-c", "--corpus_root", action="store", dest="root", default="",
                         help="optional: path to corpus root folder containing a directory dep/ and \n" +
                              "a directory xml/ containing additional corpus formats")
+    parser.add_argument("--token_cache", action="store", default=None,
+                        help="optional: binary cache file for token and markup features read from the corpus root")
     parser.add_argument("-p", "--print", dest="prnt", action="store_true", help="print output instead of serializing to a file")
     parser.add_argument("-f", "--format", choices=["rsd", "conllu", "rs3", "rs4"], default="rs3", help="input format")
     parser.add_argument("-o", "--output_format", choices=["rsd", "conllu", "tok", "rels"], default="rsd", help="output format (applies for rs3 or rs4 input)")
     parser.add_argument("-d", "--depth", choices=["ltr", "rtl", "dist"], default="dist", help="how to order depth")
     parser.add_argument("-r", "--rels", action="store_true", help="use DEFAULT_RELATIONS for the .rs3 header instead of rels in input data")
-    parser.add_argument("-a","--algorithm",choices=["li","chain","hirao"],help="dependency head algorithm (default: li)",default="li")
+    parser.add_argument("-a","--algorithm",help="dependency head algorithm, one of {li,chain,hirao}, or a comma separated list to convert each document once into <name>.<algorithm>.rsd per algorithm (default: li)",default="li")
     parser.add_argument("-s","--same_unit",action="store_true",help="retain same-unit multinucs in hirao algorithm / attach them as in li algorithm for chain")
     parser.add_argument("-n","--node_ids",action="store_true",help="output constituent node IDs in rsd dependency format")
     parser.add_argument("-w","--whitespace_tokenize",action="store_true",help="use whitespace tokenization in conllu (default: False - use stanza tokenizer)")
     parser.add_argument("--outdir", action="store", default=None, help="output directory for serialized files (default: input file directory)")
+    parser.add_argument("-m", "--merge_conllu", action="store", default=None, help="multi-document conllu file to add Discourse annotations to from the input .rsd files (use with -f rsd)")
+    parser.add_argument("-j", "--processes", action="store", type=int, default=1, help="number of worker processes for multi-document input and corpus export (default: 1)")
+    parser.add_argument("--splits", action="store", default=None, help="split list file with lines 'docname split'; export combined DISRPT .rels/.tok/.conllu files per split from rs3/rs4 input")
+    parser.add_argument("--corpus", action="store", default="eng.erst.gum", help="corpus name for DISRPT split files and relation mappings (default: eng.erst.gum)")
+    parser.add_argument("--check_projective", action="store_true", help="skip non-projective documents when converting rsd or conllu to rs3, reporting their crossing edges")
+    parser.add_argument("--incremental", action="store_true", help="only convert rs3/rs4 files which changed since the last run with the same options, using a manifest in the output directory")
+    parser.add_argument("--resume", action="store_true", help="continue an interrupted run with the same options, skipping documents recorded as completed in its journal and retrying failed ones")
+    parser.add_argument("--timeout", action="store", type=float, default=None, help="maximum seconds per document; documents are converted in -j worker processes and skipped if they take longer")
+    parser.add_argument("--max_memory", action="store", type=float, default=None, help="maximum memory in MB per worker process; documents exceeding it are skipped")
+    parser.add_argument("--concat", action="store", default=None, help="write all converted documents to one file: a stream with '# newdoc id' comments, or a .zip/.tar bundle (required for rs3 output)")
+    parser.add_argument("--shard", action="store", default=None, help="only convert shard I of N of the input files, e.g. 2/8, assigned by a stable hash of each document name")
+    parser.add_argument("--merge_shards", action="store_true", help="merge per-shard outputs from the directories given as infiles into --outdir, ordering DISRPT split files by --splits")
+    parser.add_argument("--profile", action="store", nargs="?", const="-", default=None, help="print a per-stage timing breakdown to stderr, or dump it as JSON to the given file")
 
     options = parser.parse_args()
 
+    algorithms = options.algorithm.split(",")
+    if any(a not in ["li", "chain", "hirao"] for a in algorithms):
+        parser.error("argument -a/--algorithm: invalid choice: '" + options.algorithm + "' (choose from li, chain, hirao)")
+
+    if options.incremental and (options.format not in ["rs3", "rs4"] or options.merge_conllu is not None or options.splits is not None):
+        sys.stderr.write("! --incremental only applies to per-file conversion of rs3/rs4 input and is ignored\n")
+
+    shard = None
+    if options.shard is not None:
+        try:
+            shard = parse_shard(options.shard)
+        except IOError as e:
+            parser.error("argument --shard: " + str(e).strip())
+        if options.merge_conllu is not None:
+            sys.stderr.write("! --shard does not apply to --merge_conllu and is ignored\n")
+            shard = None
+
+    if options.profile is not None:
+        enable_profiling()
+        # --timeout/--max_memory workers send their timings back with each document, but other -j pools do not
+        limited = (options.timeout is not None or options.max_memory is not None) and not options.merge_shards and \
+                  options.merge_conllu is None and options.splits is None
+        if options.processes > 1 and not limited:
+            sys.stderr.write("o Profiling collects timings in a single process, ignoring -j " + str(options.processes) + "\n")
+            options.processes = 1
+
     inpath = options.infiles
 
     if "*" in inpath:
@@ -40,55 +90,331 @@ def run_conversion():
     else:
         files = [inpath]
 
-    if options.format in ["rs3","rs4"]:
-        sys.stderr.write("o Converting from " + options.format + " to " + options.output_format + " format\n")
-        for file_ in files:
-            sys.stderr.write("Processing " + os.path.basename(file_) + "\n")
+    if shard is not None:
+        n_files = len(files)
+        files = get_shard(files, shard)
+        sys.stderr.write("o Shard " + options.shard + ": " + str(len(files)) + " of " + str(n_files) + " input files\n")
 
-            rst = open(file_).read()
-            plain_docname = re.sub(r'[\s/\\]','', os.path.basename(file_).rsplit(".",1)[0].replace("rs3", "").replace("rs4", ""))
+    failures = 0
+    journal = None
+    per_file = not options.merge_shards and options.merge_conllu is None and options.splits is None
+    if options.concat is not None and (options.incremental or options.resume):
+        sys.stderr.write("! --incremental and --resume do not apply to --concat output and are ignored\n")
+        options.incremental = options.resume = False
+    if per_file and not options.prnt and options.concat is None:
+        fingerprint = options_fingerprint({"format": options.format, "output_format": options.output_format,
+                                           "algorithm": options.algorithm, "same_unit": options.same_unit,
+                                           "node_ids": options.node_ids, "depth": options.depth,
+                                           "check_projective": options.check_projective,
+                                           "language_code": options.language_code, "corpus_root": options.root,
+                                           "whitespace_tokenize": options.whitespace_tokenize})
+        journal = Journal(options.outdir if options.outdir else ".", fingerprint, resume=options.resume, shard=shard)
+        if options.resume:
+            n_files = len(files)
+            files = [f for f in files if not journal.is_done(f)]
+            sys.stderr.write("o Resuming: " + str(n_files - len(files)) + " of " + str(n_files) + " documents already completed\n")
+        journal.save()
+    elif options.resume:
+        sys.stderr.write("! --resume only applies to per-file conversion written to files and is ignored\n")
 
-            if options.output_format == "rels":
-                output = rst2rels(rst, docname=plain_docname, lang_code=options.language_code, whitespace_tokenize=options.whitespace_tokenize)
-            elif options.output_format == "tok":
-                output = rst2tok(rst, docname=plain_docname, lang_code=options.language_code, whitespace_tokenize=options.whitespace_tokenize)
-            elif options.output_format == "conllu":
-                output = rst2conllu(rst, docname=plain_docname, lang_code=options.language_code, whitespace_tokenize=options.whitespace_tokenize)
-            else:
-                output = make_rsd(file_, options.root, algorithm=options.algorithm, keep_same_unit=options.same_unit, output_const_nid=options.node_ids)
-            if options.prnt:
-                print(output)
-            else:
-                if options.outdir:
-                    outdir = options.outdir
-                    newname = os.path.join(outdir, os.path.basename(file_).replace("rs3", options.output_format).replace("rs4", options.output_format))
-                else:
-                   newname = file_.replace("rs3", options.output_format).replace("rs4", options.output_format)
-                if newname == file_:
-                    newname = file_ + "." + options.output_format
-                with io.open(newname, 'w', encoding="utf8", newline="\n") as f:
+    bundle = None
+    if per_file and options.concat is not None and not options.prnt:
+        bundle = DocumentBundle(options.concat)
+
+    try:
+        if options.merge_shards:
+            outdir = options.outdir if options.outdir else "."
+            splits = read_splits(options.splits) if options.splits is not None else None
+            merged = merge_shards(sorted(f for f in files if os.path.isdir(f)), outdir, corpus=options.corpus, splits=splits)
+            for split in sorted(merged["splits"]):
+                sys.stderr.write("o Merged " + str(merged["splits"][split]) + " documents into " + os.path.join(outdir, options.corpus + "_" + split) + ".{rels,tok,conllu}\n")
+            sys.stderr.write("o Copied " + str(merged["copied"]) + " per-document output files to " + outdir + "\n")
+        elif options.merge_conllu is not None:
+            if options.format != "rsd":
+                sys.stderr.write("! --merge_conllu requires .rsd input files (-f rsd)\n")
+                sys.exit(1)
+            sys.stderr.write("o Adding Discourse annotations from " + str(len(files)) + " rsd files to " + options.merge_conllu + "\n")
+            outdir = options.outdir if options.outdir else os.path.dirname(files[0]) if len(files) > 0 else "."
+            newname = os.path.join(outdir, os.path.basename(options.merge_conllu))
+            if os.path.abspath(newname) == os.path.abspath(options.merge_conllu):
+                base, compression = split_compression(newname)
+                newname = base.replace(".conllu", "") + ".discourse.conllu" + compression
+            missing = 0
+            with nullcontext(sys.stdout) if options.prnt else atomic_open(newname) as f:
+                for docname, output, found in merge_discourse(options.merge_conllu, files, processes=options.processes):
+                    if not found:
+                        missing += 1
                     f.write(output)
-    else:
-        sys.stderr.write("o Converting from " + options.format + " to XML format\n")
+            if missing > 0:
+                sys.stderr.write("! " + str(missing) + " documents had no matching .rsd file and were copied unchanged\n")
+        elif options.splits is not None:
+            sys.stderr.write("o Exporting DISRPT split files for " + str(len(files)) + " documents\n")
+            outdir = options.outdir if options.outdir else "."
+            export_disrpt(files, options.splits, outdir, corpus=options.corpus, lang_code=options.language_code,
+                          whitespace_tokenize=options.whitespace_tokenize, processes=options.processes, corpus_root=options.root,
+                          shard=shard)
+        elif options.format in ["rs3","rs4"]:
+            sys.stderr.write("o Converting from " + options.format + " to " + options.output_format + " format\n")
+            if bundle is not None and len(algorithms) > 1 and not is_bundle(options.concat):
+                sys.stderr.write("! Several algorithms require a .zip or .tar bundle for --concat\n")
+                sys.exit(1)
+            if len(algorithms) > 1 and options.output_format == "rsd":
+                exts = [a + "." + options.output_format for a in algorithms]
+            else:
+                exts = [options.output_format]
+            manifests = {}
+            digests = {}
+            if options.incremental and not options.prnt:
+                manifest_fingerprint = options_fingerprint({"output_format": options.output_format, "algorithm": options.algorithm,
+                                                   "same_unit": options.same_unit, "node_ids": options.node_ids,
+                                                   "language_code": options.language_code, "corpus_root": options.root,
+                                                   "whitespace_tokenize": options.whitespace_tokenize})
+                todo = []
+                for file_ in files:
+                    outdir = options.outdir if options.outdir else os.path.dirname(os.path.abspath(file_))
+                    if outdir not in manifests:
+                        manifests[outdir] = Manifest(outdir, shard=shard)
+                    digests[file_] = file_hash(file_)
+                    if not manifests[outdir].is_current(file_, [get_output_name(file_, ext, options.outdir) for ext in exts], manifest_fingerprint, digests[file_]):
+                        todo.append(file_)
+                sys.stderr.write("o " + str(len(files) - len(todo)) + " of " + str(len(files)) + " documents are up to date\n")
+                files = todo
+            if options.root != "" and options.output_format == "rsd" and (len(files) > 1 or options.token_cache is not None):
+                # Prefetch and index the corpus root token features of these documents once instead of re-reading them per document
+                load_corpus_index(options.root, docnames=[get_docname(f) for f in files], cache_file=options.token_cache)
+            for file_, newnames, error in convert_documents(files, options, algorithms, bundle):
+                if error is not None:
+                    report_failure(file_, error, journal)
+                    failures += 1
+                    continue
+                if file_ in digests:
+                    manifest = manifests[options.outdir if options.outdir else os.path.dirname(os.path.abspath(file_))]
+                    manifest.record(file_, newnames, manifest_fingerprint, digests[file_])
+                if journal is not None:
+                    journal.complete(file_, newnames)
+            for manifest in manifests.values():
+                if manifest.saved:  # Compact the entries appended during the run
+                    manifest.save()
+        else:
+            sys.stderr.write("o Converting from " + options.format + " to XML format\n")
+            for file_, newnames, error in convert_documents(files, options, algorithms, bundle):
+                if error is not None:
+                    report_failure(file_, error, journal)
+                    failures += 1
+                    continue
+                if journal is not None:
+                    journal.complete(file_, newnames)
+    except BaseException as e:
+        if bundle is not None:
+            bundle.close(e)  # Remove the incomplete bundle
+        raise
+
+    if bundle is not None:
+        bundle.close()
+        sys.stderr.write("o Wrote " + str(bundle.docs) + " documents to " + options.concat + "\n")
+
+    if journal is not None and journal.finish() > 0:
+        sys.stderr.write("! " + str(len(journal.failed)) + " documents failed, see " + journal.retry_path + "; rerun with --resume to retry them\n")
+    elif failures > 0:
+        sys.stderr.write("! " + str(failures) + " documents failed\n")
+
+    if options.profile is not None:
+        profiler = disable_profiling()
+        cache = get_parse_cache_stats()
+        # Documents converted in --timeout/--max_memory worker processes use the workers' caches, reported with their timings
+        cache["hits"] += profiler.counts["parse_cache_hits"]
+        cache["misses"] += profiler.counts["parse_cache_misses"]
+        lookups = cache["hits"] + cache["misses"]
+        cache["hit_rate"] = round(cache["hits"] / lookups, 4) if lookups > 0 else 0.0
+        if options.profile == "-":
+            sys.stderr.write(profiler.report() + "\n")
+            sys.stderr.write("read_rst cache: " + str(cache["hits"]) + " hits, " + str(cache["misses"]) + " misses (" +
+                             "%.1f" % (100 * cache["hit_rate"]) + "% hit rate)\n")
+        else:
+            report = profiler.to_dict()
+            report["parse_cache"] = cache
+            with io.open(options.profile, 'w', encoding="utf8", newline="\n") as f:
+                f.write(json.dumps(report, indent=2) + "\n")
+
+    if failures > 0:
+        sys.exit(1)
+
+
+def report_failure(file_, error, journal=None):
+    sys.stderr.write("! Failed to convert " + os.path.basename(file_) + ": " + error + "\n")
+    if journal is not None:
+        journal.fail(file_, error)
+
+
+def convert_documents(files, options, algorithms, bundle=None):
+    """
+    Convert each input file and write its outputs, in worker processes with per-document limits if a timeout or
+    memory limit is given
+
+    :param bundle: optional DocumentBundle to write all outputs to instead of one file per document
+    :return: generator of (file, output files, error) triples in input order; error is None for successful documents
+    """
+    if options.timeout is None and options.max_memory is None:
         for file_ in files:
-            sys.stderr.write("Processing " + os.path.basename(file_) + "\n")
+            try:
+                yield file_, convert_document((file_, options, algorithms, bundle)), None
+            except Exception as e:
+                yield file_, None, format_error(e)
+        return
+    # Documents are distributed over the workers, so conversions inside a worker do not start pools of their own
+    worker_options = copy.copy(options)
+    worker_options.processes = 1
+    memory = int(options.max_memory * 1024 * 1024) if options.max_memory is not None else None
+    jobs = ((file_, worker_options, algorithms, None) for file_ in files)
+    results = limited_imap(convert_document, jobs, processes=options.processes, timeout=options.timeout, memory=memory)
+    for file_, (outputs, error) in zip(files, results):
+        if error is None and bundle is not None:
+            # Workers return their outputs, which are added to the bundle in input order
+            try:
+                for docname, name, output in outputs:
+                    bundle.write(docname, name, output)
+            except Exception as e:
+                error = format_error(e)
+            outputs = []
+        yield file_, outputs, error
 
-            data = io.open(file_,encoding="utf8").read()
 
-            if options.format == "conllu":
-                data = conllu2rsd(data)
+def convert_document(job):
+    """
+    Convert one input file and write its outputs to files, to a bundle, or print them
 
-            output = rsd2rs3(data, ordering=options.depth)
+    :param job: tuple of the input file, the command line options, the list of algorithms and an optional DocumentBundle
+    :return: list of the output files written, or of (docname, output name, output) tuples if --concat is given but
+             no bundle, e.g. in a worker process
+    """
+    file_, options, algorithms, bundle = job
+    sys.stderr.write("Processing " + os.path.basename(file_) + "\n")
+    if options.format not in ["rs3", "rs4"]:
+        outdir = options.outdir if options.outdir else os.path.dirname(file_)
+        outputs = convert_dep(file_, outdir, options)
+    else:
+        output = convert_rst(file_, options, algorithms)
+        outputs = []
+        for algorithm in output:
+            ext = options.output_format if algorithm is None else algorithm + "." + options.output_format
+            outputs.append((get_docname(file_), get_output_name(file_, ext, options.outdir), output[algorithm]))
 
-            if options.prnt:
-                print(output)
-            else:
-                if options.outdir:
-                    outdir = options.outdir
-                else:
-                    outdir = os.path.dirname(file_)
-                with open(outdir + os.sep + os.path.basename(file_).replace(".rsd",".rs3").replace(".conllu",".rs3"),'w',encoding="utf8",newline="\n") as f:
-                    f.write(output)
+    newnames = []
+    # Documents of multi-document inputs arrive one at a time and are written or bundled as they come
+    for docname, newname, output in outputs:
+        if options.prnt:
+            print(output)
+        elif bundle is not None:
+            bundle.write(docname, os.path.basename(split_compression(newname)[0]), output)
+        elif options.concat is not None:
+            newnames.append((docname, os.path.basename(split_compression(newname)[0]), output))
+        else:
+            with atomic_open(newname) as f:
+                f.write(output)
+            newnames.append(newname)
+    if options.prnt:
+        sys.stdout.flush()  # Worker processes may be killed before exiting normally
+    return newnames
+
+
+def convert_rst(file_, options, algorithms):
+    """
+    Convert one .rs3/.rs4 file to the output format
+
+    :return: dictionary of algorithm names to output strings, or {None: output} for a single output
+    """
+    with open_file(file_) as f:
+        rst = f.read()
+    plain_docname = re.sub(r'[\s/\\]','', get_docname(file_).replace("rs3", "").replace("rs4", ""))
+
+    if options.output_format == "rels":
+        output = rst2rels(rst, docname=plain_docname, lang_code=options.language_code, whitespace_tokenize=options.whitespace_tokenize, corpus_root=options.root)
+    elif options.output_format == "tok":
+        output = rst2tok(rst, docname=plain_docname, lang_code=options.language_code, whitespace_tokenize=options.whitespace_tokenize, corpus_root=options.root)
+    elif options.output_format == "conllu":
+        output = rst2conllu(rst, docname=plain_docname, lang_code=options.language_code, whitespace_tokenize=options.whitespace_tokenize, corpus_root=options.root)
+    elif len(algorithms) > 1:
+        # One parse of the document shared by all algorithms
+        outputs = make_rsd(file_, options.root, algorithm=algorithms, keep_same_unit=options.same_unit, output_const_nid=options.node_ids)
+        output = {a: outputs[(a, options.same_unit)] for a in algorithms}
+    else:
+        output = make_rsd(file_, options.root, algorithm=algorithms[0], keep_same_unit=options.same_unit, output_const_nid=options.node_ids)
+    if not isinstance(output, dict):
+        output = {None: output}
+    return output
+
+
+def convert_dep(file_, outdir, options):
+    """
+    Convert one .rsd or .conllu file, or a bundle of them, to .rs3, with one output per document if it contains several
+
+    Documents are yielded one behind the conversion, as soon as it is known whether the input holds several, so that
+    multi-document inputs are written without keeping all converted documents in memory.
+
+    :return: generator of (docname, output file name, rs3) tuples
+    """
+    if options.format == "conllu":
+        # Stream documents one by one, splitting multi-document files at '# newdoc id' comments
+        outputs = stream_conllu2rsd(file_, to_rs3=True, ordering=options.depth, processes=options.processes,
+                                    check_projective=options.check_projective)
+    elif is_bundle(file_):
+        outputs = stream_rsd2rs3(file_, ordering=options.depth, processes=options.processes,
+                                 check_projective=options.check_projective)
+    else:
+        with open_file(file_) as f:
+            data = f.read()
+        if data.startswith("# newdoc id"):
+            outputs = stream_rsd2rs3(data, ordering=options.depth, processes=options.processes,
+                                     check_projective=options.check_projective)
+        else:
+            crossing = find_crossing_edges(data) if options.check_projective else []
+            if len(crossing) > 0:
+                sys.stderr.write("! Skipping non-projective document " + os.path.basename(file_) + ": " + format_crossing(crossing) + "\n")
+                return
+            outputs = [(None, rsd2rs3(data, ordering=options.depth))]
+
+    # Name outputs after the input file, unless it contains multiple documents
+    buffered = None
+    multidoc = False
+    for docname, output in outputs:
+        if output is None:  # Skipped non-projective document
+            multidoc = True
+            continue
+        if buffered is not None:
+            multidoc = True
+            yield buffered[0] if buffered[0] is not None else get_docname(file_), get_rs3_name(buffered[0], file_, outdir, multidoc), buffered[1]
+        buffered = (docname, output)
+    if buffered is not None:
+        yield buffered[0] if buffered[0] is not None else get_docname(file_), get_rs3_name(buffered[0], file_, outdir, multidoc), buffered[1]
+
+
+def get_output_name(file_, ext, outdir=None):
+    """
+    :return: path of the output file with extension ext for input file_, in outdir if given or next to the input;
+             an .rs3/.rs4 extension is replaced, and outputs of compressed inputs are compressed the same way
+    """
+    base, compression = split_compression(os.path.basename(file_) if outdir else file_)
+    if base.endswith((".rs3", ".rs4")):
+        base = base[:-len(".rs3")]
+    newname = base + "." + ext + compression
+    if outdir:
+        newname = os.path.join(outdir, newname)
+    return newname
+
+
+def get_rs3_name(docname, file_, outdir, multidoc=False):
+    """
+    :return: path of the .rs3 output for a document in an .rsd or .conllu input file; files with several documents
+             give one output per document name
+    """
+    base, compression = split_compression(os.path.basename(file_))
+    if is_bundle(file_):
+        compression = ""
+    if multidoc and docname is not None:
+        outname = docname + ".rs3" + compression
+    else:
+        outname = re.sub(r'\.(rsd|conllu|zip|tar|tgz)$', '', base) + ".rs3" + compression
+    return outdir + os.sep + outname
 
 
 if __name__ == "__main__":
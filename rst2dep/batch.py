@@ -0,0 +1,639 @@
+"""
+batch.py
+
+Helpers for converting corpora of many files in batch runs. A manifest in each output directory records a content hash
+of every converted input file, a fingerprint of the conversion options and package version, and the outputs written,
+so that incremental runs only reconvert documents which changed since the last build. Corpora can also be partitioned
+into shards by a stable hash of each document name, so that several machines convert disjoint subsets, and the
+per-shard outputs merged again afterwards. Long runs keep a journal of completed documents, so that an interrupted
+run can be resumed, and write all outputs atomically. Documents can be converted in worker processes with time and
+memory limits, which are killed and replaced when a document exceeds them. Instead of one file per document, the
+outputs of a run can also be collected in a single stream or bundle file.
+"""
+
+import io, os, re, sys, json, time, shutil, hashlib, zipfile, tarfile
+import multiprocessing
+from multiprocessing import connection
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+try:
+    from . import __version__
+    from .profiling import enable_profiling, get_profiler
+    from .classes import open_file, split_compression, get_docname, get_parse_cache_stats
+except ImportError:  # Running as a script
+    from profiling import enable_profiling, get_profiler
+    from classes import open_file, split_compression, get_docname, get_parse_cache_stats
+    __version__ = "dev"
+
+MANIFEST_NAME = ".rst2dep_manifest.json"
+JOURNAL_NAME = ".rst2dep_journal.json"
+RETRY_NAME = "rst2dep_retry.txt"
+
+
+@contextmanager
+def atomic_open(path, buffering=-1):
+    """
+    Open a text file for writing which only appears under path once it is completely written
+
+    Output goes to a temporary file which replaces path when the block exits, or is removed if it raises, so an
+    interrupted run never leaves a partial file behind. Paths ending in .gz, .bz2 or .xz are compressed.
+    """
+    tmp_file = path + ".tmp"
+    f = open_file(tmp_file, "w", compression=split_compression(path)[1], buffering=buffering)
+    try:
+        yield f
+    except BaseException:
+        f.close()
+        os.remove(tmp_file)
+        raise
+    f.close()
+    os.replace(tmp_file, path)
+
+
+def file_hash(path):
+    """
+    :return: sha1 hex digest of the file's contents
+    """
+    sha = hashlib.sha1()
+    with io.open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def read_json_log(path):
+    """
+    Read a JSON file, or a log of one JSON object per line as written by append_json
+
+    :return: list of JSON objects; a line cut off by an interrupted write ends the log
+    """
+    with io.open(path, encoding="utf8") as f:
+        data = f.read()
+    try:
+        return [json.loads(data)]
+    except ValueError:
+        pass
+    records = []
+    for line in data.split("\n"):
+        if line.strip() == "":
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            sys.stderr.write("! Ignoring the rest of " + path + " after an incomplete line\n")
+            break
+    return records
+
+
+def append_json(path, record):
+    """
+    Append one JSON object as a line to a log file, so that recording a document costs the same for any log size
+    """
+    with io.open(path, "a", encoding="utf8", newline="\n") as f:
+        f.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+def read_manifest(path):
+    """
+    :return: dictionary of manifest entries by absolute input path, replaying entries appended after the last save
+    """
+    entries = {}
+    for record in read_json_log(path):
+        if "files" in record:
+            entries.update(record["files"])
+        else:
+            entries[record.pop("file")] = record
+    return entries
+
+
+def options_fingerprint(options):
+    """
+    :param options: dictionary of conversion options which affect the output
+    :return: hash of the options and the rst2dep version
+    """
+    data = dict(options)
+    data["version"] = __version__
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode("utf8")).hexdigest()
+
+
+class DocumentBundle:
+    """
+    Writer for the outputs of many documents in a single file, which only appears under path once it is complete
+
+    Paths ending in .zip or .tar (optionally compressed, e.g. .tar.gz) give an archive with one member file per
+    document. Any other path gives a text stream, optionally compressed, in which each document starts with a
+    '# newdoc id = ...' comment, unless the output already has one; .rels documents share a single header row instead.
+    XML outputs such as .rs3 can only be written to archives.
+
+    :param path: output file path
+    :param buffer_size: write buffer size in bytes for text streams
+    """
+    TAR_MODES = {".tar": "w", ".tar.gz": "w:gz", ".tgz": "w:gz", ".tar.bz2": "w:bz2", ".tar.xz": "w:xz"}
+
+    def __init__(self, path, buffer_size=1 << 20):
+        self.path = path
+        self.tmp_file = path + ".tmp"
+        self.docs = 0
+        self.rels_header = None
+        self.archive = None
+        self.stream = None
+        tar_mode = [self.TAR_MODES[ext] for ext in self.TAR_MODES if path.endswith(ext)]
+        if path.endswith(".zip"):
+            self.archive = zipfile.ZipFile(self.tmp_file, "w", zipfile.ZIP_DEFLATED)
+        elif len(tar_mode) > 0:
+            self.archive = tarfile.open(self.tmp_file, tar_mode[-1])
+        else:
+            self.writer = atomic_open(path, buffering=buffer_size)
+            self.stream = self.writer.__enter__()
+
+    def write(self, docname, name, output):
+        """
+        :param docname: document name for the newdoc comment in text streams
+        :param name: member file name in archives, e.g. doc.rs3
+        :param output: converted document
+        """
+        self.docs += 1
+        if isinstance(self.archive, zipfile.ZipFile):
+            self.archive.writestr(name, output)
+        elif self.archive is not None:
+            data = output.encode("utf8")
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            self.archive.addfile(info, io.BytesIO(data))
+        elif name.endswith(".rs3") or name.endswith(".rs4"):
+            raise IOError("Cannot concatenate XML documents, use a .zip or .tar bundle for " + name + "\n")
+        elif name.endswith(".rels"):
+            header, _, rows = output.partition("\n")
+            if self.rels_header is None:
+                self.rels_header = header
+                self.stream.write(header + "\n")
+            if rows.strip() != "":
+                self.stream.write(rows.strip("\n") + "\n")
+        else:
+            if not output.startswith("# newdoc id"):
+                self.stream.write("# newdoc id = " + docname + "\n")
+            self.stream.write(output.strip("\n") + "\n\n")
+
+    def close(self, error=None):
+        if self.archive is not None:
+            self.archive.close()
+            if error is None:
+                os.replace(self.tmp_file, self.path)
+            else:
+                os.remove(self.tmp_file)
+        elif error is None:
+            self.writer.__exit__(None, None, None)
+        else:
+            try:
+                self.writer.__exit__(type(error), error, error.__traceback__)
+            except BaseException:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(exc)
+        return False
+
+
+def parse_shard(spec):
+    """
+    :param spec: shard specification 'i/N' with 1 <= i <= N
+    :return: tuple of shard number i and number of shards N
+    """
+    match = re.match(r'^([0-9]+)/([0-9]+)$', spec.strip())
+    if match is None or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise IOError("Invalid shard " + spec + ", expected i/N with 1 <= i <= N\n")
+    return int(match.group(1)), int(match.group(2))
+
+
+def shard_tag(shard):
+    """
+    :param shard: tuple of shard number and number of shards
+    :return: name tag for per-shard files, e.g. 'shard1of4'
+    """
+    return "shard" + str(shard[0]) + "of" + str(shard[1])
+
+
+def in_shard(docname, shard):
+    """
+    :return: True if the document name is assigned to shard (i, N)
+    """
+    return int(hashlib.sha1(docname.encode("utf8")).hexdigest(), 16) % shard[1] == shard[0] - 1
+
+
+def get_shard(files, shard):
+    """
+    Select the files belonging to one shard of a corpus
+
+    Files are assigned by a sha1 hash of their document name, so the partition does not depend on the order of the
+    input files, the machine or the directory they are read from.
+
+    :param files: list of input file paths
+    :param shard: tuple of shard number i and number of shards N, with 1 <= i <= N
+    :return: the files in shard i, in input order
+    """
+    return [f for f in files if in_shard(get_docname(f), shard)]
+
+
+class Manifest:
+    """
+    Record of converted input files in an output directory, stored as JSON lines in MANIFEST_NAME
+
+    Entries are keyed by absolute input path and hold the input content hash, the options fingerprint and the output
+    file names. Each recorded entry is appended to the file as one line, and save rewrites the file as a single line
+    with all entries, so a run only needs to save once at the end. Sharded runs keep a separate manifest per shard, so
+    that shards can share an output directory.
+
+    :param outdir: output directory holding the manifest
+    :param shard: optional tuple of shard number and number of shards
+    """
+    def __init__(self, outdir, shard=None):
+        name = MANIFEST_NAME if shard is None else MANIFEST_NAME.replace(".json", "." + shard_tag(shard) + ".json")
+        self.path = os.path.join(outdir, name)
+        self.entries = {}
+        self.saved = False  # Whether the file holds a snapshot which later entries can be appended to
+        if os.path.exists(self.path):
+            try:
+                self.entries = read_manifest(self.path)
+            except (ValueError, AttributeError, KeyError, TypeError):
+                sys.stderr.write("! Ignoring unreadable manifest " + self.path + "\n")
+
+    def is_current(self, file_, outputs, fingerprint, digest=None):
+        """
+        :param file_: input file path
+        :param outputs: list of output file paths the conversion would write
+        :param fingerprint: options fingerprint of the current run
+        :param digest: content hash of file_, if already computed
+        :return: True if file_ is unchanged since it was last converted with the same options and all outputs exist
+        """
+        entry = self.entries.get(os.path.abspath(file_))
+        if entry is None or entry["options"] != fingerprint:
+            return False
+        if sorted(entry["outputs"]) != sorted(os.path.abspath(o) for o in outputs):
+            return False
+        if not all(os.path.exists(o) for o in outputs):
+            return False
+        return entry["hash"] == (digest if digest is not None else file_hash(file_))
+
+    def record(self, file_, outputs, fingerprint, digest=None):
+        entry = {"hash": digest if digest is not None else file_hash(file_), "options": fingerprint,
+                 "outputs": sorted(os.path.abspath(o) for o in outputs)}
+        self.entries[os.path.abspath(file_)] = entry
+        if self.saved:
+            append_json(self.path, dict(entry, file=os.path.abspath(file_)))
+        else:  # Replace any older format with a snapshot first
+            self.save()
+
+    def save(self):
+        with atomic_open(self.path) as f:
+            f.write(json.dumps({"version": __version__, "files": self.entries}, sort_keys=True) + "\n")
+        self.saved = True
+
+
+class Journal:
+    """
+    Record of the documents completed and failed in a conversion run, stored as JSON lines in JOURNAL_NAME
+
+    The journal starts with a snapshot line from save, and every completed or failed document is appended as one line,
+    which an interrupted run may leave incomplete. A resumed run with the same options skips completed documents whose
+    outputs still exist and retries failed ones; with different options it starts over.
+
+    :param outdir: directory holding the journal
+    :param fingerprint: options fingerprint of the current run
+    :param resume: whether to continue from an existing journal instead of starting a new one
+    :param shard: optional tuple of shard number and number of shards
+    """
+    def __init__(self, outdir, fingerprint, resume=False, shard=None):
+        tag = "" if shard is None else "." + shard_tag(shard)
+        self.path = os.path.join(outdir, JOURNAL_NAME.replace(".json", tag + ".json"))
+        self.retry_path = os.path.join(outdir, RETRY_NAME.replace(".txt", tag + ".txt"))
+        self.fingerprint = fingerprint
+        self.done = {}
+        self.failed = {}
+        self.saved = False  # Whether the file holds a snapshot of this run which later documents can be appended to
+        if resume and os.path.exists(self.path):
+            try:
+                records = read_json_log(self.path)
+                if len(records) > 0 and records[0].get("options") == fingerprint:
+                    self.done = records[0].get("done", {})
+                    self.failed = records[0].get("failed", {})
+                    for record in records[1:]:
+                        if "outputs" in record:
+                            self.done[record["file"]] = record["outputs"]
+                            self.failed.pop(record["file"], None)
+                        else:
+                            self.failed[record["file"]] = record["error"]
+                else:
+                    sys.stderr.write("! Journal " + self.path + " was written with different options, starting over\n")
+            except (ValueError, AttributeError, KeyError, TypeError):
+                sys.stderr.write("! Ignoring unreadable journal " + self.path + "\n")
+
+    def is_done(self, file_):
+        outputs = self.done.get(os.path.abspath(file_))
+        return outputs is not None and all(os.path.exists(o) for o in outputs)
+
+    def complete(self, file_, outputs):
+        self.done[os.path.abspath(file_)] = sorted(os.path.abspath(o) for o in outputs)
+        self.failed.pop(os.path.abspath(file_), None)
+        self.append({"file": os.path.abspath(file_), "outputs": self.done[os.path.abspath(file_)]})
+
+    def fail(self, file_, error):
+        self.failed[os.path.abspath(file_)] = error
+        self.append({"file": os.path.abspath(file_), "error": error})
+
+    def append(self, record):
+        if self.saved:
+            append_json(self.path, record)
+        else:  # Replace any journal of an earlier run with a snapshot first
+            self.save()
+
+    def save(self):
+        with atomic_open(self.path) as f:
+            f.write(json.dumps({"options": self.fingerprint, "done": self.done, "failed": self.failed}, sort_keys=True) + "\n")
+        self.saved = True
+
+    def finish(self):
+        """
+        Compact the journal and write the retry list of failed documents, one 'path<TAB>error' line each, or remove
+        the journal and any old retry list if every document was completed
+
+        :return: number of failed documents
+        """
+        if len(self.failed) > 0:
+            self.save()
+            with atomic_open(self.retry_path) as f:
+                for file_ in sorted(self.failed):
+                    f.write(file_ + "\t" + self.failed[file_] + "\n")
+        else:
+            for path in [self.path, self.retry_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+        return len(self.failed)
+
+
+def split_documents(data, ext):
+    """
+    Split a DISRPT .rels, .tok or .conllu file into documents
+
+    :return: tuple of the .rels header row (or None) and an ordered dictionary of document names to their lines
+    """
+    header = None
+    docs = {}
+    docname = None
+    lines = data.split("\n")
+    if ext == "rels" and len(lines) > 0:
+        header = lines[0]
+        lines = lines[1:]
+    for line in lines:
+        if ext == "rels":
+            if line == "":
+                continue
+            docname = line.split("\t")[0]
+        elif line.startswith("# newdoc id"):
+            docname = line.split("=", 1)[1].strip()
+        elif docname is None:
+            if line == "":
+                continue
+            raise IOError("Cannot split DISRPT file into documents, missing '# newdoc id' before: " + line + "\n")
+        if docname not in docs:
+            docs[docname] = []
+        docs[docname].append(line)
+    return header, docs
+
+
+def merge_disrpt_shards(shard_files, outfile, ext, order=None):
+    """
+    Concatenate per-shard DISRPT files of one split into a single file, in canonical document order
+
+    :param shard_files: list of per-shard .rels, .tok or .conllu file paths
+    :param outfile: path of the merged file
+    :param ext: one of rels, tok, conllu
+    :param order: list of document names in canonical order, e.g. from the split list; documents not in it follow in
+                  sorted order
+    :return: number of documents written
+    """
+    header = None
+    docs = {}
+    for shard_file in shard_files:
+        with io.open(shard_file, encoding="utf8") as f:
+            shard_header, shard_docs = split_documents(f.read(), ext)
+        if header is None and shard_header:
+            header = shard_header
+        for docname in shard_docs:
+            if docname in docs:
+                raise IOError("Document " + docname + " occurs in more than one shard of " + outfile + "\n")
+            docs[docname] = shard_docs[docname]
+    order = [d for d in (order or []) if d in docs]
+    order += sorted(set(docs) - set(order))
+    with atomic_open(outfile) as f:
+        if header is not None:
+            f.write(header + "\n")
+        for docname in order:
+            if ext == "rels":
+                f.write("\n".join(docs[docname]) + "\n")
+            else:
+                block = "\n".join(docs[docname]).strip("\n")
+                f.write(block + "\n\n")
+    return len(order)
+
+
+def merge_shards(shard_dirs, outdir, corpus="eng.erst.gum", splits=None):
+    """
+    Assemble the outputs of a sharded conversion in one output directory
+
+    Per-shard DISRPT split files (<corpus>_<split>.shard<i>of<N>.<ext>) are merged into <corpus>_<split>.<ext> in the
+    document order of the split list, per-file outputs are copied from shard directories other than outdir, and the
+    per-shard manifests are combined into the manifest of outdir.
+
+    :param shard_dirs: list of shard output directories; may include outdir itself
+    :param outdir: directory for the merged outputs
+    :param corpus: corpus name prefix of the DISRPT split files
+    :param splits: optional dictionary of split names to ordered lists of document names
+    :return: dictionary with the number of documents per merged split file under 'splits' and the number of copied
+             files under 'copied'
+    """
+    shard_pattern = re.compile(re.escape(corpus) + r'_(.+)\.shard([0-9]+)of([0-9]+)\.(rels|tok|conllu)$')
+    manifest_pattern = re.compile(re.escape(MANIFEST_NAME[:-5]) + r'\.shard[0-9]+of[0-9]+\.json$')
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    disrpt = {}
+    manifest = Manifest(outdir)
+    copied = 0
+    for shard_dir in shard_dirs:
+        copy = os.path.abspath(shard_dir) != os.path.abspath(outdir)
+        for name in sorted(os.listdir(shard_dir)):
+            path = os.path.join(shard_dir, name)
+            match = shard_pattern.match(name)
+            if match is not None:
+                split, i, n_shards, ext = match.groups()
+                disrpt.setdefault((split, ext), {})[int(i)] = (path, int(n_shards))
+            elif manifest_pattern.match(name) is not None:
+                for file_, entry in read_manifest(path).items():
+                    if copy:
+                        entry["outputs"] = sorted(os.path.abspath(os.path.join(outdir, os.path.basename(o))) for o in entry["outputs"])
+                    manifest.entries[file_] = entry
+            elif copy and os.path.isfile(path) and not name.startswith((".rst2dep_", RETRY_NAME[:-4])) and not name.endswith(".tmp"):
+                shutil.copy2(path, os.path.join(outdir, name))
+                copied += 1
+
+    merged = {}
+    for (split, ext), shards in sorted(disrpt.items()):
+        n_shards = max(n for _, n in shards.values())
+        missing = [str(i) for i in range(1, n_shards + 1) if i not in shards]
+        if len(missing) > 0:
+            sys.stderr.write("! Missing shard(s) " + ",".join(missing) + " of " + str(n_shards) + " for " + corpus + "_" + split + "." + ext + "\n")
+        shard_files = [shards[i][0] for i in sorted(shards)]
+        order = splits.get(split) if splits is not None else None
+        merged[split] = merge_disrpt_shards(shard_files, os.path.join(outdir, corpus + "_" + split + "." + ext), ext, order=order)
+    if len(manifest.entries) > 0:
+        manifest.save()
+    return {"splits": merged, "copied": copied}
+
+
+def format_error(e):
+    return type(e).__name__ + ": " + str(e).strip().split("\n")[0]
+
+
+def stage_note(stage):
+    return " (last completed stage: " + stage + ")" if stage else " (before the first stage)"
+
+
+def _limited_worker(func, conn, stage, memory):
+    if memory is not None and resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+
+    def on_stage(name, seconds):
+        stage.value = name.encode("utf8")[:255]
+
+    # Profiling hooks report the progress of each document, so that a killed job can be traced to its stage
+    profiler = enable_profiling(callback=on_stage)
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        stage.value = b""
+        profiler.reset()
+        cache = get_parse_cache_stats()
+        try:
+            result, error = func(job), None
+        except Exception as e:
+            result, error = None, format_error(e) + stage_note(profiler.last_stage)
+        # Each worker has its own read_rst cache, so its hits and misses are reported along with the timings
+        after = get_parse_cache_stats()
+        profiler.count("parse_cache_hits", after["hits"] - cache["hits"])
+        profiler.count("parse_cache_misses", after["misses"] - cache["misses"])
+        conn.send((result, error, profiler.to_dict()))
+
+
+class _LimitedWorker:
+    def __init__(self, func, memory):
+        self.func = func
+        self.memory = memory
+        self.index = None
+        self.started = None
+        self.start()
+
+    def start(self):
+        self.stage = multiprocessing.Array("c", 256, lock=False)
+        self.conn, child_conn = multiprocessing.Pipe()
+        # Not a daemon, so that conversions may start process pools of their own
+        self.process = multiprocessing.Process(target=_limited_worker, args=(self.func, child_conn, self.stage, self.memory))
+        self.process.start()
+        child_conn.close()
+
+    def submit(self, index, job):
+        self.index = index
+        self.started = time.perf_counter()
+        self.conn.send(job)
+
+    def stop(self):
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(1)
+            if self.process.is_alive():
+                self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def restart(self):
+        self.stop()
+        self.index = None
+        self.start()
+
+
+def limited_imap(func, jobs, processes=1, timeout=None, memory=None, window=None):
+    """
+    Ordered map of func over an iterable of jobs in worker processes with per-job time and memory limits
+
+    A worker whose job runs longer than timeout seconds, or which dies, e.g. killed by the operating system, is killed
+    and replaced by a new one, and the job is reported as failed. The memory limit caps each worker's address space, so
+    that allocations beyond it raise MemoryError in the worker. Errors name the last completed profiling stage of the
+    job. If profiling is enabled, stage timings and read_rst cache counts from the workers are added to the active Profiler.
+
+    :param func: picklable function taking a single job argument
+    :param jobs: iterable of job arguments, consumed lazily
+    :param processes: number of worker processes
+    :param timeout: maximum wall-clock seconds per job, or None
+    :param memory: maximum address space per worker in bytes, or None; ignored where the resource module is unavailable
+    :param window: maximum number of jobs pending or waiting to be returned (default: 2 * processes)
+    :return: generator of (result, error) pairs in input order; error is None for successful jobs, otherwise a message
+    """
+    if memory is not None and resource is None:
+        sys.stderr.write("! Memory limits are not supported on this platform and are ignored\n")
+    if window is None:
+        window = 2 * processes
+    jobs = iter(jobs)
+    done = {}
+    next_index = 0
+    next_out = 0
+    exhausted = False
+    workers = [_LimitedWorker(func, memory) for _ in range(max(1, processes))]
+    try:
+        while True:
+            for worker in workers:
+                if worker.index is None and not exhausted and next_index - next_out < window:
+                    try:
+                        job = next(jobs)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    worker.submit(next_index, job)
+                    next_index += 1
+            busy = [w for w in workers if w.index is not None]
+            if len(busy) == 0:
+                break
+            wait = None
+            if timeout is not None:
+                wait = max(0, min(w.started for w in busy) + timeout - time.perf_counter())
+            ready = connection.wait([w.conn for w in busy], timeout=wait)
+            for worker in busy:
+                index = worker.index
+                if worker.conn in ready:
+                    try:
+                        result, error, profile = worker.conn.recv()
+                        worker.index = None
+                    except (EOFError, OSError):
+                        worker.process.join()
+                        result, profile = None, None
+                        error = "Worker died with exit code " + str(worker.process.exitcode) + \
+                                stage_note(worker.stage.value.decode("utf8"))
+                        worker.restart()
+                    if profile is not None and get_profiler() is not None:
+                        get_profiler().merge(profile)
+                    done[index] = (result, error)
+                elif timeout is not None and time.perf_counter() - worker.started > timeout:
+                    done[index] = (None, "Timeout: exceeded " + str(timeout) + "s" + stage_note(worker.stage.value.decode("utf8")))
+                    worker.restart()
+            while next_out in done:
+                yield done.pop(next_out)
+                next_out += 1
+    finally:
+        for worker in workers:
+            worker.stop()
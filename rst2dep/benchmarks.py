@@ -0,0 +1,315 @@
+"""
+benchmarks.py
+
+Benchmarks for rst2dep conversions on synthetic documents of increasing size. Time and peak memory for each
+function and size are reported as machine-readable JSON, which can be stored and compared against later runs.
+Example usage:
+
+python benchmarks.py suite --sizes 10,100,1000 -o baseline.json
+python benchmarks.py suite --sizes 10,100,1000 --compare baseline.json --tolerance 0.25
+python benchmarks.py merge -n 500 -j 4
+python benchmarks.py stress --nodes 100000
+python benchmarks.py corpus -n 100
+"""
+
+import io, os, sys, json, time, shutil, tempfile, platform, tracemalloc
+from argparse import ArgumentParser
+try:
+    from .rst2dep import merge_discourse, make_rsd
+    from .dep2rst import rsd2rs3
+    from .classes import read_rst, make_deterministic_nodes, set_parse_cache_size, get_parse_cache_stats
+    from .synthetic import make_synthetic_rs3
+    from .corpus import save_corpus, load_corpus
+except ImportError:
+    from rst2dep import merge_discourse, make_rsd
+    from dep2rst import rsd2rs3
+    from classes import read_rst, make_deterministic_nodes, set_parse_cache_size, get_parse_cache_stats
+    from synthetic import make_synthetic_rs3
+    from corpus import save_corpus, load_corpus
+
+script_dir = os.path.dirname(os.path.realpath(__file__)) + os.sep
+
+
+def bench_merge_conllu(n_docs=100, processes=1):
+    """
+    Time merging rsd Discourse annotations into an n_docs document conllu file built from the bundled example
+    """
+    conllu = io.open(script_dir + "example.conllu", encoding="utf8").read()
+    rsd = io.open(script_dir + "example.rsd", encoding="utf8").read()
+    tmp = tempfile.mkdtemp()
+    try:
+        conllu_file = os.path.join(tmp, "corpus.conllu")
+        with io.open(conllu_file, "w", encoding="utf8", newline="\n") as f:
+            for i in range(n_docs):
+                docname = "doc" + str(i)
+                f.write(conllu.replace("# newdoc id = GUM_news_worship", "# newdoc id = " + docname))
+                with io.open(os.path.join(tmp, docname + ".rsd"), "w", encoding="utf8", newline="\n") as r:
+                    r.write(rsd)
+        n_bytes = os.path.getsize(conllu_file)
+
+        start = time.perf_counter()
+        docs = 0
+        for docname, output, found in merge_discourse(conllu_file, tmp, processes=processes):
+            docs += 1
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(tmp)
+
+    return {"benchmark": "merge_conllu", "docs": docs, "processes": processes, "seconds": round(elapsed, 4),
+            "docs_per_sec": round(docs / elapsed, 1), "mb_per_sec": round(n_bytes / elapsed / 1e6, 2)}
+
+
+def rsd2conllu_stub(rsd):
+    # Minimal conllu with one sentence per EDU, enough for make_rels sentence and token alignment
+    sents = []
+    for line in rsd.split("\n"):
+        if "\t" in line:
+            words = line.split("\t")[1].split(" ")
+            sents.append("\n".join("\t".join([str(i + 1), w, w, "_", "_", "_", "0", "root", "_", "_"]) for i, w in enumerate(words)))
+    return "\n\n".join(sents) + "\n\n"
+
+
+def get_stages(rs3):
+    """
+    Return a list of (name, function) pairs to benchmark on one synthetic document; inputs are prepared in advance
+    """
+    rsd = make_rsd(rs3, "", as_text=True)
+    rsd_chain = make_rsd(rs3, "", as_text=True, algorithm="chain")
+    rs3_out = rsd2rs3(rsd)
+    stages = [("read_rst", lambda: read_rst(rs3, {}, as_text=True))]
+    for algorithm in ["li", "chain", "hirao"]:
+        stages.append(("make_rsd_" + algorithm, lambda a=algorithm: make_rsd(rs3, "", as_text=True, algorithm=a)))
+    stages.append(("rsd2rs3", lambda: rsd2rs3(rsd)))
+    stages.append(("make_deterministic_nodes", lambda: make_deterministic_nodes(rs3_out)))
+    try:
+        try:
+            from .rst2rels import make_rels
+        except ImportError:
+            from rst2rels import make_rels
+        conllu = rsd2conllu_stub(rsd_chain)
+        stages.append(("make_rels", lambda: make_rels(rsd_chain, conllu, "synthetic", outmode="standoff_reltype")))
+    except ImportError:
+        sys.stderr.write("! Skipping make_rels benchmark, stanza or depedit is not installed\n")
+    return stages
+
+
+def time_call(func, repeats=3):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def bench_suite(sizes=(10, 100, 1000), repeats=3, memory=True, multinuc=0.2, secedge_ratio=0.05, signal_ratio=0.3,
+                max_depth=None, split="random", seed=42, functions=None, parse_cache=False):
+    """
+    Time each conversion stage on synthetic documents of increasing size
+
+    :param sizes: EDU counts to benchmark
+    :param repeats: timing repetitions per measurement; the fastest is reported
+    :param memory: whether to also measure peak traced memory (one additional run per measurement)
+    :param secedge_ratio: secondary edges per EDU in the synthetic documents
+    :param signal_ratio: signals per EDU in the synthetic documents
+    :param functions: optional list of stage names to run (default: all)
+    :param parse_cache: whether repeated parses may be served from the read_rst cache; by default it is disabled so
+                        that every measurement includes parsing
+    :return: dictionary with run metadata and a list of results
+    """
+    cache_size = get_parse_cache_stats()["maxsize"]
+    if not parse_cache:
+        set_parse_cache_size(0)
+    results = []
+    try:
+        for n_edus in sizes:
+            rs3 = make_synthetic_rs3(n_edus, max_depth=max_depth, multinuc=multinuc, secedges=int(n_edus * secedge_ratio),
+                                     signals=int(n_edus * signal_ratio), split=split, seed=seed)
+            for name, func in get_stages(rs3):
+                if functions is not None and name not in functions:
+                    continue
+                seconds = time_call(func, repeats=repeats)
+                result = {"function": name, "n_edus": n_edus, "seconds": round(seconds, 6),
+                          "edus_per_sec": round(n_edus / seconds, 1) if seconds > 0 else None}
+                if memory:
+                    result["peak_mb"] = round(peak_memory(func) / 1e6, 3)
+                results.append(result)
+                sys.stderr.write("o " + name + " (" + str(n_edus) + " EDUs): " + str(round(seconds, 4)) + "s\n")
+    finally:
+        set_parse_cache_size(cache_size)
+
+    meta = {"python": platform.python_version(), "platform": platform.platform(), "repeats": repeats,
+            "params": {"multinuc": multinuc, "secedge_ratio": secedge_ratio, "signal_ratio": signal_ratio,
+                       "max_depth": max_depth, "split": split, "seed": seed, "parse_cache": parse_cache}}
+    return {"meta": meta, "results": results}
+
+
+def bench_stress(n_nodes=100000, algorithms=("li", "chain", "hirao"), multinuc=0.0, seed=42):
+    """
+    Convert one very deep right-branching synthetic document with about n_nodes nodes, without raising the
+    recursion limit
+
+    :return: dictionary with document size, maximum nesting depth and seconds per stage
+    """
+    rs3 = make_synthetic_rs3(n_nodes // 2 + 1, multinuc=multinuc, split="right", seed=seed)
+    result = {"benchmark": "stress", "recursion_limit": sys.getrecursionlimit()}
+    cache_size = get_parse_cache_stats()["maxsize"]
+    set_parse_cache_size(0)  # Time every conversion from scratch
+    try:
+        start = time.perf_counter()
+        nodes = read_rst(rs3, {}, as_text=True)
+        result["read_rst"] = round(time.perf_counter() - start, 4)
+        result["nodes"] = sum(1 for n in nodes.values() if n.kind != "secedge")
+        result["edus"] = sum(1 for n in nodes.values() if n.kind == "edu")
+        result["max_depth"] = max(n.sortdepth for n in nodes.values() if n.kind != "secedge")
+        for algorithm in algorithms:
+            start = time.perf_counter()
+            make_rsd(rs3, "", as_text=True, algorithm=algorithm)
+            result["make_rsd_" + algorithm] = round(time.perf_counter() - start, 4)
+            sys.stderr.write("o make_rsd_" + algorithm + " (" + str(result["nodes"]) + " nodes): " + str(result["make_rsd_" + algorithm]) + "s\n")
+    finally:
+        set_parse_cache_size(cache_size)
+    return result
+
+
+def bench_corpus(n_docs=100, n_edus=200, seed=42):
+    """
+    Compare parsing synthetic .rs3 documents with read_rst to loading the same parsed documents from a binary corpus file
+    """
+    docs = [make_synthetic_rs3(n_edus, secedges=n_edus // 20, signals=int(n_edus * 0.3), seed=seed + i) for i in range(n_docs)]
+    cache_size = get_parse_cache_stats()["maxsize"]
+    set_parse_cache_size(0)
+    try:
+        start = time.perf_counter()
+        parsed = {}
+        for i, rs3 in enumerate(docs):
+            rel_hash = {}
+            parsed["doc" + str(i)] = (read_rst(rs3, rel_hash, as_text=True), rel_hash)
+        read_seconds = time.perf_counter() - start
+    finally:
+        set_parse_cache_size(cache_size)
+    tmp = tempfile.mkdtemp()
+    try:
+        corpus_file = os.path.join(tmp, "corpus.npz")
+        start = time.perf_counter()
+        save_corpus(parsed, corpus_file)
+        save_seconds = time.perf_counter() - start
+        n_bytes = os.path.getsize(corpus_file)
+        load_seconds = time_call(lambda: load_corpus(corpus_file))
+    finally:
+        shutil.rmtree(tmp)
+    return {"benchmark": "corpus", "docs": n_docs, "n_edus": n_edus, "read_rst": round(read_seconds, 4),
+            "save_corpus": round(save_seconds, 4), "load_corpus": round(load_seconds, 4),
+            "speedup": round(read_seconds / load_seconds, 1), "mb": round(n_bytes / 1e6, 2)}
+
+
+# Fields holding seconds in the results of benchmarks other than the suite, matched by prefix
+TIMED_FIELDS = {"stress": ("read_rst", "make_rsd_"), "merge_conllu": ("seconds",),
+                "corpus": ("read_rst", "save_corpus", "load_corpus")}
+
+
+def get_timings(result):
+    """
+    :param result: output of any benchmark function
+    :return: dictionary of (measurement, input size) tuples to seconds
+    """
+    if "results" in result:  # Suite
+        return {(r["function"], str(r["n_edus"]) + " EDUs"): r["seconds"] for r in result["results"]}
+    benchmark = result["benchmark"]
+    if benchmark == "stress":
+        size = str(result["nodes"]) + " nodes"
+    elif benchmark == "merge_conllu":
+        size = str(result["docs"]) + " docs, " + str(result["processes"]) + " processes"
+    else:
+        size = str(result["docs"]) + " docs of " + str(result["n_edus"]) + " EDUs"
+    timings = {}
+    for field in result:
+        if field.startswith(TIMED_FIELDS[benchmark]):
+            timings[(benchmark if field == "seconds" else field, size)] = result[field]
+    return timings
+
+
+def compare(current, baseline, tolerance=0.2):
+    """
+    Compare benchmark results against a stored baseline of the same benchmark
+
+    :return: list of comparison rows and the number of regressions, i.e. measurements slower than the baseline by more than tolerance
+    """
+    base = get_timings(baseline)
+    rows = []
+    regressions = 0
+    for key, seconds in get_timings(current).items():
+        if key not in base:
+            continue
+        ratio = seconds / base[key] if base[key] > 0 else None
+        regression = ratio is not None and ratio > 1 + tolerance
+        if regression:
+            regressions += 1
+        rows.append({"function": key[0], "size": key[1], "baseline": base[key], "current": seconds,
+                     "ratio": round(ratio, 3) if ratio is not None else None, "regression": regression})
+    return rows, regressions
+
+
+if __name__ == "__main__":
+    p = ArgumentParser(description="Run rst2dep benchmarks and print results as JSON")
+    p.add_argument("benchmark", choices=["suite", "merge", "stress", "corpus"], help="benchmark to run")
+    p.add_argument("--sizes", default="10,100,1000", help="comma separated EDU counts for the suite benchmark")
+    p.add_argument("--functions", default=None, help="comma separated stage names to run (default: all)")
+    p.add_argument("--repeats", type=int, default=3, help="timing repetitions per measurement")
+    p.add_argument("--no_memory", action="store_true", help="skip peak memory measurement")
+    p.add_argument("--multinuc", type=float, default=0.2, help="multinuc probability in synthetic documents")
+    p.add_argument("--max_depth", type=int, default=None, help="maximum nesting depth of synthetic documents")
+    p.add_argument("--split", choices=["random", "balanced", "right"], default="random", help="synthetic tree shape")
+    p.add_argument("-o", "--output", default=None, help="file to write JSON results to (default: print)")
+    p.add_argument("--compare", default=None, help="baseline JSON file to compare against")
+    p.add_argument("--parse_cache", action="store_true", help="allow the read_rst cache to serve repeated parses in the suite benchmark")
+    p.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown ratio before a comparison counts as a regression")
+    p.add_argument("-n", "--docs", type=int, default=100, help="number of documents for the merge and corpus benchmarks")
+    p.add_argument("-j", "--processes", type=int, default=1, help="number of worker processes for the merge benchmark")
+    p.add_argument("--nodes", type=int, default=100000, help="approximate number of tree nodes for the stress benchmark")
+    opts = p.parse_args()
+
+    if opts.benchmark == "merge":
+        result = bench_merge_conllu(n_docs=opts.docs, processes=opts.processes)
+    elif opts.benchmark == "corpus":
+        result = bench_corpus(n_docs=opts.docs)
+    elif opts.benchmark == "stress":
+        result = bench_stress(n_nodes=opts.nodes)
+    else:
+        sizes = [int(n) for n in opts.sizes.split(",")]
+        functions = opts.functions.split(",") if opts.functions is not None else None
+        result = bench_suite(sizes, repeats=opts.repeats, memory=not opts.no_memory, multinuc=opts.multinuc,
+                             max_depth=opts.max_depth, split=opts.split, functions=functions,
+                             parse_cache=opts.parse_cache)
+
+    exit_code = 0
+    if opts.compare is not None:
+        baseline = json.load(io.open(opts.compare, encoding="utf8"))
+        rows, regressions = compare(result, baseline, tolerance=opts.tolerance)
+        result["comparison"] = rows
+        if len(rows) == 0:
+            sys.stderr.write("! No measurements in common with the baseline " + opts.compare + "\n")
+        for row in rows:
+            flag = " REGRESSION" if row["regression"] else ""
+            sys.stderr.write(row["function"] + " (" + row["size"] + "): x" + str(row["ratio"]) + flag + "\n")
+        if regressions > 0:
+            exit_code = 1
+
+    if opts.output is not None:
+        with io.open(opts.output, "w", encoding="utf8", newline="\n") as f:
+            f.write(json.dumps(result, indent=2) + "\n")
+    else:
+        print(json.dumps(result, indent=2))
+    sys.exit(exit_code)
@@ -1,6 +1,45 @@
 from xml.dom import minidom
 from xml.parsers.expat import ExpatError
-import re, collections, sys, io
+import re, collections, sys, io, os, hashlib
+import gzip, bz2, lzma
+
+# Compressed files are recognized by extension and (de)compressed as a stream
+COMPRESSION = {".gz": gzip, ".bz2": bz2, ".xz": lzma}
+
+
+def split_compression(path):
+    """
+    :return: tuple of path without a compression extension (.gz, .bz2 or .xz) and that extension, or "" if uncompressed
+    """
+    for ext in COMPRESSION:
+        if path.endswith(ext):
+            return path[:-len(ext)], ext
+    return path, ""
+
+
+def open_file(path, mode="r", compression=None, buffering=-1):
+    """
+    Open a UTF-8 text file for reading or writing, decompressing or compressing it as a stream if its name ends in
+    .gz, .bz2 or .xz
+
+    :param mode: 'r' or 'w'
+    :param compression: compression extension to use instead of detecting it from path, e.g. for temporary files
+    :param buffering: write buffer size in bytes for uncompressed output
+    :return: text file object
+    """
+    if compression is None:
+        compression = split_compression(path)[1]
+    newline = "\n" if "w" in mode else None
+    if compression != "":
+        return COMPRESSION[compression].open(path, mode + "t", encoding="utf8", newline=newline)
+    return io.open(path, mode, encoding="utf8", newline=newline, buffering=buffering)
+
+
+def get_docname(path):
+    """
+    :return: document name of a file path, without directories, compression and format extensions
+    """
+    return os.path.basename(split_compression(path)[0]).rsplit(".", 1)[0]
 
 
 def rangify(token_string):
@@ -41,6 +80,42 @@ def unrangify(range_string):
     return ",".join(sorted(tokens, key=lambda x: int(x)))
 
 
+def bounded_imap(func, jobs, processes=1, window=None):
+    """
+    Ordered map of func over an iterable of jobs, optionally on a process pool.
+
+    Unlike Pool.imap, at most window jobs are pulled from the input iterator at any time, so
+    streaming readers keep constant memory even when the workers are slower than the reader.
+
+    :param func: picklable function taking a single job argument
+    :param jobs: iterable of job arguments, consumed lazily
+    :param processes: number of worker processes; 1 runs everything in the current process
+    :param window: maximum number of pending jobs (default: 2 * processes)
+    :return: generator of results in input order
+    """
+    if processes is None or processes <= 1:
+        for job in jobs:
+            yield func(job)
+        return
+
+    from multiprocessing import Pool
+    if window is None:
+        window = 2 * processes
+    pending = collections.deque()
+    pool = Pool(processes)
+    try:
+        for job in jobs:
+            pending.append(pool.apply_async(func, (job,)))
+            if len(pending) >= window:
+                yield pending.popleft().get()
+        while len(pending) > 0:
+            yield pending.popleft().get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
 class SIGNAL:
     def __init__(self, sigtype, sigsubtype, tokens, status=""):
         self.type = sigtype
@@ -220,9 +295,131 @@ class ParsedToken:
         return str(self.text) + " (" + str(self.pos) + "/" + str(self.lemma) + ") " + "<-" + str(self.func) + "- " + str(self.head_text)
 
 
+class ParseCache:
+    """
+    Bounded LRU cache of parsed RST trees, keyed by a hash of the document text and the relations passed to read_rst
+
+    Cached trees are snapshots which are never returned themselves: each hit returns a copy of the NODE objects and
+    their lists, so that conversions which modify node fields do not change the cache.
+
+    :param maxsize: maximum number of documents to keep; 0 disables caching
+    """
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(data, rel_hash):
+        digest = hashlib.sha1(data.encode("utf8")).hexdigest()
+        return digest + "|" + ";".join(rel + "=" + rel_hash[rel] for rel in sorted(rel_hash))
+
+    def get(self, key):
+        """
+        :return: tuple of a fresh copy of the cached nodes and the relations found while parsing, or None on a miss
+        """
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        nodes, rels = self.entries[key]
+        return copy_nodes(nodes), rels
+
+    def put(self, key, nodes, rels):
+        if self.maxsize <= 0:
+            return
+        self.entries[key] = (copy_nodes(nodes), dict(rels))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hits / lookups, 4) if lookups > 0 else 0.0,
+                "size": len(self.entries), "maxsize": self.maxsize}
+
+
+_parse_cache = ParseCache()
+
+
+def copy_nodes(nodes):
+    """
+    Copy a dictionary of NODE and SECEDGE objects from read_rst, including their children, token and signal lists
+    """
+    output = {}
+    for nid in nodes:
+        node = nodes[nid]
+        clone = node.__class__.__new__(node.__class__)
+        clone.__dict__.update(node.__dict__)
+        if isinstance(node, NODE):
+            clone.children = list(node.children)
+            clone.tokens = list(node.tokens)
+        signals = []
+        for sig in node.signals:
+            sig_clone = SIGNAL.__new__(SIGNAL)
+            sig_clone.__dict__.update(sig.__dict__)
+            signals.append(sig_clone)
+        clone.signals = signals
+        output[nid] = clone
+    return output
+
+
+def set_parse_cache_size(maxsize):
+    """
+    Set the number of parsed documents kept by read_rst in this process; 0 disables the cache
+    """
+    _parse_cache.maxsize = maxsize
+    while len(_parse_cache.entries) > max(maxsize, 0):
+        _parse_cache.entries.popitem(last=False)
+
+
+def get_parse_cache_stats():
+    """
+    :return: dictionary with hits, misses, hit_rate, size and maxsize of the read_rst cache in this process
+    """
+    return _parse_cache.stats()
+
+
+def clear_parse_cache():
+    _parse_cache.clear()
+
+
 def read_rst(data, rel_hash, as_text=False):
+    """
+    Read an .rs3/.rs4 document into a dictionary of NODE objects, and SECEDGE objects for secondary edges
+
+    Repeated calls with the same document text and rel_hash are served from an LRU cache of parsed trees, see
+    ParseCache; rel_hash is updated with the document's relations either way.
+
+    :param data: path to an .rs3 or .rs4 file, optionally compressed, or a string containing the document if as_text is True
+    :param rel_hash: dictionary of relation names with type suffixes to relation types, updated from the document header
+    :return: dictionary of node ID -> NODE or SECEDGE, or an error message string for invalid input
+    """
     if not as_text:
-        data = io.open(data, encoding="utf8").read()
+        with open_file(data) as f:
+            data = f.read()
+    if _parse_cache.maxsize <= 0:
+        return parse_rst(data, rel_hash)
+    key = ParseCache.make_key(data, rel_hash)
+    cached = _parse_cache.get(key)
+    if cached is not None:
+        nodes, rels = cached
+        rel_hash.update(rels)
+        return nodes
+    nodes = parse_rst(data, rel_hash)
+    if not isinstance(nodes, str):
+        _parse_cache.put(key, nodes, rel_hash)
+    return nodes
+
+
+def parse_rst(data, rel_hash):
     try:
         xmldoc = minidom.parseString(data)
     except ExpatError:
@@ -367,13 +564,8 @@ def read_rst(data, rel_hash, as_text=False):
     for row in nodes:
         elements[row[0]] = NODE(row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7], "")
 
-    for element in elements:
-        if elements[element].kind == "edu":
-            get_left_right(element, elements, 0, 0, rel_hash)
-
-    for element in elements:
-        node = elements[element]
-        get_depth(node,node,elements)
+    get_left_right(elements, rel_hash)
+    get_depth(elements)
 
     for nid in elements:
         node = elements[nid]
@@ -428,45 +620,79 @@ def read_rst(data, rel_hash, as_text=False):
     return elements
 
 
-def get_left_right(node_id, nodes, min_left, max_right, rel_hash):
+def get_left_right(nodes, rel_hash):
     """
-    Calculate leftmost and rightmost EDU covered by a NODE object. For EDUs this is the number of the EDU
-    itself. For spans and multinucs, the leftmost and rightmost child dominated by the NODE is found recursively.
+    Calculate leftmost and rightmost EDU covered by each NODE object. For EDUs this is the number of the EDU
+    itself. For spans and multinucs, these are the leftmost and rightmost EDUs dominated by their span or multinuc
+    children, including any satellites of those children.
+
+    Nodes are visited children first using an explicit stack, so arbitrarily deep trees are supported.
     """
-    if nodes[node_id].parent != "0" and node_id != "0":
-        parent = nodes[nodes[node_id].parent]
-        if min_left > nodes[node_id].left or min_left == 0:
-            if nodes[node_id].left != 0:
-                min_left = nodes[node_id].left
-        if max_right < nodes[node_id].right or max_right == 0:
-            max_right = nodes[node_id].right
-        if nodes[node_id].relname == "span":
-            if parent.left > min_left or parent.left == 0:
-                parent.left = min_left
-            if parent.right < max_right:
-                parent.right = max_right
-        elif nodes[node_id].relname in rel_hash:
-            if parent.kind == "multinuc" and rel_hash[nodes[node_id].relname] =="multinuc":
-                if parent.left > min_left or parent.left == 0:
-                    parent.left = min_left
-                if parent.right < max_right:
-                    parent.right = max_right
-        get_left_right(parent.id, nodes, min_left, max_right, rel_hash)
-
-
-def get_depth(orig_node, probe_node, nodes):
+    children = collections.defaultdict(list)
+    for nid in nodes:
+        children[nodes[nid].parent].append(nid)
+
+    order = []
+    stack = list(children["0"])
+    while len(stack) > 0:
+        nid = stack.pop()
+        order.append(nid)
+        stack.extend(children[nid])
+
+    sub_left = {}  # Leftmost and rightmost EDU in the entire subtree of each node, including satellites
+    sub_right = {}
+    for nid in reversed(order):  # Children before parents
+        node = nodes[nid]
+        left = node.left if node.kind == "edu" else 0
+        right = node.right if node.kind == "edu" else 0
+        for child_id in children[nid]:
+            if sub_right[child_id] == 0:  # No EDUs below this child
+                continue
+            child_left = sub_left[child_id]
+            child_right = sub_right[child_id]
+            if left == 0 or child_left < left:
+                left = child_left
+            if child_right > right:
+                right = child_right
+            child = nodes[child_id]
+            if child.relname == "span" or (child.relname in rel_hash and node.kind == "multinuc" and rel_hash[child.relname] == "multinuc"):
+                if node.left == 0 or child_left < node.left:
+                    node.left = child_left
+                if node.right < child_right:
+                    node.right = child_right
+        sub_left[nid] = left
+        sub_right[nid] = right
+
+
+def get_depth(nodes):
     """
-    Calculate graphical nesting depth of a node based on the node list graph.
+    Calculate graphical nesting depth of each node based on the node list graph.
     Note that RST parentage without span/multinuc does NOT increase depth.
+
+    Depths are accumulated from the root down, reusing the depth of each node's parent once it is known.
     """
-    if probe_node.parent != "0":
-        parent = nodes[probe_node.parent]
-        if parent.kind != "edu" and (probe_node.relname == "span" or parent.kind == "multinuc" and probe_node.relkind =="multinuc"):
-            orig_node.depth += 1
-            orig_node.sortdepth +=1
-        elif parent.kind == "edu":
-            orig_node.sortdepth += 1
-        get_depth(orig_node, parent, nodes)
+    depth = {"0": 0}
+    sortdepth = {"0": 0}
+    for nid in nodes:
+        path = []
+        probe = nid
+        while probe not in depth:
+            path.append(probe)
+            probe = nodes[probe].parent
+        for probe_id in reversed(path):
+            probe_node = nodes[probe_id]
+            depth[probe_id] = depth[probe_node.parent]
+            sortdepth[probe_id] = sortdepth[probe_node.parent]
+            if probe_node.parent != "0":
+                parent = nodes[probe_node.parent]
+                if parent.kind != "edu" and (probe_node.relname == "span" or parent.kind == "multinuc" and probe_node.relkind == "multinuc"):
+                    depth[probe_id] += 1
+                    sortdepth[probe_id] += 1
+                elif parent.kind == "edu":
+                    sortdepth[probe_id] += 1
+    for nid in nodes:
+        nodes[nid].depth += depth[nid]
+        nodes[nid].sortdepth += sortdepth[nid]
 
 
 def determinstic_groups(nodes):
@@ -482,6 +708,8 @@ def determinstic_groups(nodes):
             if parent not in id_map:
                 max_id += 1
                 id_map[str(parent)] = str(max_id)
+            elif nodes[parent].kind != "edu":  # All ancestors of an already mapped group are mapped too
+                break
             parent = nodes[parent].parent
     return id_map
 
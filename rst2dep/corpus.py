@@ -0,0 +1,295 @@
+"""
+corpus.py
+
+Compact binary storage for parsed RST documents. The NODE and SECEDGE dictionaries returned by read_rst for a whole
+corpus are stored as typed NumPy arrays in a single uncompressed .npz file: node IDs, parents, relations, left/right
+EDU spans, depths, children, signals and secondary edges, with all strings in one UTF-8 string table and EDU text as
+offsets into one text blob. Files are loaded without pickle, and loading is much faster than parsing .rs3 XML.
+Example usage:
+
+python corpus.py save gum.corpus.npz "rst/*.rs3"
+python corpus.py info gum.corpus.npz
+"""
+
+import io, os, sys, gc
+from glob import glob
+from argparse import ArgumentParser
+import numpy as np
+try:
+    from .classes import NODE, SECEDGE, SIGNAL, read_rst, open_file, get_docname, split_compression
+    from .dep2rst import rsd2rs3, conllu2rsd
+except ImportError:
+    from classes import NODE, SECEDGE, SIGNAL, read_rst, open_file, get_docname, split_compression
+    from dep2rst import rsd2rs3, conllu2rsd
+
+FORMAT_MAGIC = "rst2dep-corpus"
+FORMAT_VERSION = 1
+
+NODE_STRING_FIELDS = ["id", "parent", "kind", "relname", "relkind", "leftmost_child", "dep_parent", "dep_rel"]
+NODE_INT_FIELDS = ["left", "right", "depth", "sortdepth", "dist", "domain"]
+SIGNAL_FIELDS = ["type", "subtype", "tokens", "status"]
+
+
+class StringTable:
+    """
+    Interned strings, stored as one UTF-8 blob with character offsets
+    """
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def add(self, string):
+        if string not in self.ids:
+            self.ids[string] = len(self.strings)
+            self.strings.append(string)
+        return self.ids[string]
+
+    def to_arrays(self):
+        offsets = np.zeros(len(self.strings) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(s) for s in self.strings], dtype=np.int64)
+        return np.frombuffer("".join(self.strings).encode("utf8"), dtype=np.uint8), offsets
+
+
+def unpack_strings(blob, offsets):
+    text = blob.tobytes().decode("utf8")
+    offsets = offsets.tolist()
+    return [text[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def read_document(data):
+    """
+    :param data: path to an .rs3, .rs4, .rsd or .conllu file, optionally compressed
+    :return: tuple of the read_rst nodes and relation dictionary of the document
+    """
+    base = split_compression(data)[0]
+    if base.endswith((".rsd", ".conllu")):
+        with open_file(data) as f:
+            rsd = f.read()
+        data = rsd2rs3(conllu2rsd(rsd) if base.endswith(".conllu") else rsd)
+    else:
+        with open_file(data) as f:
+            data = f.read()
+    rel_hash = {}
+    nodes = read_rst(data, rel_hash, as_text=True)
+    if isinstance(nodes, str):
+        raise IOError(nodes)
+    return nodes, rel_hash
+
+
+def get_relations(nodes):
+    """
+    :return: relation dictionary in the format of read_rst's rel_hash, inferred from relation suffixes in nodes
+    """
+    rel_hash = {}
+    for nid in nodes:
+        relname = nodes[nid].relname
+        if relname.endswith("_r"):
+            rel_hash[relname] = "rst"
+        elif relname.endswith("_m"):
+            rel_hash[relname] = "multinuc"
+    return rel_hash
+
+
+def save_corpus(docs, path):
+    """
+    Write parsed documents to a binary corpus file
+
+    :param docs: dictionary or iterable of (docname, document) pairs; each document is a dictionary of nodes from
+                 read_rst, a tuple of such nodes and their rel_hash, or a path to an .rs3, .rs4, .rsd or .conllu file
+    :param path: output file, written atomically; by convention ending in .npz
+    :return: number of documents written
+    """
+    if isinstance(docs, dict):
+        docs = docs.items()
+    strings = StringTable()
+    text = StringTable()
+    doc_names = []
+    seen = set()
+    doc_nodes = [0]
+    doc_secedges = [0]
+    doc_rels = [0]
+    node_cols = {field: [] for field in NODE_STRING_FIELDS + NODE_INT_FIELDS}
+    node_text = []
+    children = []
+    node_children = [0]
+    secedge_cols = {"source": [], "target": [], "relname": []}
+    signal_cols = {field: [] for field in SIGNAL_FIELDS}
+    secedge_signal_cols = {field: [] for field in SIGNAL_FIELDS}
+    node_signals = [0]
+    secedge_signals = [0]
+    rel_names = []
+    rel_types = []
+
+    for docname, doc in docs:
+        if isinstance(doc, str):
+            nodes, rel_hash = read_document(doc)
+        elif isinstance(doc, tuple):
+            nodes, rel_hash = doc
+        else:
+            nodes, rel_hash = doc, get_relations(doc)
+        if docname in seen:
+            raise IOError("Duplicate document name " + docname + " in corpus\n")
+        seen.add(docname)
+        doc_names.append(strings.add(docname))
+        for nid in nodes:
+            node = nodes[nid]
+            if node.kind == "secedge":
+                secedge_cols["source"].append(strings.add(node.source))
+                secedge_cols["target"].append(strings.add(node.target))
+                secedge_cols["relname"].append(strings.add(node.relname))
+                cols, offsets = secedge_signal_cols, secedge_signals
+            else:
+                for field in NODE_STRING_FIELDS:
+                    node_cols[field].append(strings.add(getattr(node, field)))
+                for field in NODE_INT_FIELDS:
+                    node_cols[field].append(getattr(node, field))
+                node_text.append(text.add(node.text))
+                children += [strings.add(child) for child in node.children]
+                node_children.append(len(children))
+                cols, offsets = signal_cols, node_signals
+            for sig in node.signals:
+                for field in SIGNAL_FIELDS:
+                    cols[field].append(strings.add(getattr(sig, field)))
+            offsets.append(len(cols["type"]))
+        for rel in rel_hash:
+            rel_names.append(strings.add(rel))
+            rel_types.append(strings.add(rel_hash[rel]))
+        doc_nodes.append(len(node_text))
+        doc_secedges.append(len(secedge_cols["source"]))
+        doc_rels.append(len(rel_names))
+
+    arrays = {"magic": np.array(list(FORMAT_MAGIC.encode("ascii")), dtype=np.uint8),
+              "version": np.array([FORMAT_VERSION], dtype=np.int32)}
+    arrays["strings"], arrays["string_offsets"] = strings.to_arrays()
+    arrays["text"], arrays["text_offsets"] = text.to_arrays()
+    arrays["doc_names"] = np.array(doc_names, dtype=np.int32)
+    arrays["doc_nodes"] = np.array(doc_nodes, dtype=np.int64)
+    arrays["doc_secedges"] = np.array(doc_secedges, dtype=np.int64)
+    arrays["doc_rels"] = np.array(doc_rels, dtype=np.int64)
+    for field in NODE_STRING_FIELDS:
+        arrays["node_" + field] = np.array(node_cols[field], dtype=np.int32)
+    for field in NODE_INT_FIELDS:
+        arrays["node_" + field] = np.array(node_cols[field], dtype=np.int32)
+    arrays["node_text"] = np.array(node_text, dtype=np.int32)
+    arrays["node_children"] = np.array(node_children, dtype=np.int64)
+    arrays["children"] = np.array(children, dtype=np.int32)
+    arrays["node_signals"] = np.array(node_signals, dtype=np.int64)
+    arrays["secedge_signals"] = np.array(secedge_signals, dtype=np.int64)
+    for field in secedge_cols:
+        arrays["secedge_" + field] = np.array(secedge_cols[field], dtype=np.int32)
+    for field in SIGNAL_FIELDS:
+        arrays["signal_" + field] = np.array(signal_cols[field], dtype=np.int32)
+        arrays["secedge_signal_" + field] = np.array(secedge_signal_cols[field], dtype=np.int32)
+    arrays["rel_names"] = np.array(rel_names, dtype=np.int32)
+    arrays["rel_types"] = np.array(rel_types, dtype=np.int32)
+
+    tmp_file = path + ".tmp"
+    try:
+        with io.open(tmp_file, "wb") as f:
+            np.savez(f, **arrays)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    os.replace(tmp_file, path)
+    return len(doc_names)
+
+
+def make_signals(cols, start, end):
+    signals = []
+    for i in range(start, end):
+        sig = SIGNAL.__new__(SIGNAL)
+        sig.__dict__.update({field: cols[field][i] for field in SIGNAL_FIELDS})
+        signals.append(sig)
+    return signals
+
+
+def load_corpus(path, rel_hash=None, docnames=None):
+    """
+    Read a binary corpus file written by save_corpus
+
+    :param path: corpus file
+    :param rel_hash: optional dictionary which is updated with the relations of the loaded documents, as in read_rst
+    :param docnames: optional collection of document names to load (default: all)
+    :return: dictionary of docname -> dictionary of node ID -> NODE or SECEDGE, in the order the documents were saved
+    """
+    try:
+        data = np.load(path, allow_pickle=False)
+    except (ValueError, OSError) as e:
+        raise IOError("Cannot read corpus file " + path + ": " + str(e) + "\n")
+    with data:
+        if "magic" not in data.files or data["magic"].tobytes() != FORMAT_MAGIC.encode("ascii"):
+            raise IOError(path + " is not an rst2dep corpus file\n")
+        version = int(data["version"][0])
+        if version > FORMAT_VERSION:
+            raise IOError(path + " has corpus format version " + str(version) + ", but this rst2dep version reads up to "
+                          + str(FORMAT_VERSION) + "\n")
+        strings = unpack_strings(data["strings"], data["string_offsets"])
+        texts = unpack_strings(data["text"], data["text_offsets"])
+        cols = {name: data[name].tolist() for name in data.files if name not in ["strings", "string_offsets", "text", "text_offsets"]}
+
+    def lookup(name):
+        return [strings[i] for i in cols[name]]
+
+    gc_enabled = gc.isenabled()
+    gc.disable()  # Creating many small objects at once would otherwise trigger repeated collections
+    try:
+        node_fields = NODE_STRING_FIELDS + NODE_INT_FIELDS + ["text"]
+        node_rows = list(zip(*([lookup("node_" + field) for field in NODE_STRING_FIELDS] +
+                               [cols["node_" + field] for field in NODE_INT_FIELDS] + [[texts[i] for i in cols["node_text"]]])))
+        children = lookup("children")
+        child_offsets = cols["node_children"]
+        signals = {field: lookup("signal_" + field) for field in SIGNAL_FIELDS}
+        signal_offsets = cols["node_signals"]
+        secedge_signals = {field: lookup("secedge_signal_" + field) for field in SIGNAL_FIELDS}
+        secedges = {field: lookup("secedge_" + field) for field in ["source", "target", "relname"]}
+
+        corpus = {}
+        for d, docname in enumerate(lookup("doc_names")):
+            if docnames is not None and docname not in docnames:
+                continue
+            nodes = {}
+            for i in range(cols["doc_nodes"][d], cols["doc_nodes"][d + 1]):
+                node = NODE.__new__(NODE)
+                fields = dict(zip(node_fields, node_rows[i]))
+                fields["token_count"] = fields["text"].count(" ") + 1
+                fields["children"] = children[child_offsets[i]:child_offsets[i + 1]]
+                fields["tokens"] = []
+                fields["parse"] = ""
+                start, end = signal_offsets[i], signal_offsets[i + 1]
+                fields["signals"] = make_signals(signals, start, end) if end > start else []
+                node.__dict__ = fields
+                nodes[fields["id"]] = node
+            for i in range(cols["doc_secedges"][d], cols["doc_secedges"][d + 1]):
+                secedge = SECEDGE(secedges["source"][i], secedges["target"][i], secedges["relname"][i],
+                                  make_signals(secedge_signals, cols["secedge_signals"][i], cols["secedge_signals"][i + 1]))
+                secedge.kind = "secedge"
+                nodes[secedge.id] = secedge
+            if rel_hash is not None:
+                for i in range(cols["doc_rels"][d], cols["doc_rels"][d + 1]):
+                    rel_hash[strings[cols["rel_names"][i]]] = strings[cols["rel_types"][i]]
+            corpus[docname] = nodes
+        return corpus
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+if __name__ == "__main__":
+    p = ArgumentParser(description="Store parsed .rs3/.rs4/.rsd/.conllu documents in a binary corpus file, or list its contents")
+    p.add_argument("command", choices=["save", "info"], help="save documents to a corpus file, or list the documents in one")
+    p.add_argument("corpus", help="binary corpus file, e.g. gum.corpus.npz")
+    p.add_argument("files", nargs="*", help="input files or glob patterns for the save command")
+    opts = p.parse_args()
+
+    if opts.command == "save":
+        files = []
+        for pattern in opts.files:
+            files += sorted(glob(pattern)) if "*" in pattern else [pattern]
+        n_docs = save_corpus(((get_docname(f), f) for f in files), opts.corpus)
+        sys.stderr.write("o Saved " + str(n_docs) + " documents to " + opts.corpus + "\n")
+    else:
+        for docname, nodes in load_corpus(opts.corpus).items():
+            edus = sum(1 for n in nodes.values() if n.kind == "edu")
+            secedges = sum(1 for n in nodes.values() if n.kind == "secedge")
+            print(docname + "\t" + str(edus) + " EDUs\t" + str(len(nodes) - secedges) + " nodes\t" + str(secedges) + " secedges")
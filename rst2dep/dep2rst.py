@@ -42,12 +42,16 @@ Input format - .conllu:
 
 """
 
-import io, sys, os
+import io, sys, os, zipfile, tarfile
 from argparse import ArgumentParser
 try:
-    from classes import NODE, make_deterministic_nodes, rangify, unrangify
+    from classes import NODE, make_deterministic_nodes, rangify, unrangify, bounded_imap, open_file, get_docname
+    from profiling import tick, tock
+    from docindex import DocumentIndex
 except:
-    from .classes import NODE, make_deterministic_nodes, rangify, unrangify
+    from .classes import NODE, make_deterministic_nodes, rangify, unrangify, bounded_imap, open_file, get_docname
+    from .profiling import tick, tock
+    from .docindex import DocumentIndex
 from collections import defaultdict
 import re
 
@@ -142,6 +146,162 @@ def conllu2rsd(conllu):
     return "\n".join(edus) + "\n"
 
 
+def iter_conllu_docs(conllu):
+    """
+    Lazily split multi-document conllu data at '# newdoc id = ...' comment lines
+
+    :param conllu: path to a conllu file, optionally compressed, an open file object, an iterable of lines, or a conllu string
+    :return: generator of (docname, conllu_string) tuples; docname is None if the document has no newdoc comment
+    """
+    close = False
+    if isinstance(conllu, str):
+        if "\n" in conllu:
+            conllu = io.StringIO(conllu)
+        else:
+            conllu = open_file(conllu)
+            close = True
+
+    docname = None
+    lines = []
+    try:
+        for line in conllu:
+            line = line.rstrip("\r\n")
+            if line.startswith("# newdoc id"):
+                if any("\t" in l for l in lines):
+                    yield docname, "\n".join(lines) + "\n"
+                lines = []
+                docname = line.split("=", 1)[1].strip()
+            lines.append(line)
+        if any("\t" in l for l in lines):
+            yield docname, "\n".join(lines) + "\n"
+    finally:
+        if close:
+            conllu.close()
+
+
+BUNDLE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+
+def is_bundle(path):
+    return isinstance(path, str) and "\n" not in path and path.endswith(BUNDLE_EXTENSIONS)
+
+
+def iter_bundle_docs(path):
+    """
+    Read the documents in a .zip or .tar bundle with one file per document, e.g. written by the --concat output mode
+
+    :param path: path to a .zip, .tar, .tar.gz, .tgz, .tar.bz2 or .tar.xz file
+    :return: generator of (docname, text) tuples in archive order; document names are the member file names without
+             extensions
+    """
+    if path.endswith(".zip"):
+        with zipfile.ZipFile(path) as bundle:
+            for name in bundle.namelist():
+                if not name.endswith("/"):
+                    yield get_docname(name), bundle.read(name).decode("utf8")
+    else:
+        with tarfile.open(path) as bundle:
+            for member in bundle:
+                if member.isfile():
+                    yield get_docname(member.name), bundle.extractfile(member).read().decode("utf8")
+
+
+def iter_documents(data):
+    """
+    :param data: a .zip/.tar bundle path, a DocumentIndex, or anything accepted by iter_conllu_docs, e.g. a conllu or
+                 rsd stream with '# newdoc id' comments
+    :return: generator of (docname, document string) tuples
+    """
+    if isinstance(data, DocumentIndex):
+        return data.items()
+    if is_bundle(data):
+        return iter_bundle_docs(data)
+    return iter_conllu_docs(data)
+
+
+def _convert_dep_doc(job):
+    docname, doc, input_format, to_rs3, ordering, check_projective = job
+    rsd = conllu2rsd(doc) if input_format == "conllu" else doc
+    if check_projective:
+        crossing = find_crossing_edges(rsd)
+        if len(crossing) > 0:
+            sys.stderr.write("! Skipping non-projective document " + str(docname) + ": " + format_crossing(crossing) + "\n")
+            return docname, None
+    if to_rs3:
+        return docname, rsd2rs3(rsd, ordering=ordering)
+    return docname, rsd
+
+
+def stream_conllu2rsd(conllu, to_rs3=False, ordering="dist", processes=1, check_projective=False):
+    """
+    Convert multi-document conllu to one rsd (or rs3) per document, holding only a few documents in memory at a time
+
+    :param conllu: anything accepted by iter_documents, e.g. a path to a large conllu split file or a bundle
+    :param to_rs3: if True, also run rsd2rs3 on each document and yield .rs3 strings
+    :param ordering: depth ordering for rsd2rs3, one of {dist,ltr,rtl}
+    :param processes: number of worker processes to convert documents in parallel
+    :param check_projective: if True, non-projective documents are not converted and yield None as output
+    :return: generator of (docname, output) tuples in input order
+    """
+    jobs = ((docname, doc, "conllu", to_rs3, ordering, check_projective) for docname, doc in iter_documents(conllu))
+    for result in bounded_imap(_convert_dep_doc, jobs, processes=processes):
+        yield result
+
+
+def stream_rsd2rs3(rsd, ordering="dist", processes=1, check_projective=False):
+    """
+    Convert multi-document rsd, i.e. rsd documents each preceded by a '# newdoc id' comment or a bundle of .rsd files,
+    to one .rs3 per document
+
+    :param rsd: anything accepted by iter_documents
+    :return: generator of (docname, rs3) tuples in input order; see stream_conllu2rsd
+    """
+    jobs = ((docname, doc, "rsd", True, ordering, check_projective) for docname, doc in iter_documents(rsd))
+    for result in bounded_imap(_convert_dep_doc, jobs, processes=processes):
+        yield result
+
+
+def get_edges(rsd):
+    """
+    :return: list of (dependent, head) EDU number tuples in an rsd string; the root has head 0
+    """
+    edges = []
+    for line in rsd.split("\n"):
+        if "\t" in line:
+            fields = line.split("\t")
+            edges.append((int(fields[0]), int(fields[6])))
+    return edges
+
+
+def find_crossing_edges(rsd):
+    """
+    Find crossing dependency edges in O(n log n), treating the root as attached to a virtual node 0 left of all EDUs
+
+    Edges are swept in order of their left end, keeping a stack of open, properly nested edges. An edge which
+    crosses the innermost open edge is reported together with that edge and left out of the sweep, so each
+    non-projective edge is listed once and the remaining edges are projective.
+
+    :param rsd: rsd string, or a list of (dependent, head) tuples
+    :return: list of pairs of crossing edges as ((dependent, head), (dependent, head)); empty if the tree is projective
+    """
+    edges = get_edges(rsd) if isinstance(rsd, str) else rsd
+    arcs = sorted(((min(dep, head), max(dep, head), (dep, head)) for dep, head in edges), key=lambda x: (x[0], -x[1]))
+    stack = []
+    crossing = []
+    for left, right, edge in arcs:
+        while len(stack) > 0 and stack[-1][1] <= left:
+            stack.pop()
+        if len(stack) > 0 and stack[-1][1] < right:
+            crossing.append((edge, stack[-1][2]))
+            continue
+        stack.append((left, right, edge))
+    return crossing
+
+
+def format_crossing(crossing):
+    return ", ".join(str(a[0]) + "->" + str(a[1]) + " x " + str(b[0]) + "->" + str(b[1]) for a, b in crossing)
+
+
 def xml_escape(edu_contents):
     return edu_contents.replace("&","&amp;").replace(">","&gt;").replace("<","&lt;")
 
@@ -163,9 +323,24 @@ def determinstic_groups(nodes):
     return id_map
 
 
-def rsd2rs3(rsd, ordering="dist", default_rels=False, strict=True, default_sigs=False):
+def rsd2rs3(rsd, ordering="dist", default_rels=False, strict=True, default_sigs=False, check_projective=False):
+    """
+    Convert an rsd dependency string to an .rs3 constituent tree
+
+    :param ordering: how to order depth, one of {dist,ltr,rtl}
+    :param default_rels: use DEFAULT_RELATIONS for the .rs3 header instead of rels in input data
+    :param strict: exit on relations not in DEFAULT_RELATIONS if default_rels is True, otherwise treat them as spans
+    :param default_sigs: use DEFAULT_SIGNALS for the .rs3 header
+    :param check_projective: raise an IOError listing crossing edges before conversion if the input is non-projective
+    :return: .rs3 string
+    """
     global sigmap
 
+    t0 = t = tick()
+    if check_projective:
+        crossing = find_crossing_edges(rsd)
+        if len(crossing) > 0:
+            raise IOError("! non-projective rsd cannot be converted, crossing edges: " + format_crossing(crossing))
     nodes = {}
     if default_rels:
         rels = DEFAULT_RELATIONS
@@ -191,9 +366,10 @@ def rsd2rs3(rsd, ordering="dist", default_rels=False, strict=True, default_sigs=
             signals = []
             all_tokens += fields[1].split(" ")
             if fields[8] != "_":  # Secedges
-                dep_target, secrel, src_height, target_height, sec_signals = fields[8].split(":")
-                sec_signals = sec_signals.split(";")
-                secedges.append({"trg": dep_target, "src": eid, "rel": secrel, "src_height": src_height, "trg_height": target_height, "signals": sec_signals})
+                for secedge in fields[8].split("|"):
+                    dep_target, secrel, src_height, target_height, sec_signals = secedge.split(":")
+                    sec_signals = sec_signals.split(";") if sec_signals != "_" else []
+                    secedges.append({"trg": dep_target, "src": eid, "rel": secrel, "src_height": src_height, "trg_height": target_height, "signals": sec_signals})
             if fields[-1] != "_":
                 # Values like: dm-but-70-gold;semantic-lexical_chain-72-73,85-_;graphical-layout-_-_
                 sigs = fields[-1].split(";")
@@ -218,6 +394,8 @@ def rsd2rs3(rsd, ordering="dist", default_rels=False, strict=True, default_sigs=
             if head != "0":
                 childmap[int(head)].add(int(eid))
             max_id += 1
+    n_edus = max_id
+    t = tock("rsd2rs3/parse", t)
 
     # Compute path lengths to root
     for nid in nodes:
@@ -232,6 +410,7 @@ def rsd2rs3(rsd, ordering="dist", default_rels=False, strict=True, default_sigs=
             if path_length > 1000:
                 raise IOError("! path_length exceeds 1000 in graph (cyclical dependency for unit "+str(p)+"?)\n" + rsd)
         nodes[nid].depth = path_length
+    t = tock("rsd2rs3/depth", t)
 
     # Add deterministic ordering prioritizing right or left children, if desired
     left_children = [n for n in sorted(nodes,key=lambda x: nodes[x].parent-nodes[x].left) if nodes[n].parent > nodes[n].id]
@@ -299,6 +478,7 @@ def rsd2rs3(rsd, ordering="dist", default_rels=False, strict=True, default_sigs=
             parent.relkind = "multinuc"
             parent.relname = node.relname
             done.add(parent.id)
+    t = tock("rsd2rs3/build_tree", t)
 
     # Build header
     header = "<rst>\n\t<header>\n\t\t<relations>\n"
@@ -350,8 +530,8 @@ def rsd2rs3(rsd, ordering="dist", default_rels=False, strict=True, default_sigs=
 
     edus_out = []
     for edu in sorted(edus, key=lambda x:x.id):
-        if edu.parent == 0:
-            seg = '\t\t<segment id="' + str(edu.id) + '"/>'
+        if edu.parent == 0:  # Unattached EDU, e.g. a single-EDU document
+            seg = '\t\t<segment id="' + str(edu.id) + '">' + xml_escape(edu.text) + '</segment>'
         else:
             seg = '\t\t<segment id="'+str(edu.id)+'" parent="'+str(id_map[edu.parent])+'" relname="'+edu.relname+'">'+xml_escape(edu.text)+'</segment>'
         edus_out.append(seg)
@@ -399,8 +579,12 @@ def rsd2rs3(rsd, ordering="dist", default_rels=False, strict=True, default_sigs=
 
     output = header + "\n".join(edus_out) + "\n" + "\n".join(groups_out) + secedges_out + signals_out + "\n\t</body>\n</rst>\n"
 
+    t = tock("rsd2rs3/serialize", t)
+
     # Ensure deterministic node numbering
     output = make_deterministic_nodes(output)
+    tock("rsd2rs3/deterministic_ids", t)
+    tock("rsd2rs3", t0, edus=n_edus)
 
     return output
 
@@ -0,0 +1,181 @@
+"""
+docindex.py
+
+Random access to documents in large multi-document .rsd and .conllu files, in which each document starts with a
+'# newdoc id = ...' comment, e.g. as written with --concat. An offset index mapping document names to byte offsets and
+lengths is built in one pass and stored in a sidecar file next to the data (<file>.idx); the data file is then
+memory-mapped, so that single documents are returned without reading the rest of the file. Example usage:
+
+python docindex.py build corpus.conllu
+python docindex.py get corpus.conllu GUM_news_worship
+"""
+
+import io, os, re, sys, mmap
+from argparse import ArgumentParser
+try:
+    from .classes import split_compression
+    from .batch import atomic_open
+except ImportError:
+    from classes import split_compression
+    from batch import atomic_open
+
+INDEX_EXT = ".idx"
+INDEX_VERSION = 1
+NEWDOC = re.compile(rb'^# newdoc id\s*=\s*(.*?)\s*$', re.MULTILINE)
+
+# Open indexes by absolute data file path, see get_document_index
+_indexes = {}
+
+
+def get_index_path(path):
+    return path + INDEX_EXT
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return str(stat.st_size) + "\t" + str(stat.st_mtime_ns)
+
+
+def build_offset_index(data, default_name=None):
+    """
+    Find the documents in multi-document rsd or conllu data in one pass
+
+    :param data: bytes or memory-mapped file contents
+    :param default_name: name for content before the first '# newdoc id' comment, if it contains any tab-separated rows
+    :return: list of (docname, byte offset, byte length) tuples in file order
+    """
+    starts = [(m.group(1).decode("utf8"), m.start()) for m in NEWDOC.finditer(data)]
+    first = starts[0][1] if len(starts) > 0 else len(data)
+    if first > 0 and b"\t" in data[:first]:
+        starts.insert(0, (default_name, 0))
+    ends = [offset for _, offset in starts[1:]] + [len(data)]
+    return [(docname, offset, end - offset) for (docname, offset), end in zip(starts, ends)]
+
+
+class DocumentIndex:
+    """
+    Memory-mapped multi-document .rsd or .conllu file with an offset index for O(1) access to single documents
+
+    The sidecar index <path>.idx is used if it matches the size and modification time of the data file; otherwise the
+    index is rebuilt and the sidecar rewritten (if the directory is writable). Documents are returned as strings which
+    can be passed to conllu2rsd, rsd2rs3 or the evaluation functions.
+
+    :param path: uncompressed multi-document file
+    :param save: whether to write the sidecar index after building it
+    """
+    def __init__(self, path, save=True):
+        if split_compression(path)[1] != "":
+            raise IOError("Cannot memory-map compressed file " + path + ", decompress it to build an offset index\n")
+        self.path = path
+        self.file = io.open(path, "rb")
+        size = os.path.getsize(path)
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b""
+        self.offsets = {}
+        self.order = []
+        entries = self.load_index()
+        if entries is None:
+            entries = build_offset_index(self.data, default_name=os.path.basename(split_compression(path)[0]).rsplit(".", 1)[0])
+            if save:
+                self.save_index(entries)
+        for docname, offset, length in entries:
+            if docname in self.offsets:
+                sys.stderr.write("! Duplicate document " + docname + " in " + path + ", keeping the first one\n")
+                continue
+            self.offsets[docname] = (offset, length)
+            self.order.append(docname)
+
+    def load_index(self):
+        index_path = get_index_path(self.path)
+        if not os.path.exists(index_path):
+            return None
+        with io.open(index_path, encoding="utf8") as f:
+            header = f.readline().rstrip("\n").split("\t", 2)
+            if header[0] != "# rst2dep offset index v" + str(INDEX_VERSION) or header[1:] != file_signature(self.path).split("\t"):
+                return None
+            entries = []
+            for line in f:
+                docname, offset, length = line.rstrip("\n").rsplit("\t", 2)
+                entries.append((docname, int(offset), int(length)))
+        return entries
+
+    def save_index(self, entries):
+        try:
+            with atomic_open(get_index_path(self.path)) as f:
+                f.write("# rst2dep offset index v" + str(INDEX_VERSION) + "\t" + file_signature(self.path) + "\n")
+                for docname, offset, length in entries:
+                    f.write(docname + "\t" + str(offset) + "\t" + str(length) + "\n")
+        except (IOError, OSError):
+            sys.stderr.write("! Could not write offset index for " + self.path + "\n")
+
+    def __getitem__(self, docname):
+        offset, length = self.offsets[docname]
+        return self.data[offset:offset + length].decode("utf8")
+
+    def __contains__(self, docname):
+        return docname in self.offsets
+
+    def __len__(self):
+        return len(self.order)
+
+    def docnames(self):
+        """
+        :return: list of document names in file order
+        """
+        return list(self.order)
+
+    def items(self):
+        """
+        :return: generator of (docname, document string) tuples in file order, like iter_conllu_docs
+        """
+        for docname in self.order:
+            yield docname, self[docname]
+
+    def close(self):
+        if not isinstance(self.data, bytes):
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def get_document_index(path):
+    """
+    :return: an open DocumentIndex for path, shared by all callers in this process until the file changes
+    """
+    key = os.path.abspath(path)
+    index = _indexes.get(key)
+    if index is not None and index.signature != file_signature(path):
+        index.close()
+        index = None
+    if index is None:
+        index = DocumentIndex(path)
+        index.signature = file_signature(path)
+        _indexes[key] = index
+    return index
+
+
+if __name__ == "__main__":
+    p = ArgumentParser(description="Build an offset index for a multi-document .rsd or .conllu file, or print documents from it")
+    p.add_argument("command", choices=["build", "list", "get"], help="build the sidecar index, list document names, or print documents")
+    p.add_argument("file", help="multi-document .rsd or .conllu file")
+    p.add_argument("docnames", nargs="*", help="documents to print with the get command")
+    opts = p.parse_args()
+
+    if opts.command == "build" and os.path.exists(get_index_path(opts.file)):
+        os.remove(get_index_path(opts.file))
+    with DocumentIndex(opts.file) as index:
+        if opts.command == "build":
+            sys.stderr.write("o Indexed " + str(len(index)) + " documents in " + get_index_path(opts.file) + "\n")
+        elif opts.command == "list":
+            print("\n".join(index.docnames()))
+        else:
+            for docname in opts.docnames:
+                if docname not in index:
+                    sys.stderr.write("! Document " + docname + " not found in " + opts.file + "\n")
+                    continue
+                sys.stdout.write(index[docname])
@@ -0,0 +1,291 @@
+"""
+evaluate.py
+
+Scores predicted discourse parses against gold. Dependency scores (UAS, LAS and relation accuracy) are computed
+over .rsd EDUs, and RST-Parseval span, nuclearity, relation and full (nuclearity and relation) scores over
+constituent trees. Inputs can be .rsd, .conllu or .rs3/.rs4 files, which are converted as needed. Scores are
+micro-averaged over the corpus. Example usage:
+
+python evaluate.py gold_dir/ pred_dir/ -j 8
+"""
+
+import os, sys, json
+from glob import glob
+from argparse import ArgumentParser
+import numpy as np
+try:
+    from .rst2dep import make_rsd
+    from .dep2rst import rsd2rs3, conllu2rsd
+    from .classes import bounded_imap, open_file, split_compression, get_docname
+    from .validate import read_tree, get_coverage
+    from .docindex import get_document_index
+except ImportError:
+    from rst2dep import make_rsd
+    from dep2rst import rsd2rs3, conllu2rsd
+    from classes import bounded_imap, open_file, split_compression, get_docname
+    from validate import read_tree, get_coverage
+    from docindex import get_document_index
+
+DEP_METRICS = ["uas", "las", "rel"]
+PARSEVAL_METRICS = ["span", "nuclearity", "relation", "full"]
+
+
+def get_count_fields(dependencies=True, parseval=True):
+    """
+    :return: list of the per-document count names returned by evaluate_pair with these options
+    """
+    return (["edus"] + DEP_METRICS if dependencies else []) + (["gold", "pred"] + PARSEVAL_METRICS if parseval else [])
+
+
+def rel_class(label, rel_map=None):
+    """
+    Map a dependency or constituent relation label to the class compared in relation scores
+
+    Suffixes _r/_m are removed; if rel_map is given, labels are then mapped through it (unmapped labels are kept).
+    """
+    if label.endswith("_r") or label.endswith("_m"):
+        label = label[:-2]
+    if rel_map is not None:
+        label = rel_map.get(label, label)
+    return label
+
+
+def read_dependencies(rsd, rel_map=None):
+    """
+    :return: tuple of arrays of head EDU numbers and relation labels, one per EDU
+    """
+    heads = []
+    rels = []
+    for line in rsd.split("\n"):
+        if "\t" in line:
+            fields = line.split("\t")
+            heads.append(int(fields[6]))
+            rels.append(rel_class(fields[7], rel_map))
+    return np.array(heads, dtype=np.int64), np.array(rels, dtype=object)
+
+
+def get_constituents(rst_xml, rel_map=None):
+    """
+    Get RST-Parseval constituents from an RST tree
+
+    Each constituent is the EDU range dominated by a node, labeled by the topmost node covering that range, with
+    nuclearity 'S' for satellites and 'N' otherwise, and the relation of satellites and multinuc children ('span'
+    for other nuclei). The document root is excluded; every EDU is included as a leaf constituent.
+
+    :return: tuple of arrays of (first EDU, last EDU) pairs, nuclearity labels and relation labels
+    """
+    tree, _ = read_tree(rst_xml)
+    postorder, coverage = get_coverage(tree)
+    labels = {}
+    for nid in reversed(postorder):  # Parents before children, so the topmost node labels each range
+        node = tree[nid]
+        if node.parent == "0":
+            continue
+        span = coverage[nid][:2]
+        if node.relname.endswith("_r"):
+            label = ("S", rel_class(node.relname, rel_map))
+        elif node.relname.endswith("_m"):
+            label = ("N", rel_class(node.relname, rel_map))
+        else:
+            label = ("N", "span")
+        if span not in labels:
+            labels[span] = label
+    for nid in tree:
+        if tree[nid].kind == "edu":
+            edu = int(tree[nid].left)
+            if (edu, edu) not in labels:  # Nucleus EDU with its own satellites
+                labels[(edu, edu)] = ("N", "span")
+    spans = sorted(labels)
+    return np.array(spans, dtype=np.int64).reshape(-1, 2), np.array([labels[s][0] for s in spans], dtype=object), \
+           np.array([labels[s][1] for s in spans], dtype=object)
+
+
+def score_dependencies(gold_rsd, pred_rsd, rel_map=None):
+    """
+    :return: dictionary of correct counts per dependency metric and the number of EDUs
+    """
+    gold_heads, gold_rels = read_dependencies(gold_rsd, rel_map)
+    pred_heads, pred_rels = read_dependencies(pred_rsd, rel_map)
+    if len(gold_heads) != len(pred_heads):
+        raise IOError("EDU count mismatch: " + str(len(gold_heads)) + " gold vs. " + str(len(pred_heads)) + " predicted EDUs\n")
+    head_match = gold_heads == pred_heads
+    rel_match = gold_rels == pred_rels
+    return {"edus": len(gold_heads), "uas": int(head_match.sum()), "las": int((head_match & rel_match).sum()),
+            "rel": int(rel_match.sum())}
+
+
+def score_constituents(gold_rs3, pred_rs3, rel_map=None):
+    """
+    Matched spans count for nuclearity and relation independently, and for full if both labels match
+
+    :return: dictionary of matched counts per RST-Parseval metric and the numbers of gold and predicted constituents
+    """
+    gold_spans, gold_nuc, gold_rel = get_constituents(gold_rs3, rel_map)
+    pred_spans, pred_nuc, pred_rel = get_constituents(pred_rs3, rel_map)
+    n_edus = max(int(gold_spans[:, 1].max()) if len(gold_spans) > 0 else 0, int(pred_spans[:, 1].max()) if len(pred_spans) > 0 else 0) + 1
+    _, gold_idx, pred_idx = np.intersect1d(gold_spans[:, 0] * n_edus + gold_spans[:, 1],
+                                           pred_spans[:, 0] * n_edus + pred_spans[:, 1], return_indices=True)
+    nuc_match = gold_nuc[gold_idx] == pred_nuc[pred_idx]
+    rel_match = gold_rel[gold_idx] == pred_rel[pred_idx]
+    return {"gold": len(gold_spans), "pred": len(pred_spans), "span": len(gold_idx), "nuclearity": int(nuc_match.sum()),
+            "relation": int(rel_match.sum()), "full": int((nuc_match & rel_match).sum())}
+
+
+def read_input(path):
+    """
+    :param path: file path, or (path, docname) tuple for one document in a multi-document .rsd or .conllu file
+    :return: tuple of the .rsd and .rs3 representations of a gold or predicted file; each is computed only when needed
+    """
+    if isinstance(path, tuple):
+        path, docname = path
+        data = get_document_index(path)[docname]
+    else:
+        with open_file(path) as f:
+            data = f.read()
+    base = split_compression(path)[0]
+    if base.endswith(".rs3") or base.endswith(".rs4"):
+        return None, data
+    if base.endswith(".conllu"):
+        data = conllu2rsd(data)
+    return data, None
+
+
+def evaluate_pair(gold, pred, dependencies=True, parseval=True, algorithm="li", rel_map=None):
+    """
+    Score one predicted document against gold
+
+    :param gold: path to gold .rsd, .conllu, .rs3 or .rs4 file, or (path, docname) tuple, see read_input
+    :param pred: path to predicted file in any of the same formats
+    :param algorithm: dependency conversion algorithm for constituent inputs, one of {li,chain,hirao}
+    :param rel_map: optional dictionary mapping relation names to coarse classes for relation scores
+    :return: dictionary of counts
+    """
+    counts = {}
+    inputs = [read_input(gold), read_input(pred)]
+    if dependencies:
+        rsds = [rsd if rsd is not None else make_rsd(rs3, "", as_text=True, algorithm=algorithm) for rsd, rs3 in inputs]
+        counts.update(score_dependencies(rsds[0], rsds[1], rel_map))
+    if parseval:
+        trees = [rs3 if rs3 is not None else rsd2rs3(rsd) for rsd, rs3 in inputs]
+        counts.update(score_constituents(trees[0], trees[1], rel_map))
+    return counts
+
+
+def _evaluate_job(job):
+    gold, pred, kwargs, fields = job
+    doc = gold[1] if isinstance(gold, tuple) else os.path.basename(gold)
+    try:
+        counts = evaluate_pair(gold, pred, **kwargs)
+    except Exception as e:
+        return {"doc": doc, "error": type(e).__name__ + ": " + str(e).strip().split("\n")[0]}
+    return {"doc": doc, "counts": np.array([counts[field] for field in fields], dtype=np.int64)}
+
+
+def aggregate(results, fields):
+    """
+    Micro-average per-document counts into corpus scores
+
+    :param results: iterable of dictionaries with a document name under 'doc' and either an array of counts in the
+                    order of fields under 'counts' or an error message under 'error'
+    :param fields: list of count names, see get_count_fields
+    :return: dictionary of scores, document and EDU counts, and any per-document errors
+    """
+    counts = []
+    errors = []
+    for result in results:
+        if "error" in result:
+            errors.append(result)
+        else:
+            counts.append(result["counts"])
+    stacked = np.stack(counts) if len(counts) > 0 else np.zeros((0, len(fields)), dtype=np.int64)
+    totals = dict(zip(fields, np.sum(stacked, axis=0).tolist()))
+    scores = {"docs": len(counts)}
+    if "edus" in totals:
+        scores["edus"] = totals["edus"]
+        for metric in DEP_METRICS:
+            scores[metric] = round(totals[metric] / totals["edus"], 4) if totals["edus"] > 0 else 0.0
+    if "gold" in totals:
+        for metric in PARSEVAL_METRICS:
+            p = totals[metric] / totals["pred"] if totals["pred"] > 0 else 0.0
+            r = totals[metric] / totals["gold"] if totals["gold"] > 0 else 0.0
+            f = 2 * p * r / (p + r) if p + r > 0 else 0.0
+            scores[metric] = {"p": round(p, 4), "r": round(r, 4), "f1": round(f, 4)}
+    scores["errors"] = errors
+    return scores
+
+
+def evaluate_corpus(pairs, processes=1, dependencies=True, parseval=True, algorithm="li", rel_map=None):
+    """
+    Score a corpus of (gold, pred) file path pairs on a process pool
+
+    :return: dictionary of micro-averaged scores, see aggregate()
+    """
+    kwargs = {"dependencies": dependencies, "parseval": parseval, "algorithm": algorithm, "rel_map": rel_map}
+    fields = get_count_fields(dependencies, parseval)
+    jobs = ((gold, pred, kwargs, fields) for gold, pred in pairs)
+    return aggregate(bounded_imap(_evaluate_job, jobs, processes=processes), fields)
+
+
+def match_files(gold, pred):
+    """
+    Pair gold and predicted files by document name; gold and pred are file names, glob patterns or directories.
+    A single uncompressed .rsd or .conllu file with several '# newdoc id' documents is split into (path, docname)
+    entries using its offset index, so that each document is read on its own
+    """
+    def expand(path):
+        if os.path.isdir(path):
+            files = sorted(glob(os.path.join(path, "*")))
+        else:
+            files = sorted(glob(path)) if "*" in path else [path]
+        files = [f for f in files if supported(f)]
+        if len(files) == 1 and files[0].endswith((".rsd", ".conllu")) and os.path.isfile(files[0]):
+            index = get_document_index(files[0])
+            if len(index) > 1:
+                return [(files[0], docname) for docname in index.docnames()]
+        return files
+
+    def supported(path):
+        return split_compression(path)[0].endswith((".rsd", ".conllu", ".rs3", ".rs4"))
+
+    def docname(entry):
+        return entry[1] if isinstance(entry, tuple) else get_docname(entry)
+
+    gold_files = expand(gold)
+    pred_files = {docname(f): f for f in expand(pred)}
+    if len(gold_files) == 1 and len(pred_files) == 1:
+        return [(gold_files[0], list(pred_files.values())[0])]
+    pairs = []
+    for f in gold_files:
+        if docname(f) in pred_files:
+            pairs.append((f, pred_files[docname(f)]))
+        else:
+            sys.stderr.write("! No prediction found for " + docname(f) + "\n")
+    return pairs
+
+
+if __name__ == "__main__":
+    p = ArgumentParser(description="Score predicted discourse parses against gold (.rsd, .conllu, .rs3 or .rs4)")
+    p.add_argument("gold", help="gold file, glob pattern or directory")
+    p.add_argument("pred", help="predicted file, glob pattern or directory; files are matched to gold by document name")
+    p.add_argument("-j", "--processes", type=int, default=1, help="number of worker processes")
+    p.add_argument("-a", "--algorithm", choices=["li", "chain", "hirao"], default="li", help="dependency conversion algorithm for .rs3/.rs4 inputs")
+    p.add_argument("-m", "--metrics", choices=["all", "dep", "parseval"], default="all", help="which scores to compute")
+    p.add_argument("--json", action="store_true", help="print scores as JSON")
+    opts = p.parse_args()
+
+    pairs = match_files(opts.gold, opts.pred)
+    scores = evaluate_corpus(pairs, processes=opts.processes, dependencies=opts.metrics != "parseval",
+                             parseval=opts.metrics != "dep", algorithm=opts.algorithm)
+    for error in scores["errors"]:
+        sys.stderr.write("! " + error["doc"] + ": " + error["error"] + "\n")
+    if opts.json:
+        print(json.dumps(scores, indent=2))
+    else:
+        print("docs: " + str(scores["docs"]))
+        if "edus" in scores:
+            print("edus: " + str(scores["edus"]))
+            for metric in DEP_METRICS:
+                print(metric.upper().ljust(12) + "%.4f" % scores[metric])
+        for metric in PARSEVAL_METRICS:
+            if metric in scores:
+                print(metric.ljust(12) + "P=%.4f R=%.4f F1=%.4f" % (scores[metric]["p"], scores[metric]["r"], scores[metric]["f1"]))
@@ -3,55 +3,70 @@ Script to extract depdendency and XML markup information from data
 in the conll10/conllu and CWB XML formats.
 
 """
-import os, re, io
+import os, re, io, sys, marshal
 import ntpath
+from concurrent.futures import ThreadPoolExecutor
 try:
-    from .classes import ParsedToken, get_tense
+    from .classes import ParsedToken, get_tense, open_file, split_compression, COMPRESSION
 except:
-    from classes import ParsedToken, get_tense
+    from classes import ParsedToken, get_tense, open_file, split_compression, COMPRESSION
 
-def get_tok_info(docname,corpus_root):
+def get_dep_file(docname, corpus_root):
+    """
+    Find the dependency parse for a document in corpus_root/dep/, as either docname.conll10 or docname.conllu, which
+    may be compressed
+    """
+    for ext in [".conll10", ".conllu"]:
+        for compression in [""] + list(COMPRESSION):
+            dep_file = os.path.join(corpus_root, "dep", docname + ext + compression)
+            if os.path.exists(dep_file):
+                return dep_file
+    raise IOError("No dependency parse found for " + docname + " in " + os.path.join(corpus_root, "dep") + " (tried .conll10 and .conllu)\n")
 
-    if corpus_root[-1]!=os.sep:
-        corpus_root += os.sep
 
-    xml_file = corpus_root + "xml" + os.sep + docname + ".xml"
-    conll_file = corpus_root + "dep" + os.sep + docname + ".conll10"
-    tokens = []
+# Loaded corpus indexes by corpus root, used by get_tok_info when available
+CORPUS_INDEXES = {}
+CACHE_VERSION = 2
+# The marshal format is only guaranteed to be readable by the interpreter version which wrote it
+CACHE_HEADER = "# rst2dep token cache v" + str(CACHE_VERSION) + "\t" + str(sys.implementation.cache_tag) + "\tmarshal " + str(marshal.version) + "\n"
 
-    try:
-        lines = io.open(conll_file).read().replace("\r","").split("\n")
-    except:
-        lines = io.open(conll_file.replace(".conll10",".conllu")).read().replace("\r","").split("\n")
+
+def get_xml_file(docname, corpus_root):
+    xml_file = os.path.join(corpus_root, "xml", docname + ".xml")
+    for compression in COMPRESSION:
+        if not os.path.exists(xml_file) and os.path.exists(xml_file + compression):
+            return xml_file + compression
+    return xml_file
+
+
+def parse_dep_rows(conll_data):
+    """
+    Parse conll10/conllu data into tuples of (id, text, lemma, pos, morph, head, func, abs_id, abs_head, sent_id)
+    """
+    rows = []
     offset = sent_toks = 0
-    toks_by_abs_id = {}
     sid = 1
-    for line in lines:
+    for line in conll_data.replace("\r","").split("\n"):
         if "\t" in line:
             cols = line.split("\t")
             if "-" in cols[0] or "." in cols[0]:
                 continue
-            tok = ParsedToken(cols[0],cols[1],cols[2],cols[3],cols[5],cols[6],cols[7])
-            tok.abs_id = int(cols[0]) + offset
-            tok.abs_head = int(cols[6]) + offset if cols[6] != "0" else 0
-            tok.sent_id = sid
-            toks_by_abs_id[tok.abs_id] = tok
-            tokens.append(tok)
+            abs_id = int(cols[0]) + offset
+            abs_head = int(cols[6]) + offset if cols[6] != "0" else 0
+            rows.append((cols[0],cols[1],cols[2],cols[3],cols[5],cols[6],cols[7],abs_id,abs_head,sid))
             sent_toks += 1
         elif len(line.strip())==0:
             offset += sent_toks
             sent_toks = 0
             sid += 1
+    return rows
 
-    for tid, tok in enumerate(tokens):
-        if tok.head != "0":
-            tok.parent = toks_by_abs_id[tok.abs_head]
-            if tok.abs_head-1 > tid:  # Only collect premodifiers, for tense classification
-                tokens[tok.abs_head-1].children.append(tok)
-        else:
-            tok.parent = None
 
-    counter = 0
+def parse_xml_markup(xml_data):
+    """
+    Parse GUM-style XML into one tuple of (heading, caption, list, s_type, date, para, item, pos, lemma) per token line
+    """
+    markup = []
     heading = "_"
     caption = "_"
     date = "_"
@@ -59,7 +74,7 @@ def get_tok_info(docname,corpus_root):
     s_type = "_"
     para = "_"
     item = "_"
-    for line in io.open(xml_file).read().replace("\r", "").split("\n"):
+    for line in xml_data.replace("\r", "").split("\n"):
         if "<s type=" in line:
             m = re.search(r'<s type="([^"]+)"',line)
             s_type = m.group(1)
@@ -87,19 +102,186 @@ def get_tok_info(docname,corpus_root):
             item = "open_item"
         if "\t" in line:
             fields = line.split("\t")
-            tokens[counter].heading = heading
-            tokens[counter].caption = caption
-            tokens[counter].list = list
-            tokens[counter].s_type = s_type
-            tokens[counter].date = date
-            tokens[counter].para = para
-            tokens[counter].item = item
-            tokens[counter].pos = fields[1]
-            tokens[counter].lemma = fields[2]
+            markup.append((heading, caption, list, s_type, date, para, item, fields[1], fields[2]))
             para = "_"
             item = "_"
+    return markup
+
+
+def read_doc_info(docname, corpus_root):
+    """
+    Read and parse the dep/ and xml/ files of one document into plain tuples, which can be indexed and cached
+    """
+    conll_file = get_dep_file(docname, corpus_root)
+    xml_file = get_xml_file(docname, corpus_root)
+    with open_file(conll_file) as f:
+        rows = parse_dep_rows(f.read())
+    with open_file(xml_file) as f:
+        markup = parse_xml_markup(f.read())
+    return rows, markup
+
+
+def tokens_from_info(rows, markup):
+    """
+    Build fresh ParsedToken objects with parent and premodifier children links from parsed document rows
+    """
+    tokens = []
+    toks_by_abs_id = {}
+    for tok_id, text, lemma, pos, morph, head, func, abs_id, abs_head, sid in rows:
+        tok = ParsedToken(tok_id, text, lemma, pos, morph, head, func)
+        tok.abs_id = abs_id
+        tok.abs_head = abs_head
+        tok.sent_id = sid
+        toks_by_abs_id[abs_id] = tok
+        tokens.append(tok)
+
+    for tid, tok in enumerate(tokens):
+        if tok.head != "0":
+            tok.parent = toks_by_abs_id[tok.abs_head]
+            if tok.abs_head-1 > tid:  # Only collect premodifiers, for tense classification
+                tokens[tok.abs_head-1].children.append(tok)
+        else:
+            tok.parent = None
 
-            counter += 1
+    for counter, (heading, caption, list, s_type, date, para, item, pos, lemma) in enumerate(markup):
+        tokens[counter].heading = heading
+        tokens[counter].caption = caption
+        tokens[counter].list = list
+        tokens[counter].s_type = s_type
+        tokens[counter].date = date
+        tokens[counter].para = para
+        tokens[counter].item = item
+        tokens[counter].pos = pos
+        tokens[counter].lemma = lemma
 
     return tokens
 
+
+def try_read_doc_info(docname, corpus_root):
+    """
+    :return: the result of read_doc_info, or None if the document cannot be read or parsed
+    """
+    try:
+        return read_doc_info(docname, corpus_root)
+    except Exception:
+        return None
+
+
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return (path, stat.st_size, stat.st_mtime_ns)
+
+
+class CorpusIndex:
+    def __init__(self, corpus_root, docnames=None, threads=8, cache_file=None):
+        """
+        Prefetched and indexed token and markup information for all documents under a corpus root
+
+        :param corpus_root: corpus root folder containing dep/ and xml/ directories
+        :param docnames: documents to load (default: every .conll10/.conllu file in dep/)
+        :param threads: number of threads used to read and parse files
+        :param cache_file: optional path of a binary cache; unchanged documents are loaded from it and it is
+                           rewritten if any document had to be parsed again, keeping cached documents not in docnames
+
+        Documents whose dep/ or xml/ file is missing or unreadable are skipped with a warning, so that get_tok_info
+        reports the error when that document is converted.
+        """
+        self.corpus_root = corpus_root
+        self.docs = {}
+        self.fingerprints = {}
+        self.from_cache = set()  # Documents loaded from the cache file instead of parsed
+        if docnames is None:
+            dep_files = [split_compression(f)[0] for f in os.listdir(os.path.join(corpus_root, "dep"))]
+            docnames = sorted(set(f.rsplit(".", 1)[0] for f in dep_files if f.endswith(".conll10") or f.endswith(".conllu")))
+
+        cached = self.load_cache(cache_file) if cache_file is not None else {}
+        requested = set(docnames)
+        self.other_cached = {d: cached[d] for d in cached if d not in requested}
+        to_read = []
+        skipped = []
+        for docname in docnames:
+            try:
+                fingerprint = self.get_fingerprint(docname)
+            except (IOError, OSError):
+                skipped.append(docname)
+                continue
+            if docname in cached and cached[docname][0] == fingerprint:
+                self.docs[docname] = cached[docname][1]
+                self.fingerprints[docname] = fingerprint
+                self.from_cache.add(docname)
+            else:
+                to_read.append((docname, fingerprint))
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            infos = executor.map(lambda doc: try_read_doc_info(doc[0], corpus_root), to_read)
+            for (docname, fingerprint), info in zip(to_read, infos):
+                if info is None:
+                    skipped.append(docname)
+                    continue
+                self.docs[docname] = info
+                self.fingerprints[docname] = fingerprint
+        if len(skipped) > 0:
+            sys.stderr.write("! Not indexing " + str(len(skipped)) + " documents with a missing or unreadable dep/ or xml/ file in " +
+                             corpus_root + ": " + ", ".join(sorted(skipped)[:5]) + (", ..." if len(skipped) > 5 else "") + "\n")
+
+        if cache_file is not None and len(to_read) > 0:
+            self.save_cache(cache_file)
+
+    def get_fingerprint(self, docname):
+        return file_fingerprint(get_dep_file(docname, self.corpus_root)) + file_fingerprint(get_xml_file(docname, self.corpus_root))
+
+    def __contains__(self, docname):
+        return docname in self.docs
+
+    def get_tokens(self, docname):
+        rows, markup = self.docs[docname]
+        return tokens_from_info(rows, markup)
+
+    def save_cache(self, cache_file):
+        docs = dict(self.other_cached)
+        docs.update((d, (self.fingerprints[d], self.docs[d])) for d in self.docs)
+        data = {"version": CACHE_VERSION, "docs": docs}
+        tmp_file = cache_file + ".tmp"
+        with io.open(tmp_file, "wb") as f:
+            f.write(CACHE_HEADER.encode("utf8"))
+            marshal.dump(data, f)
+        os.replace(tmp_file, cache_file)
+
+    @staticmethod
+    def load_cache(cache_file):
+        """
+        :return: dictionary of docnames to (fingerprint, info) tuples, or an empty dictionary if the cache is missing,
+                 unreadable or was written by a different cache or Python version
+        """
+        if not os.path.exists(cache_file):
+            return {}
+        try:
+            with io.open(cache_file, "rb") as f:
+                if f.readline() != CACHE_HEADER.encode("utf8"):  # Checked before unmarshalling anything
+                    return {}
+                data = marshal.load(f)
+        except (EOFError, ValueError, TypeError):
+            sys.stderr.write("! Ignoring unreadable token cache " + cache_file + "\n")
+            return {}
+        if not isinstance(data, dict) or data.get("version") != CACHE_VERSION:
+            return {}
+        return data["docs"]
+
+
+def load_corpus_index(corpus_root, docnames=None, threads=8, cache_file=None):
+    """
+    Load a CorpusIndex and register it, so that get_tok_info (and make_rsd) serve documents under corpus_root from memory
+    """
+    index = CorpusIndex(corpus_root, docnames=docnames, threads=threads, cache_file=cache_file)
+    CORPUS_INDEXES[os.path.normpath(corpus_root)] = index
+    return index
+
+
+def get_tok_info(docname,corpus_root):
+
+    index = CORPUS_INDEXES.get(os.path.normpath(corpus_root))
+    if index is not None and docname in index:
+        return index.get_tokens(docname)
+
+    rows, markup = read_doc_info(docname, corpus_root)
+    return tokens_from_info(rows, markup)
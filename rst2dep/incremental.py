@@ -0,0 +1,590 @@
+"""
+incremental.py
+
+Incremental .rsd conversion for documents which are edited one operation at a time, e.g. in an annotation interface.
+A document is parsed once; after each edit (reparenting a node, changing a relation, adding or removing a signal or
+secondary edge) only the relabeling, dependency heads, distances and heights which depend on changed nodes are
+recomputed, and the changed .rsd lines are returned. Example usage:
+
+from rst2dep.incremental import IncrementalDocument
+doc = IncrementalDocument("example.rs3")
+changed = doc.reparent("5", "3", "elaboration")  # dictionary of EDU ID -> new .rsd line
+assert doc.verify() == []  # identical to a full make_rsd conversion of the edited tree
+"""
+
+import re, collections
+from itertools import zip_longest
+try:
+    from .rst2dep import make_rsd, find_dep_head, get_distance, relabel_node
+    from .classes import read_rst, open_file, SIGNAL, SECEDGE
+    from .dep2rst import xml_escape
+except ImportError:
+    from rst2dep import make_rsd, find_dep_head, get_distance, relabel_node
+    from classes import read_rst, open_file, SIGNAL, SECEDGE
+    from dep2rst import xml_escape
+
+
+class TrackedNodes(dict):
+    """
+    Dictionary of NODE objects which records the IDs looked up while reads is a set
+    """
+    reads = None
+
+    def __getitem__(self, key):
+        if self.reads is not None:
+            self.reads.add(key)
+        return dict.__getitem__(self, key)
+
+
+class IncrementalDocument:
+    """
+    An RST document which can be edited and re-converted to .rsd incrementally
+
+    For each node, the IDs of all nodes read while relabeling it, finding its dependency head and measuring its
+    distance are recorded. An edit only recomputes values which read a changed node, so that results are the same as
+    for a full conversion of the edited tree with make_rsd. Heights and head EDUs of constituents, used for secondary
+    edges, are only recomputed for the ancestors of changed nodes. Edits which leave a secondary edge without a head EDU
+    raise IOError and are undone.
+
+    Node IDs are those assigned by read_rst, i.e. EDUs are numbered 1-N in order, followed by groups in order of
+    appearance.
+
+    :param rstfile: path to an .rs3 or .rs4 file, or a string containing the RST tree if as_text is True
+    :param algorithm: the algorithm to use for dependency head selection, one of {li,chain,hirao}
+    :param keep_same_unit: if True, retain same-unit multinucs in hirao algorithm / attach them as in li algorithm for chain
+    :param output_const_nid: use the fourth column in the output to store the constituent tree original node ID for each relation
+    """
+    def __init__(self, rstfile, as_text=False, algorithm="li", keep_same_unit=False, output_const_nid=False):
+        if not as_text:
+            with open_file(rstfile) as f:
+                rstfile = f.read()
+        self.rel_hash = {}
+        nodes = read_rst(rstfile, self.rel_hash, as_text=True)
+        if isinstance(nodes, str):
+            raise IOError("Invalid RST document: " + re.sub(r'<[^>]+>', '', nodes))
+        self.algorithm = algorithm
+        self.keep_same_unit = keep_same_unit
+        self.output_const_nid = output_const_nid
+        self.default_rst = ""
+        for rel in self.rel_hash:
+            if self.rel_hash[rel] == "rst":
+                self.default_rst = rel
+                break
+
+        # Secedge sources and targets keep the IDs in the XML, while read_rst renumbers nodes
+        raw_ids = re.findall(r'<segment[^>]*?\sid="([^"]+)"', rstfile) + re.findall(r'<group[^>]*?\sid="([^"]+)"', rstfile)
+        raw_ids = {raw: str(i + 1) for i, raw in enumerate(raw_ids)}
+        self.nodes = TrackedNodes()
+        self.secedges = collections.OrderedDict()
+        for nid in nodes:
+            if nodes[nid].kind == "secedge":
+                sec = nodes[nid]
+                secedge = SECEDGE(raw_ids.get(sec.source, sec.source), raw_ids.get(sec.target, sec.target), sec.relname, sec.signals)
+                self.secedges[secedge.id] = secedge
+            else:
+                self.nodes[nid] = nodes[nid]
+        self.position = {nid: i for i, nid in enumerate(self.nodes)}
+        self.edus = sorted([nid for nid in self.nodes if self.nodes[nid].kind == "edu"], key=int)
+        self.document_tokens = " ".join(self.nodes[nid].text for nid in self.nodes if self.nodes[nid].kind == "edu").split(" ")
+        self.bare_rels = {}
+        for nid in self.nodes:
+            relname = self.nodes[nid].relname
+            self.bare_rels[nid] = relname[:-2] if relname.endswith("_r") or relname.endswith("_m") else relname
+
+        # Left and right EDU of each subtree, including satellites
+        self.extent = {}
+        for nid in self.nodes:
+            node = self.nodes[nid]
+            if node.kind == "edu":
+                self.extent[nid] = (node.left, node.right)
+        self.update_structure(list(self.nodes))
+
+        self.relabels = {}
+        self.heads = {}
+        self.dists = {}
+        self.head_edu = {}
+        self.target_edu = {}
+        self.heights = {}
+        self.lines = {}
+        self.secedge_fields = {}
+        self.reads = {"relabel": {}, "head": {}, "dist": {}}
+        self.readers = {"relabel": collections.defaultdict(set), "head": collections.defaultdict(set),
+                        "dist": collections.defaultdict(set)}
+        self.recomputed = {}
+        self.update(set(self.nodes), set(self.nodes))
+
+    # Edit operations
+
+    def reparent(self, nid, parent, relname=None):
+        """
+        Attach a node to a new parent, optionally with a new relation
+
+        :param nid: ID of the node to move
+        :param parent: ID of the new parent node, or '0' to make the node a root
+        :param relname: relation name without _r/_m suffix (default: keep the current relation)
+        :return: dictionary of EDU ID -> .rsd line for all lines which changed
+        """
+        nodes = self.nodes
+        if nid not in nodes or (parent != "0" and parent not in nodes):
+            raise IOError("Cannot attach node " + nid + " to " + parent + ": node not found\n")
+        probe = parent
+        while probe != "0":
+            if probe == nid:
+                raise IOError("Cannot attach node " + nid + " to its own descendant " + parent + "\n")
+            probe = nodes[probe].parent
+        node = nodes[nid]
+        old_parent = node.parent
+        old_relname = self.bare_rels[nid]
+        if relname is not None:
+            self.bare_rels[nid] = relname
+        if old_parent != "0":
+            nodes[old_parent].children.remove(nid)
+        node.parent = parent
+        if parent != "0":
+            nodes[parent].children.append(nid)
+            nodes[parent].children.sort(key=lambda x: self.position[x])
+        try:
+            return self.edit([nid], [old_parent, parent])
+        except IOError:  # Undo the edit, e.g. if a secondary edge lost its head EDU
+            self.reparent(nid, old_parent, old_relname)
+            raise
+
+    def relabel(self, nid, relname):
+        """
+        Change the relation of a node
+
+        :param relname: relation name without _r/_m suffix, e.g. 'elaboration' or 'span'
+        :return: dictionary of EDU ID -> .rsd line for all lines which changed
+        """
+        if nid not in self.nodes:
+            raise IOError("Cannot relabel node " + nid + ": node not found\n")
+        old_relname = self.bare_rels[nid]
+        self.bare_rels[nid] = relname
+        try:
+            return self.edit([nid], [self.nodes[nid].parent])
+        except IOError:
+            self.relabel(nid, old_relname)
+            raise
+
+    def add_signal(self, source, sigtype, subtype, tokens="", status=""):
+        """
+        Add a signal to a node or secondary edge
+
+        :param source: node ID, or secondary edge ID of the form 'source-target'
+        :param tokens: comma separated document token numbers, e.g. '5,6'
+        :return: dictionary of EDU ID -> .rsd line for all lines which changed
+        """
+        self.get_source(source).signals.append(SIGNAL(sigtype, subtype, tokens, status))
+        return self.edit([source] if source in self.nodes else [], [])
+
+    def remove_signal(self, source, sigtype, subtype, tokens=None):
+        """
+        Remove the first signal of a node or secondary edge with the given type, subtype and optionally tokens
+
+        :return: dictionary of EDU ID -> .rsd line for all lines which changed
+        """
+        signals = self.get_source(source).signals
+        for i, sig in enumerate(signals):
+            if sig.type == sigtype and sig.subtype == subtype and (tokens is None or sig.tokens == tokens):
+                del signals[i]
+                return self.edit([source] if source in self.nodes else [], [])
+        raise IOError("No " + sigtype + "/" + subtype + " signal found on " + source + "\n")
+
+    def add_secedge(self, source, target, relname):
+        """
+        :return: dictionary of EDU ID -> .rsd line for all lines which changed
+        """
+        if source not in self.nodes or target not in self.nodes:
+            raise IOError("Cannot add secedge " + source + "-" + target + ": node not found\n")
+        if source + "-" + target in self.secedges:
+            raise IOError("Secedge " + source + "-" + target + " already exists\n")
+        self.secedges[source + "-" + target] = SECEDGE(source, target, relname)
+        try:
+            return self.edit([], [])
+        except IOError:
+            del self.secedges[source + "-" + target]
+            raise
+
+    def remove_secedge(self, source, target):
+        """
+        :return: dictionary of EDU ID -> .rsd line for all lines which changed
+        """
+        if source + "-" + target not in self.secedges:
+            raise IOError("Secedge " + source + "-" + target + " not found\n")
+        del self.secedges[source + "-" + target]
+        return self.edit([], [])
+
+    def get_source(self, source):
+        if source in self.nodes:
+            return self.nodes[source]
+        if source in self.secedges:
+            return self.secedges[source]
+        raise IOError("Signal source " + source + " not found\n")
+
+    # Recomputation
+
+    def get_depth(self, nid, depths):
+        path = []
+        while nid != "0" and nid not in depths:
+            path.append(nid)
+            nid = self.nodes[nid].parent
+        depth = depths.get(nid, 0)
+        for probe in reversed(path):
+            depth += 1
+            depths[probe] = depth
+        return depths[path[0]] if len(path) > 0 else depth
+
+    def get_ancestors(self, nids):
+        """
+        :return: set of the given node IDs and all of their ancestors
+        """
+        output = set()
+        for nid in nids:
+            while nid != "0" and nid not in output:
+                output.add(nid)
+                nid = self.nodes[nid].parent
+        return output
+
+    def get_relname(self, nid):
+        # Add _r/_m suffixes as read_rst does, based on the parent and the relations of the node's siblings
+        node = self.nodes[nid]
+        relname = self.bare_rels[nid]
+        if node.parent == "0":
+            if node.kind != "edu":
+                return ""
+            if relname == "":
+                return self.default_rst
+            return relname if relname.endswith("_r") else relname + "_r"
+        parent = self.nodes[node.parent]
+        if parent.kind == "multinuc" and relname + "_m" in self.rel_hash:
+            counts = collections.Counter(self.bare_rels[c] for c in parent.children if self.bare_rels[c] + "_m" in self.rel_hash)
+            multinuc_rels = [rel for rel in counts if counts[rel] >= 2]
+            if relname in multinuc_rels or len(multinuc_rels) == 0:
+                return relname + "_m"
+        if relname != "span":
+            return relname + "_r"
+        return relname
+
+    def update_structure(self, nids):
+        """
+        Recompute relation suffixes, left and right EDUs and leftmost children for the given nodes, children first
+        """
+        nodes = self.nodes
+        depths = {}
+        for nid in sorted(nids, key=lambda x: self.get_depth(x, depths), reverse=True):
+            node = nodes[nid]
+            if node.kind != "edu":
+                node.left = node.right = 0
+            left = node.left
+            right = node.right
+            for child_id in node.children:
+                child_left, child_right = self.extent[child_id]
+                if child_right == 0:  # No EDUs below this child
+                    continue
+                if left == 0 or child_left < left:
+                    left = child_left
+                if child_right > right:
+                    right = child_right
+                child = nodes[child_id]
+                if child.relname == "span" or (child.relname in self.rel_hash and node.kind == "multinuc" and self.rel_hash[child.relname] == "multinuc"):
+                    if node.left == 0 or child_left < node.left:
+                        node.left = child_left
+                    if node.right < child_right:
+                        node.right = child_right
+            self.extent[nid] = (left, right)
+
+            node.leftmost_child = ""
+            for child_id in node.children:
+                if nodes[child_id].left == node.left:
+                    node.leftmost_child = child_id
+            if node.kind == "multinuc" and node.leftmost_child == "":
+                min_left = node.right
+                for child_id in node.children:
+                    child = nodes[child_id]
+                    if child.relname.endswith("_m") and child.left < min_left:
+                        min_left = child.left
+                        node.leftmost_child = child_id
+
+    def edit(self, edited, parents):
+        """
+        Update the tree after an edit and recompute affected values
+
+        :param edited: IDs of nodes whose parent, relation or signals were edited
+        :param parents: IDs of the old and new parents of edited nodes
+        :return: dictionary of EDU ID -> .rsd line for all lines which changed
+        """
+        nodes = self.nodes
+        siblings = set(edited)
+        for parent in parents:
+            if parent != "0":
+                siblings.update(nodes[parent].children)
+        affected = self.get_ancestors([p for p in parents if p != "0"]) | siblings
+        before = {nid: self.get_state(nid) for nid in affected}
+        for nid in siblings:
+            nodes[nid].relname = self.get_relname(nid)
+        self.update_structure(affected)
+        changed = set(edited) | set(nid for nid in affected if self.get_state(nid) != before[nid])
+        return self.update(changed, self.get_ancestors(changed))
+
+    def get_state(self, nid):
+        node = self.nodes[nid]
+        return node.parent, node.relname, node.left, node.right, node.leftmost_child, tuple(node.children)
+
+    def track(self, kind, key, func, *args, **kwargs):
+        # Call func while recording the nodes it reads, and index them so that key is recomputed when they change
+        self.nodes.reads = set([key])
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            reads = self.nodes.reads
+            self.nodes.reads = None
+        index = self.readers[kind]
+        for nid in self.reads[kind].get(key, ()):
+            index[nid].discard(key)
+        for nid in reads:
+            index[nid].add(key)
+        self.reads[kind][key] = reads
+        return result
+
+    def get_readers(self, kind, nids):
+        output = set()
+        for nid in nids:
+            output.update(self.readers[kind].get(nid, ()))
+        return output
+
+    def update(self, changed, structural):
+        """
+        Recompute values depending on changed nodes
+
+        :param changed: IDs of nodes whose parent, relation, children, EDU span or signals changed
+        :param structural: IDs of nodes whose subtree changed, for which heights and head EDUs are recomputed
+        :return: dictionary of EDU ID -> .rsd line for all lines which changed
+        """
+        nodes = self.nodes
+        recomputed = {"relabel": 0, "heads": 0, "distances": 0, "heights": len(structural)}
+
+        # Relations of span and leftmost multinuc children, see make_rsd
+        rel_changed = set()
+        for nid in sorted(changed | self.get_readers("relabel", changed), key=lambda x: self.position[x]):
+            dep_rel, top_nid, sigs = self.track("relabel", nid, relabel_node, nodes, nid)
+            recomputed["relabel"] += 1
+            relabel = (dep_rel, top_nid, list(sigs))  # Copy, since signal lists are edited in place
+            if relabel != self.relabels.get(nid):
+                self.relabels[nid] = relabel
+                rel_changed.add(nid)
+                nodes[nid].dep_rel = dep_rel
+
+        # Dependency heads; EDU relations only differ from relabeling if the EDU is the root
+        head_changed = set()
+        pending = changed | rel_changed | self.get_readers("head", changed | rel_changed)
+        while len(pending) > 0:
+            dep_rel_changed = set()
+            for nid in sorted(pending, key=lambda x: self.position[x]):
+                if nodes[nid].kind != "edu":
+                    continue
+                dep_rel = self.relabels[nid][0]
+                dep_parent = self.track("head", nid, find_dep_head, nodes, nid, nid, [], dep_rel,
+                                        algorithm=self.algorithm, keep_same_unit=self.keep_same_unit)
+                recomputed["heads"] += 1
+                if dep_parent is None:
+                    dep_parent = "0"
+                    dep_rel = "ROOT"
+                if (dep_parent, dep_rel) != self.heads.get(nid):
+                    self.heads[nid] = (dep_parent, dep_rel)
+                    head_changed.add(nid)
+                if nodes[nid].dep_rel != dep_rel and self.algorithm == "chain":  # Only chain reads other EDUs' relations
+                    nodes[nid].dep_rel = dep_rel
+                    dep_rel_changed.add(nid)
+            pending = self.get_readers("head", dep_rel_changed)
+
+        final_changed = set()
+        if self.algorithm == "hirao":  # Re-wire multinuc relation children to point to the multinuc parent, see make_rsd
+            for nid in self.edus:
+                nodes[nid].dep_parent, nodes[nid].dep_rel = self.heads[nid]
+            for nid in [n for n in nodes if nodes[n].kind == "edu"]:
+                node = nodes[nid]
+                dep_rel = node.dep_rel
+                while dep_rel.endswith("_m"):
+                    if self.keep_same_unit and ("same-unit" in dep_rel.lower() or "same_unit" in dep_rel.lower() or "sameunit" in dep_rel.lower()):
+                        break
+                    if node.dep_parent == "0":
+                        dep_rel = node.dep_rel = "ROOT"
+                    else:
+                        dep_rel = node.dep_rel = nodes[node.dep_parent].dep_rel
+                        node.dep_parent = nodes[node.dep_parent].dep_parent
+            for nid in self.edus:
+                if self.dists.get(nid) is None or (nodes[nid].dep_parent, nodes[nid].dep_rel) != self.dists[nid][:2]:
+                    final_changed.add(nid)
+        else:
+            # Relabeling overwrites dep_rel, so restore it for EDUs whose head is unchanged, e.g. the root
+            final_changed = head_changed | set(nid for nid in rel_changed if nodes[nid].kind == "edu")
+            for nid in final_changed:
+                nodes[nid].dep_parent, nodes[nid].dep_rel = self.heads[nid]
+
+        # Distances from dependency parents to attachment points
+        dist_changed = set()
+        for nid in sorted(final_changed | self.get_readers("dist", changed), key=int):
+            node = nodes[nid]
+            if node.dep_rel == "ROOT":
+                dist = "0"
+            else:
+                # Look up the dependency parent while tracking, since its ancestors are read through its parent
+                dist = self.track("dist", nid, lambda: get_distance(node, nodes[node.dep_parent], nodes))
+            recomputed["distances"] += 1
+            if (node.dep_parent, node.dep_rel, str(dist)) != self.dists.get(nid):
+                self.dists[nid] = (node.dep_parent, node.dep_rel, str(dist))
+                dist_changed.add(nid)
+
+        self.update_heights(structural)
+        secedge_fields = self.get_secedge_fields()
+
+        output = {}
+        to_format = final_changed | dist_changed | set(n for n in rel_changed | changed if nodes[n].kind == "edu")
+        to_format |= set(self.secedge_fields) ^ set(secedge_fields)
+        to_format |= set(n for n in secedge_fields if secedge_fields[n] != self.secedge_fields.get(n))
+        for nid in to_format:
+            line = self.format_line(nid, secedge_fields)
+            if line != self.lines.get(nid):
+                self.lines[nid] = output[nid] = line
+        self.secedge_fields = secedge_fields
+        self.recomputed = recomputed
+        return output
+
+    def update_heights(self, nids):
+        """
+        Recompute height and head EDUs of the given nodes from their children, as in make_rsd
+
+        Each node is headed by the lowest numbered EDU reaching it through span or multinuc head relations, and its
+        height is that of the child leading to that EDU plus one. Nodes reached only through satellite relations
+        take the height of the last satellite.
+        """
+        nodes = self.nodes
+        depths = {}
+        for nid in sorted(nids, key=lambda x: self.get_depth(x, depths), reverse=True):  # Children first
+            node = nodes[nid]
+            if node.kind == "edu":
+                self.head_edu[nid] = self.target_edu[nid] = nid
+                self.heights[nid] = 0
+                continue
+            heads = []
+            satellites = []
+            for child_id in node.children:
+                child = nodes[child_id]
+                if child.kind == "edu":
+                    first = last = child_id
+                elif child_id in self.head_edu:
+                    first, last = self.head_edu[child_id], self.target_edu[child_id]
+                else:  # No EDU climbs beyond this child
+                    continue
+                if child.relname == "span" or (node.kind == "multinuc" and (node.leftmost_child == child_id or (child.relname.endswith("_m") and not child.relname.startswith("same")))):
+                    heads.append((int(first), int(last), child_id))
+                else:
+                    satellites.append((int(last), child_id))
+            self.head_edu.pop(nid, None)
+            self.target_edu.pop(nid, None)
+            self.heights.pop(nid, None)
+            if len(heads) > 0:
+                first, _, child_id = min(heads)
+                self.head_edu[nid] = str(first)
+                self.target_edu[nid] = str(max(h[1] for h in heads))
+                self.heights[nid] = self.heights[child_id] + 1
+            elif len(satellites) > 0:
+                self.heights[nid] = self.heights[max(satellites)[1]] + 1
+
+    def get_secedge_fields(self):
+        """
+        :return: dictionary of EDU ID -> (secedge node ID mapping, secedges) column values, as in make_rsd
+        """
+        src2secedges = collections.defaultdict(set)
+        secedge_mapping = {}
+        target_edu = self.target_edu if self.algorithm == "chain" else self.head_edu
+        for secedge in self.secedges.values():
+            for nid, heads in [(secedge.source, self.head_edu), (secedge.target, target_edu)]:
+                if nid not in heads:
+                    raise IOError("Secedge " + secedge.id + " cannot be converted: node " + nid + " has no span or multinuc head EDU\n")
+            dep_src = self.head_edu[secedge.source]
+            dep_trg = target_edu[secedge.target]
+            signals = [sig.pretty_print(tokens=self.document_tokens) for sig in secedge.signals]
+            signals = ";".join(sorted(signals)) if len(signals) > 0 else "_"
+            src2secedges[dep_src].add(":".join([dep_trg, secedge.relname, str(self.heights[secedge.source]),
+                                                str(self.heights[secedge.target]), signals]))
+            secedge_mapping[dep_src + "-" + dep_trg] = secedge.id
+        fields = {}
+        for src in src2secedges:
+            secs = sorted(src2secedges[src])
+            mapping = "_"
+            if self.output_const_nid:
+                mapping = "|".join(src + "-" + sec.split(":")[0] + ":" + secedge_mapping[src + "-" + sec.split(":")[0]] for sec in secs)
+            fields[src] = (mapping, "|".join(secs))
+        return fields
+
+    def format_line(self, nid, secedge_fields):
+        node = self.nodes[nid]
+        _, top_nid, sigs = self.relabels[nid]
+        signals = sigs if len(sigs) > 0 else node.signals
+        signals = ";".join([sig.pretty_print(self.document_tokens) for sig in signals]) if len(signals) > 0 else "_"
+        top_nid = top_nid if self.output_const_nid else "_"
+        mapping, secedges = secedge_fields.get(nid, ("_", "_"))
+        return "\t".join([nid, node.text, self.dists[nid][2], top_nid, mapping, "_", node.dep_parent, node.dep_rel, secedges, signals])
+
+    # Output
+
+    def rsd(self):
+        return "\n".join(self.lines[nid] for nid in self.edus) + "\n"
+
+    def to_rs3(self):
+        """
+        :return: the current tree as an .rs3/.rs4 string, keeping node IDs
+        """
+        nodes = self.nodes
+        lines = ["<rst>", "\t<header>", "\t\t<relations>"]
+        for rel in self.rel_hash:
+            lines.append('\t\t\t<rel name="' + rel[:-2] + '" type="' + self.rel_hash[rel] + '"/>')
+        lines += ["\t\t</relations>", "\t</header>", "\t<body>"]
+        for nid in self.edus:
+            node = nodes[nid]
+            if node.parent == "0":
+                relname = ' relname="' + self.bare_rels[nid] + '"' if self.bare_rels[nid] != "" else ""
+                lines.append('\t\t<segment id="' + nid + '"' + relname + '>' + xml_escape(node.text) + '</segment>')
+            else:
+                lines.append('\t\t<segment id="' + nid + '" parent="' + node.parent + '" relname="' + self.bare_rels[nid] + '">' + xml_escape(node.text) + '</segment>')
+        for nid in sorted([n for n in nodes if nodes[n].kind != "edu"], key=int):
+            node = nodes[nid]
+            if node.parent == "0":
+                lines.append('\t\t<group id="' + nid + '" type="' + node.kind + '"/>')
+            else:
+                lines.append('\t\t<group id="' + nid + '" type="' + node.kind + '" parent="' + node.parent + '" relname="' + self.bare_rels[nid] + '"/>')
+        if len(self.secedges) > 0:
+            lines.append("\t\t<secedges>")
+            for secedge in self.secedges.values():
+                lines.append('\t\t\t<secedge id="' + secedge.id + '" source="' + secedge.source + '" target="' + secedge.target + '" relname="' + secedge.relname + '"/>')
+            lines.append("\t\t</secedges>")
+        signals = []
+        for source in sorted(nodes, key=int):
+            signals += [(source, sig) for sig in nodes[source].signals]
+        for source in self.secedges:
+            signals += [(source, sig) for sig in self.secedges[source].signals]
+        if len(signals) > 0:
+            lines.append("\t\t<signals>")
+            for source, sig in signals:
+                status = ' status="' + sig.status + '"' if sig.status != "" else ""
+                lines.append('\t\t\t<signal source="' + source + '" type="' + sig.type + '" subtype="' + sig.subtype + '" tokens="' + sig.tokens + '"' + status + '/>')
+            lines.append("\t\t</signals>")
+        lines += ["\t</body>", "</rst>"]
+        return "\n".join(lines) + "\n"
+
+    def verify(self):
+        """
+        Compare the incremental output against a full make_rsd conversion of the current tree
+
+        :return: list of (EDU ID, incremental line, full conversion line) tuples for lines which differ; if one side has
+                 more lines, the missing EDU ID or line is None
+        """
+        full = make_rsd(self.to_rs3(), "", as_text=True, algorithm=self.algorithm, keep_same_unit=self.keep_same_unit,
+                        output_const_nid=self.output_const_nid).strip().split("\n")
+        output = []
+        for nid, line in zip_longest(self.edus, full):
+            incremental = self.lines[nid] if nid is not None else None
+            if incremental != line:
+                output.append((nid, incremental, line))
+        return output
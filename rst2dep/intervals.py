@@ -0,0 +1,211 @@
+"""
+intervals.py
+
+Containment index over the EDU ranges dominated by the nodes of a parsed RST document, and extraction of
+sub-documents. Each node is indexed by the first and last EDU it dominates, including satellites attached to it,
+so that the nodes covering or contained in an EDU range are found with binary search instead of scans over all
+nodes. extract_subtree writes the part of a document between two EDUs as a canonically numbered .rs3 or .rsd
+fragment. Example usage:
+
+python intervals.py example.rs3 120 180 > excerpt.rs3
+python intervals.py example.rs3 120 180 -o rsd > excerpt.rsd
+"""
+
+import sys
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from argparse import ArgumentParser
+try:
+    from .rst2dep import make_rsd
+    from .dep2rst import xml_escape
+    from .classes import read_rst, open_file, make_deterministic_nodes
+    from .validate import get_coverage, get_raw_ids
+except ImportError:
+    from rst2dep import make_rsd
+    from dep2rst import xml_escape
+    from classes import read_rst, open_file, make_deterministic_nodes
+    from validate import get_coverage, get_raw_ids
+
+
+class IntervalIndex:
+    """
+    Index of the EDU ranges dominated by each node of one RST document
+
+    Nodes are sorted by first EDU and, for equal first EDUs, outermost first, with a max-tree over their last EDUs.
+    Covering queries take O(log n) per result and containment queries O(log n + k) for k results.
+
+    :param doc: path to an .rs3 or .rs4 file, optionally compressed, or the document as a string; dictionaries of
+                nodes are not accepted, since their secondary edges refer to XML IDs which read_rst has renumbered
+    """
+    def __init__(self, doc):
+        self.rel_hash = {}
+        if not isinstance(doc, str):
+            raise IOError("IntervalIndex needs the .rs3/.rs4 XML or a path to it, not " + type(doc).__name__ + "\n")
+        if "<" not in doc:
+            with open_file(doc) as f:
+                doc = f.read()
+        nodes = read_rst(doc, self.rel_hash, as_text=True)
+        if isinstance(nodes, str):
+            raise IOError("Invalid RST document\n")
+        raw_ids = get_raw_ids(doc)
+        self.nodes = {nid: nodes[nid] for nid in nodes if nodes[nid].kind != "secedge"}
+        # Secondary edges refer to the IDs in the XML, which read_rst renumbers
+        self.secedges = [(raw_ids.get(n.source, n.source), raw_ids.get(n.target, n.target), n) for n in nodes.values() if n.kind == "secedge"]
+        postorder, self.coverage = get_coverage(self.nodes)
+        position = {nid: i for i, nid in enumerate(postorder)}
+
+        self.edus = sorted([n for n in self.nodes.values() if n.kind == "edu"], key=lambda n: n.left)
+        self.tok_offsets = [0]  # Number of tokens before each EDU, and the total
+        for edu in self.edus:
+            self.tok_offsets.append(self.tok_offsets[-1] + len(edu.text.split(" ")))
+
+        # Ancestors come after their descendants in post-order, so sorting by -position puts them first for equal ranges
+        rows = [nid for nid in postorder if self.coverage[nid][2] > 0]
+        rows.sort(key=lambda nid: (self.coverage[nid][0], -self.coverage[nid][1], -position[nid]))
+        self.rows = rows
+        self.firsts = [self.coverage[nid][0] for nid in rows]
+        self.lasts = [self.coverage[nid][1] for nid in rows]
+        self.size = 1
+        while self.size < len(rows):
+            self.size *= 2
+        self.max_last = [0] * (2 * self.size)
+        self.max_last[self.size:self.size + len(rows)] = self.lasts
+        for i in range(self.size - 1, 0, -1):
+            self.max_last[i] = max(self.max_last[2 * i], self.max_last[2 * i + 1])
+
+    def covering(self, start, end=None):
+        """
+        :return: list of nodes dominating all EDUs from start to end (default: start), outermost first
+        """
+        if end is None:
+            end = start
+        limit = bisect_right(self.firsts, start)  # Rows which begin at or before start
+        found = []
+        stack = [(1, 0, self.size)]
+        while len(stack) > 0:
+            i, lo, hi = stack.pop()
+            if lo >= limit or self.max_last[i] < end:
+                continue
+            if hi - lo == 1:
+                found.append(lo)
+            else:
+                mid = (lo + hi) // 2
+                stack.append((2 * i + 1, mid, hi))
+                stack.append((2 * i, lo, mid))
+        return [self.nodes[self.rows[i]] for i in sorted(found)]
+
+    def contained(self, start, end):
+        """
+        :return: list of nodes which only dominate EDUs from start to end, sorted by first EDU, outermost first
+        """
+        lo = bisect_left(self.firsts, start)
+        hi = bisect_right(self.firsts, end)
+        return [self.nodes[self.rows[i]] for i in range(lo, hi) if self.lasts[i] <= end]
+
+    def smallest_covering(self, start, end=None):
+        """
+        :return: the innermost node dominating all EDUs from start to end, or None if the EDUs share no ancestor
+        """
+        nodes = self.covering(start, end)
+        return nodes[-1] if len(nodes) > 0 else None
+
+    def edu_range(self, tok_start, tok_end):
+        """
+        :return: tuple of the first and last EDU containing 1-based document tokens tok_start to tok_end
+        """
+        return bisect_left(self.tok_offsets, tok_start), bisect_left(self.tok_offsets, tok_end)
+
+    def extract(self, start, end, output="rs3", algorithm="li"):
+        """
+        See extract_subtree
+        """
+        if not 1 <= start <= end <= len(self.edus):
+            raise IOError("Invalid EDU range " + str(start) + "-" + str(end) + " for a document with " + str(len(self.edus)) + " EDUs\n")
+        tok_offset, tok_limit = self.tok_offsets[start - 1], self.tok_offsets[end]
+        edus = self.edus[start - 1:end]
+        groups = [n for n in self.contained(start, end) if n.kind != "edu"]
+        new_id = {n.id: str(i + 1) for i, n in enumerate(edus + groups)}
+
+        def attributes(node):
+            if node.parent not in new_id:  # Parent is outside the fragment
+                return ""
+            relname = node.relname[:-2] if node.relname.endswith(("_r", "_m")) else node.relname
+            return ' parent="' + new_id[node.parent] + '" relname="' + relname + '"'
+
+        sigtypes = defaultdict(set)
+
+        def signals_xml(source, signals):
+            lines = []
+            for sig in signals:
+                tokens = [int(t) - tok_offset for t in sig.tokens.split(",") if t != "" and tok_offset < int(t) <= tok_limit]
+                if len(tokens) == 0 and sig.tokens != "":  # Anchored outside the fragment only
+                    continue
+                status = ' status="' + sig.status + '"' if sig.status not in ["", "_"] else ""
+                lines.append('\t\t\t<signal source="' + source + '" type="' + sig.type + '" subtype="' + sig.subtype +
+                             '" tokens="' + ",".join(str(t) for t in tokens) + '"' + status + '/>')
+                sigtypes[sig.type].add(sig.subtype)
+            return lines
+
+        body = []
+        signals = []
+        for node in edus:
+            body.append('\t\t<segment id="' + new_id[node.id] + '"' + attributes(node) + '>' + xml_escape(node.text) + '</segment>')
+            signals += signals_xml(new_id[node.id], node.signals)
+        for node in groups:
+            body.append('\t\t<group id="' + new_id[node.id] + '" type="' + node.kind + '"' + attributes(node) + '/>')
+            signals += signals_xml(new_id[node.id], node.signals)
+        secedges = []
+        for source, target, secedge in self.secedges:
+            if source in new_id and target in new_id:
+                sec_id = new_id[source] + "-" + new_id[target]
+                secedges.append('\t\t\t<secedge id="' + sec_id + '" source="' + new_id[source] + '" target="' + new_id[target] + '" relname="' + secedge.relname + '"/>')
+                signals += signals_xml(sec_id, secedge.signals)
+
+        header = ["<rst>", "\t<header>", "\t\t<relations>"]
+        for rel in sorted(self.rel_hash):
+            header.append('\t\t\t<rel name="' + rel[:-2] + '" type="' + self.rel_hash[rel] + '"/>')
+        header.append("\t\t</relations>")
+        if len(sigtypes) > 0:
+            header.append("\t\t<sigtypes>")
+            for sigtype in sorted(sigtypes):
+                header.append('\t\t\t<sig type="' + sigtype + '" subtypes="' + ";".join(sorted(sigtypes[sigtype])) + '"/>')
+            header.append("\t\t</sigtypes>")
+        header += ["\t</header>", "\t<body>"]
+        if len(secedges) > 0:
+            body += ["\t\t<secedges>"] + secedges + ["\t\t</secedges>"]
+        if len(signals) > 0:
+            body += ["\t\t<signals>"] + signals + ["\t\t</signals>"]
+        rs3 = make_deterministic_nodes("\n".join(header + body + ["\t</body>", "</rst>"]) + "\n")
+        if output == "rsd":
+            return make_rsd(rs3, "", as_text=True, algorithm=algorithm)
+        return rs3
+
+
+def extract_subtree(doc, start_edu, end_edu, output="rs3", algorithm="li"):
+    """
+    Extract the part of a document from start_edu to end_edu (1-based, inclusive) as a stand-alone document
+
+    The fragment contains these EDUs and every node which only dominates EDUs in the range, with node IDs
+    renumbered as in rsd2rs3 output and signal tokens renumbered from the first EDU. Relations to nodes outside the
+    range are dropped, so a range which is not a single constituent gives several unattached top-level nodes.
+    Secondary edges are kept if both ends are in the fragment, and signals if any of their tokens are.
+
+    :param doc: an IntervalIndex, or anything accepted by IntervalIndex
+    :param output: one of {rs3,rsd}
+    :param algorithm: dependency conversion algorithm for rsd output, one of {li,chain,hirao}
+    :return: .rs3 or .rsd string
+    """
+    index = doc if isinstance(doc, IntervalIndex) else IntervalIndex(doc)
+    return index.extract(start_edu, end_edu, output=output, algorithm=algorithm)
+
+
+if __name__ == "__main__":
+    p = ArgumentParser(description="Print the part of an .rs3/.rs4 document between two EDUs as an .rs3 or .rsd fragment")
+    p.add_argument("file", help=".rs3 or .rs4 file")
+    p.add_argument("start", type=int, help="first EDU of the fragment (1-based)")
+    p.add_argument("end", type=int, help="last EDU of the fragment (inclusive)")
+    p.add_argument("-o", "--output", choices=["rs3", "rsd"], default="rs3", help="output format")
+    p.add_argument("-a", "--algorithm", choices=["li", "chain", "hirao"], default="li", help="dependency conversion algorithm for rsd output")
+    opts = p.parse_args()
+
+    sys.stdout.write(extract_subtree(opts.file, opts.start, opts.end, output=opts.output, algorithm=opts.algorithm))
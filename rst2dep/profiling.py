@@ -0,0 +1,147 @@
+"""
+profiling.py
+
+Lightweight per-stage timing for rst2dep conversions. Profiling is off by default: conversion functions call
+tick() and tock() around their stages, which return immediately while no Profiler is enabled.
+Example usage:
+
+from rst2dep.profiling import enable_profiling, disable_profiling
+profiler = enable_profiling()
+make_rsd("example.rs3", "", as_text=False)
+disable_profiling()
+print(profiler.report())
+"""
+
+import time, json
+from collections import defaultdict
+
+_profiler = None
+
+
+class Profiler:
+    """
+    Collects cumulative time, call counts and EDU counts per stage
+
+    Stage names have the form 'function/stage', e.g. 'make_rsd/heads'; the total for each instrumented
+    function is recorded under its bare name, e.g. 'make_rsd', and is used for documents and EDUs per second.
+    Other event counts, e.g. parse cache hits in worker processes, can be added with count().
+
+    :param callback: optional function called with (stage, seconds) after every completed stage
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.edus = defaultdict(int)
+        self.counts = defaultdict(int)
+        self.last_stage = None
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+
+    def add(self, stage, seconds, edus=0):
+        self.seconds[stage] += seconds
+        self.calls[stage] += 1
+        self.edus[stage] += edus
+        self.last_stage = stage
+        if self.callback is not None:
+            self.callback(stage, seconds)
+
+    def merge(self, other):
+        """
+        Add the counts of another Profiler or of a dictionary produced by to_dict(), e.g. from a worker process
+        """
+        other = other.to_dict() if isinstance(other, Profiler) else other
+        for stage, vals in other["stages"].items():
+            self.seconds[stage] += vals["seconds"]
+            self.calls[stage] += vals["calls"]
+            self.edus[stage] += vals["edus"]
+        for name, n in other.get("counts", {}).items():
+            self.counts[name] += n
+
+    def reset(self):
+        self.seconds.clear()
+        self.calls.clear()
+        self.edus.clear()
+        self.counts.clear()
+        self.last_stage = None
+
+    def to_dict(self):
+        stages = {}
+        for stage in self.seconds:
+            stages[stage] = {"seconds": round(self.seconds[stage], 6), "calls": self.calls[stage], "edus": self.edus[stage]}
+            if "/" not in stage and self.seconds[stage] > 0:
+                stages[stage]["docs_per_sec"] = round(self.calls[stage] / self.seconds[stage], 2)
+                stages[stage]["edus_per_sec"] = round(self.edus[stage] / self.seconds[stage], 1)
+        output = {"stages": stages}
+        if len(self.counts) > 0:
+            output["counts"] = dict(self.counts)
+        return output
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def report(self):
+        """
+        :return: human readable per-stage breakdown, with each stage's share of its function's total time
+        """
+        lines = []
+        functions = sorted(s for s in self.seconds if "/" not in s)
+        for func in functions:
+            total = self.seconds[func]
+            docs_sec = self.calls[func] / total if total > 0 else 0
+            edus_sec = self.edus[func] / total if total > 0 else 0
+            lines.append(func + ": " + str(self.calls[func]) + " docs, " + str(self.edus[func]) + " EDUs, " +
+                         "%.3f" % total + "s (" + "%.1f" % docs_sec + " docs/s, " + "%.1f" % edus_sec + " EDUs/s)")
+            for stage in [s for s in self.seconds if s.startswith(func + "/")]:  # In pipeline order
+                share = 100 * self.seconds[stage] / total if total > 0 else 0
+                lines.append("  " + stage.split("/", 1)[1].ljust(24) + "%.3f" % self.seconds[stage] + "s  " + "%5.1f" % share + "%")
+        return "\n".join(lines)
+
+
+def enable_profiling(profiler=None, callback=None):
+    """
+    Start collecting stage timings in this process
+
+    :param profiler: an existing Profiler to add to (default: a new one)
+    :param callback: optional function called with (stage, seconds) after every completed stage
+    :return: the active Profiler
+    """
+    global _profiler
+    _profiler = profiler if profiler is not None else Profiler(callback=callback)
+    return _profiler
+
+
+def disable_profiling():
+    global _profiler
+    profiler = _profiler
+    _profiler = None
+    return profiler
+
+
+def get_profiler():
+    return _profiler
+
+
+def tick():
+    """
+    :return: a start time if profiling is enabled, otherwise None
+    """
+    if _profiler is None:
+        return None
+    return time.perf_counter()
+
+
+def tock(stage, start, edus=0):
+    """
+    Record the time since start for stage and return the current time, so that consecutive stages can be chained
+
+    :param stage: stage name, e.g. 'make_rsd/heads'
+    :param start: value returned by tick() or a previous tock(); if None, nothing is recorded
+    :param edus: number of EDUs processed, used for throughput of whole functions
+    """
+    if start is None or _profiler is None:
+        return None
+    now = time.perf_counter()
+    _profiler.add(stage, now - start, edus)
+    return now
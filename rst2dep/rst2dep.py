@@ -7,12 +7,16 @@ to a CoNLL-style dependency representation, a.k.a. .rsd.
 """
 
 
-import re, io, ntpath, collections, sys
+import re, io, ntpath, collections, sys, os
 from argparse import ArgumentParser
 try:
-    from .classes import NODE, SIGNAL, SECEDGE, ParsedToken, read_rst, get_tense, rangify
+    from .classes import NODE, SIGNAL, SECEDGE, ParsedToken, read_rst, get_tense, rangify, bounded_imap, open_file, split_compression
+    from .dep2rst import iter_conllu_docs
+    from .profiling import tick, tock
 except:
-    from classes import NODE, SIGNAL, SECEDGE, ParsedToken, read_rst, get_tense, rangify
+    from classes import NODE, SIGNAL, SECEDGE, ParsedToken, read_rst, get_tense, rangify, bounded_imap, open_file, split_compression
+    from dep2rst import iter_conllu_docs
+    from profiling import tick, tock
 
 # Add hardwired genre identifiers which appear as substring in filenames here
 GENRES = {"_news_":"news","_whow_":"whow","_voyage_":"voyage","_interview_":"interview",
@@ -22,17 +26,42 @@ GENRES = {"_news_":"news","_whow_":"whow","_voyage_":"voyage","_interview_":"int
           "_medical_":"medical","_syllabus_":"syllabus","_poetry_":"poetry"
           }
 
+# Abbreviations for signal types and subtypes in conllu Discourse annotations; unlisted values are kept as is
+SIGTYPES = {"dm":"dm","orphan":"orphan","graphical":"grf","lexical":"lex","morphological":"mrph","numerical":"num",
+            "reference":"ref","semantic":"sem","syntactic":"syn","unsure":"unsure"}
+SUBTYPES = {"items_in_sequence":"seq","quotation_marks":"quot","question_mark":"qmark","parentheses":"paren",
+            "alternate_expression":"alt_expr","indicative_phrase":"ind_phrase","indicative_word":"ind_word",
+            "comparative_reference":"comp_ref","demonstrative_reference":"dem_ref","personal_reference":"pers_ref",
+            "propositional_reference":"prop_ref","attribution_source":"attr_src","lexical_chain":"lex_chain",
+            "parallel_syntactic_construction":"parallel","subject_auxiliary_inversion":"sai"}
+
 
 def abbreviate_signals(signal_string):
     if signal_string == "_":
         return "_"
     parts = signal_string.replace("|", "-").split("-", 2)
     if parts[0] not in ["dm", "orphan"]:
-        parts[1] = subtypes[parts[1]]
-    parts[0] = sigtypes[parts[0]]
+        parts[1] = SUBTYPES.get(parts[1], parts[1])
+    parts[0] = SIGTYPES.get(parts[0], parts[0])
     return "-".join(parts)
 
 
+def convert_rel(relname, relation_set=None):
+    """
+    Convert an rsd relation label to its conllu Discourse form: satellite suffixes are removed,
+    multinuclear relations keep _m, and relation_set optionally maps relation names to another inventory
+    """
+    suffix = ""
+    if relname.endswith("_r"):
+        relname = relname[:-2]
+    elif relname.endswith("_m"):
+        relname = relname[:-2]
+        suffix = "_m"
+    if relation_set is not None:
+        relname = relation_set.get(relname, relname)
+    return relname + suffix
+
+
 def add_feat(field,feat):
     if field == "_":
         return feat
@@ -46,33 +75,54 @@ def add_feat(field,feat):
 
 
 def find_dep_head(nodes, source, exclude, block, initial_deprel, algorithm="li", keep_same_unit=False):
-    parent = nodes[source].parent
-    if parent != "0":
-        if nodes[parent].kind == "multinuc":
-            for child in nodes[parent].children:
-                # Check whether exclude and child are under the same multinuc and exclude is further to the left
-                if nodes[child].left > int(exclude) and nodes[child].left >= nodes[parent].left and int(exclude) >= nodes[parent].left:
+    """
+    Climb from source towards the root until some other EDU is found to serve as the dependency head of exclude
+
+    :return: the head EDU ID, or None if exclude is the root
+    """
+    while True:
+        parent = nodes[source].parent
+        if parent != "0":
+            if nodes[parent].kind == "multinuc":
+                for child in nodes[parent].children:
+                    # Check whether exclude and child are under the same multinuc and exclude is further to the left
+                    if nodes[child].left > int(exclude) and nodes[child].left >= nodes[parent].left and int(exclude) >= nodes[parent].left:
+                        block.append(child)
+        else:
+            # Prevent EDU children of root from being dep head - only multinuc children possible at this point
+            for child in nodes[source].children:
+                if nodes[child].kind == "edu":
                     block.append(child)
-    else:
-        # Prevent EDU children of root from being dep head - only multinuc children possible at this point
-        for child in nodes[source].children:
-            if nodes[child].kind == "edu":
-                block.append(child)
-    candidate = seek_other_edu_child(nodes, nodes[source].parent, exclude, block, initial_deprel, algorithm=algorithm, keep_same_unit=keep_same_unit)
-    if candidate is not None:
-        return candidate
-    else:
+        candidate = seek_other_edu_child(nodes, parent, exclude, block, initial_deprel, algorithm=algorithm, keep_same_unit=keep_same_unit)
+        if candidate is not None:
+            return candidate
         if parent == "0":
             return None
-        else:
-            if parent not in nodes:
-                raise IOError("Node with id " + source + " has parent id " + parent + " which is not listed\n")
-            return find_dep_head(nodes, parent, exclude, block, initial_deprel, algorithm=algorithm, keep_same_unit=keep_same_unit)
+        if parent not in nodes:
+            raise IOError("Node with id " + source + " has parent id " + parent + " which is not listed\n")
+        source = parent
+
+
+def get_left_sibling(nodes, exclude):
+    # Find the closest multinuc sibling to the left of exclude, used by the chain algorithm
+    parent = nodes[exclude].parent
+    siblings = nodes[parent].children if parent in nodes else [n for n in nodes if nodes[n].parent == parent]
+    left_sibling_id = [n for n in siblings if nodes[n].right == nodes[exclude].left - 1 and (nodes[n].dep_rel.endswith("_m") or nodes[nodes[n].parent].leftmost_child == n)]
+    if len(left_sibling_id) > 0:
+        return left_sibling_id[0]
+    # We could have malformed rs3 where the next multinuc child to the left has no intervening hierarchy, meaning that child is not strictly adjacent
+    left_sibling_id = [n for n in siblings if nodes[n].right < nodes[exclude].left - 1 and (nodes[n].dep_rel.endswith("_m") or nodes[nodes[n].parent].leftmost_child == n)]
+    if len(left_sibling_id) > 0:  # Take the unit closest on the left of exclude
+        return sorted(left_sibling_id, key=lambda x: nodes[x].left)[-1]
+    return None
 
 
 def seek_other_edu_child(nodes, source, exclude, block, initial_deprel, algorithm="li", keep_same_unit=False):
     """
-    Recursive function to find some child of a node which is an EDU and does not have the excluded ID
+    Depth first search for some child of a node which is an EDU and does not have the excluded ID
+
+    The search uses an explicit stack of (node, children to search, next child index, left sibling) frames
+    rather than recursion, so arbitrarily deep trees are supported.
 
     :param nodes: dictionary of IDs to NODE objects
     :param source: the source node from which to traverse
@@ -85,60 +135,62 @@ def seek_other_edu_child(nodes, source, exclude, block, initial_deprel, algorith
 
     if source == "0":
         return None
-    else:
-        # Check if this is already an EDU
-        if nodes[source].kind == "edu" and source != exclude and source not in block:
-            return source
-        # Loop through children of this node
-        children_to_search = [child for child in nodes[source].children if child not in nodes[exclude].children and child not in block]
-        if len(children_to_search)>0:
-            if algorithm == "chain" and not initial_deprel.endswith("_r"):
-                children_to_search.sort(key=lambda x: nodes[x].left, reverse=True)
-            elif int(exclude) < int(children_to_search[0]):
-                children_to_search.sort(key=lambda x: int(x))
-            else:
-                children_to_search.sort(key=lambda x: int(x), reverse=True)
-        if algorithm == "chain" and nodes[source].kind == "multinuc":
-            left_sibling_id = [n for n in nodes if nodes[n].right == nodes[exclude].left - 1 and nodes[n].parent == nodes[exclude].parent and (nodes[n].dep_rel.endswith("_m") or nodes[nodes[n].parent].leftmost_child == n)]
-            if len(left_sibling_id) > 0:
-                left_sibling_id = left_sibling_id[0]
-            else:  # We could have malformed rs3 where the next multinuc child to the left has no intervening hierarchy, meaning that child is not strictly adjacent
-                left_sibling_id = [n for n in nodes if nodes[n].right < nodes[exclude].left - 1 and nodes[n].parent == nodes[exclude].parent and (nodes[n].dep_rel.endswith("_m") or nodes[nodes[n].parent].leftmost_child == n)]
-                if len(left_sibling_id) > 0:  # Take the unit closest on the left of exclude
-                    left_sibling_id = sorted(left_sibling_id, key=lambda x: nodes[x].left)[-1]
-
-        for child_id in children_to_search:
-            # Found an EDU child which is not the original caller
-            if nodes[child_id].kind == "edu" and child_id != exclude and (nodes[source].kind != "span" or nodes[child_id].relname == "span") and \
-                    not (nodes[source].kind == "multinuc" and nodes[source].leftmost_child == exclude) and \
-                    (nodes[nodes[child_id].parent].kind not in ["span","multinuc"]):
-                    #not (nodes[child_id].parent == nodes[exclude].parent and nodes[source].kind == "multinuc" and int(child_id) > int(exclude)):  # preclude right pointing rel between multinuc siblings
-                return child_id
-            # Found a non-terminal child
-            elif child_id != exclude:
-                # If it's a span, check below it, following only span relation paths
-                if nodes[source].kind == "span":
-                    if nodes[child_id].relname == "span":
-                        candidate = seek_other_edu_child(nodes, child_id, exclude, block, initial_deprel, algorithm=algorithm, keep_same_unit=keep_same_unit)
-                        if candidate is not None:
-                            return candidate
-                # If it's a multinuc...
-                elif nodes[source].kind == "multinuc":
-                    if algorithm in ["li","hirao"] or initial_deprel.endswith("_r") or (keep_same_unit and "sameunit" in nodes[child_id].relname.lower().replace("_","").replace("-","")):
-                        # In Li et al. conversion, only consider the left most child as representing the multinuc topologically
-                        if child_id == nodes[source].leftmost_child:
-                            candidate = seek_other_edu_child(nodes, child_id, exclude, block, initial_deprel, algorithm=algorithm, keep_same_unit=keep_same_unit)
-                            if candidate is not None:
-                                return candidate
-                    elif algorithm == "chain":  # In chain conversion, consider next multinuc child, which should already be sorted
-                        if nodes[child_id].dep_rel.endswith("_r") and nodes[child_id].parent == source and not nodes[nodes[child_id].parent].leftmost_child == child_id:
-                            # Do not allow traversing against the direction of a satellite relation
-                            continue
-                        if child_id == left_sibling_id or source != nodes[exclude].parent:
-                            candidate = seek_other_edu_child(nodes, child_id, exclude, block, initial_deprel, algorithm=algorithm, keep_same_unit=keep_same_unit)
-                            if candidate is not None:
-                                return candidate
-    return None
+
+    stack = []
+    enter = source
+    while True:
+        if enter is not None:
+            # Check if this is already an EDU
+            if nodes[enter].kind == "edu" and enter != exclude and enter not in block:
+                return enter
+            # Get children of this node to loop through
+            children_to_search = [child for child in nodes[enter].children if child not in nodes[exclude].children and child not in block]
+            if len(children_to_search)>0:
+                if algorithm == "chain" and not initial_deprel.endswith("_r"):
+                    children_to_search.sort(key=lambda x: nodes[x].left, reverse=True)
+                elif int(exclude) < int(children_to_search[0]):
+                    children_to_search.sort(key=lambda x: int(x))
+                else:
+                    children_to_search.sort(key=lambda x: int(x), reverse=True)
+            left_sibling_id = None
+            if algorithm == "chain" and nodes[enter].kind == "multinuc":
+                left_sibling_id = get_left_sibling(nodes, exclude)
+            stack.append([enter, children_to_search, 0, left_sibling_id])
+            enter = None
+
+        if len(stack) == 0:
+            return None
+        frame = stack[-1]
+        source, children_to_search, index, left_sibling_id = frame
+        if index >= len(children_to_search):  # No match below this node, return to its parent's loop
+            stack.pop()
+            continue
+        frame[2] += 1
+        child_id = children_to_search[index]
+
+        # Found an EDU child which is not the original caller
+        if nodes[child_id].kind == "edu" and child_id != exclude and (nodes[source].kind != "span" or nodes[child_id].relname == "span") and \
+                not (nodes[source].kind == "multinuc" and nodes[source].leftmost_child == exclude) and \
+                (nodes[nodes[child_id].parent].kind not in ["span","multinuc"]):
+            return child_id
+        # Found a non-terminal child
+        elif child_id != exclude:
+            # If it's a span, check below it, following only span relation paths
+            if nodes[source].kind == "span":
+                if nodes[child_id].relname == "span":
+                    enter = child_id
+            # If it's a multinuc...
+            elif nodes[source].kind == "multinuc":
+                if algorithm in ["li","hirao"] or initial_deprel.endswith("_r") or (keep_same_unit and "sameunit" in nodes[child_id].relname.lower().replace("_","").replace("-","")):
+                    # In Li et al. conversion, only consider the left most child as representing the multinuc topologically
+                    if child_id == nodes[source].leftmost_child:
+                        enter = child_id
+                elif algorithm == "chain":  # In chain conversion, consider next multinuc child, which should already be sorted
+                    if nodes[child_id].dep_rel.endswith("_r") and nodes[child_id].parent == source and not nodes[nodes[child_id].parent].leftmost_child == child_id:
+                        # Do not allow traversing against the direction of a satellite relation
+                        continue
+                    if child_id == left_sibling_id or source != nodes[exclude].parent:
+                        enter = child_id
 
 
 def get_distance(node, parent, nodes):
@@ -170,43 +222,84 @@ def get_distance(node, parent, nodes):
 
 
 def get_nonspan_rel(nodes,node):
-    if node.parent == "0":  # Reached the root
-        return "ROOT_" + node.id
-    elif nodes[node.parent].kind == "multinuc" and nodes[node.parent].leftmost_child == node.id:
-        return get_nonspan_rel(nodes, nodes[node.parent])
-    elif nodes[node.parent].kind == "multinuc" and nodes[node.parent].leftmost_child != node.id:
-        return node#.relname
-    elif nodes[node.parent].relname != "span":
-        grandparent = nodes[node.parent].parent
-        if grandparent == "0":
+    """
+    Climb from node through span and leftmost multinuc relations to the node carrying its nearest non-span relation
+
+    :return: the NODE with the relation, or 'ROOT_' + node ID if the root is reached first
+    """
+    while True:
+        if node.parent == "0":  # Reached the root
             return "ROOT_" + node.id
-        elif not (nodes[grandparent].kind == "multinuc" and nodes[node.parent].left == nodes[grandparent].left):
-            return nodes[node.parent]#.relname
-        else:
-            return get_nonspan_rel(nodes,nodes[node.parent])
-    else:
-        if node.relname.endswith("_r"):
+        parent = nodes[node.parent]
+        if parent.kind == "multinuc" and parent.leftmost_child == node.id:
+            node = parent
+        elif parent.kind == "multinuc" and parent.leftmost_child != node.id:
             return node#.relname
+        elif parent.relname != "span":
+            grandparent = parent.parent
+            if grandparent == "0":
+                return "ROOT_" + node.id
+            elif not (nodes[grandparent].kind == "multinuc" and parent.left == nodes[grandparent].left):
+                return parent#.relname
+            else:
+                node = parent
         else:
-            return get_nonspan_rel(nodes,nodes[node.parent])
+            if node.relname.endswith("_r"):
+                return node#.relname
+            else:
+                node = parent
+
+
+def relabel_node(nodes, nid):
+    """
+    Find the dependency relation of a node, which is its nearest non-span relation for span and leftmost multinuc children
+
+    :return: tuple of the relation, the ID of the node carrying it and that node's signals (empty if it is the node itself)
+    """
+    node = nodes[nid]
+    new_rel = node.relname
+    sigs = []
+    top_nid = nid
+    if node.parent == "0":
+        new_rel = "ROOT"
+    elif node.relname == "span" or (nodes[node.parent].kind == "multinuc" and nodes[node.parent].leftmost_child == nid):
+        new_rel = get_nonspan_rel(nodes, node)
+        if isinstance(new_rel,str):
+            top_nid = new_rel.split("_")[1]
+            new_rel = "ROOT"
+        else:
+            top_nid = new_rel.id
+        if new_rel != "ROOT":
+            sigs = new_rel.signals
+            new_rel = new_rel.relname
+    return new_rel, top_nid, sigs
 
 
 def make_rsd(rstfile, xml_dep_root="", as_text=False, docname=None, out_mode="conll", algorithm="li", keep_same_unit=False, output_const_nid=False):
     """
     Convert an RST tree to a dependency representation
 
-    :param rstfile: path to an .rs3 or .rs4 file, or a string containing the RST tree if as_text is True
+    :param rstfile: path to an .rs3 or .rs4 file, optionally compressed, or a string containing the RST tree if as_text is True
     :param xml_dep_root: directory containing GUM-style XML files for additional features (use "" if not available)
     :param as_text: whether rstfile is a string containing the RST tree or a file path
     :param docname: optional document name to use for output file name
     :param out_mode: output format, one of {conll,malt}
-    :param algorithm: the algorithm to use for dependency head selection, one of {li,chain,hirao}
-    :param keep_same_unit: if True, retain same-unit multinucs in hirao algorithm / attach them as in li algorithm for chain
+    :param algorithm: the algorithm to use for dependency head selection, one of {li,chain,hirao}, or a list of several
+    :param keep_same_unit: if True, retain same-unit multinucs in hirao algorithm / attach them as in li algorithm for chain;
+                           may also be a list, e.g. [False, True]
     :param output_const_nid: use the fourth column in the output to store the constituent tree original node ID for each relation
-    :return: a string containing the dependency representation if as_text is True, otherwise writes to a file
+    :return: a string containing the dependency representation if as_text is True, otherwise writes to a file; if algorithm
+             or keep_same_unit is a list, the document is parsed once and a dictionary of outputs keyed by
+             (algorithm, keep_same_unit) is returned for every combination
     """
 
+    algorithms = algorithm if isinstance(algorithm, list) else [algorithm]
+    same_units = keep_same_unit if isinstance(keep_same_unit, list) else [keep_same_unit]
+    variants = [(a, su) for a in algorithms for su in same_units]
+
+    t0 = t = tick()
     nodes = read_rst(rstfile,{},as_text=as_text)
+    t = tock("make_rsd/read_rst", t)
 
     text = " ".join([nodes[nid].text for nid in nodes if nodes[nid].kind=="edu"])
     document_tokens = text.split(" ")
@@ -219,11 +312,11 @@ def make_rsd(rstfile, xml_dep_root="", as_text=False, docname=None, out_mode="co
             secedges.append(nodes[nid])
             del nodes[nid]
 
-    out_graph = []
-    if rstfile.endswith("rs3"):
-        out_file = rstfile.replace(".rs3",".rsd")
+    base = rstfile if as_text else split_compression(rstfile)[0]
+    if base.endswith("rs3"):
+        out_file = base.replace(".rs3",".rsd")
     else:
-        out_file = rstfile + ".rsd"
+        out_file = base + ".rsd"
     if docname is not None:
         out_file = docname + ".rsd"
 
@@ -278,53 +371,17 @@ def make_rsd(rstfile, xml_dep_root="", as_text=False, docname=None, out_mode="co
                     break
 
             token_reached += edu.token_count
+    t = tock("make_rsd/features", t)
 
     # Get each node with 'span' relation its nearest non-span relname
     for nid in nodes:
         node = nodes[nid]
-        new_rel = node.relname
-        sigs = []
-        top_nid = nid
-        if node.parent == "0":
-            new_rel = "ROOT"
-        elif node.relname == "span" or (nodes[node.parent].kind == "multinuc" and nodes[node.parent].leftmost_child == nid):
-            new_rel = get_nonspan_rel(nodes, node)
-            if isinstance(new_rel,str):
-                top_nid = new_rel.split("_")[1]
-                new_rel = "ROOT"
-            else:
-                top_nid = new_rel.id
-            if new_rel != "ROOT":
-                sigs = new_rel.signals
-                new_rel = new_rel.relname
+        new_rel, top_nid, sigs = relabel_node(nodes, nid)
         node.dep_rel = new_rel
         node.top_nid = top_nid
         if len(sigs) > 0:
             node.signals = sigs
-
-    for nid in nodes:
-        node = nodes[nid]
-        dep_parent = find_dep_head(nodes, nid, nid, [], node.dep_rel, algorithm=algorithm, keep_same_unit=keep_same_unit)
-        if dep_parent is None:
-            # This is the root
-            dep_parent = "0"
-        if node.kind == "edu":
-            if dep_parent == "0":
-                node.dep_rel = "ROOT"
-            node.dep_parent = dep_parent
-            out_graph.append(node)
-
-    if algorithm == "hirao":  # Re-wire multinuc relation children to point to the multinuc parent
-        for node in out_graph:
-            dep_rel = node.dep_rel
-            while dep_rel.endswith("_m"):
-                if keep_same_unit and ("same-unit" in dep_rel.lower() or "same_unit" in dep_rel.lower() or "sameunit" in dep_rel.lower()):
-                    break
-                if node.dep_parent == "0":
-                    dep_rel = node.dep_rel = "ROOT"
-                else:
-                    dep_rel = node.dep_rel = nodes[node.dep_parent].dep_rel
-                    node.dep_parent = nodes[node.dep_parent].dep_parent
+    t = tock("make_rsd/relabel", t)
 
     # Get head EDU and height per node
     node2head_edu = {}
@@ -356,6 +413,61 @@ def make_rsd(rstfile, xml_dep_root="", as_text=False, docname=None, out_mode="co
 
             if not span_parent and not multinuc_parent:
                 break  # A satellite relation has been traversed, stop looking for nodes headed by this
+    t = tock("make_rsd/heights", t)
+
+    # Algorithm independent relations from relabeling, restored before each conversion
+    relabeled = {nid: nodes[nid].dep_rel for nid in nodes}
+    outputs = {}
+    for variant_algorithm, variant_same_unit in variants:
+        if variant_algorithm == "li" and (variant_algorithm, not variant_same_unit) in outputs:
+            # keep_same_unit does not affect the li algorithm
+            outputs[(variant_algorithm, variant_same_unit)] = outputs[(variant_algorithm, not variant_same_unit)]
+            continue
+        for nid in nodes:
+            nodes[nid].dep_rel = relabeled[nid]
+        outputs[(variant_algorithm, variant_same_unit)] = make_dependencies(nodes, edus, secedges, node2head_edu, target_node2head_edu,
+                                                                           document_tokens, feats, out_mode, variant_algorithm,
+                                                                           variant_same_unit, output_const_nid)
+    tock("make_rsd", t0, edus=len(edus))
+
+    if isinstance(algorithm, list) or isinstance(keep_same_unit, list):
+        return outputs
+    return outputs[variants[0]]
+
+
+def make_dependencies(nodes, edus, secedges, node2head_edu, target_node2head_edu, document_tokens, feats, out_mode="conll",
+                      algorithm="li", keep_same_unit=False, output_const_nid=False):
+    """
+    Find dependency heads for relabeled nodes with one algorithm and serialize them, see make_rsd
+
+    :return: string with the dependency representation
+    """
+    t = tick()
+    out_graph = []
+    for nid in nodes:
+        node = nodes[nid]
+        dep_parent = find_dep_head(nodes, nid, nid, [], node.dep_rel, algorithm=algorithm, keep_same_unit=keep_same_unit)
+        if dep_parent is None:
+            # This is the root
+            dep_parent = "0"
+        if node.kind == "edu":
+            if dep_parent == "0":
+                node.dep_rel = "ROOT"
+            node.dep_parent = dep_parent
+            out_graph.append(node)
+
+    if algorithm == "hirao":  # Re-wire multinuc relation children to point to the multinuc parent
+        for node in out_graph:
+            dep_rel = node.dep_rel
+            while dep_rel.endswith("_m"):
+                if keep_same_unit and ("same-unit" in dep_rel.lower() or "same_unit" in dep_rel.lower() or "sameunit" in dep_rel.lower()):
+                    break
+                if node.dep_parent == "0":
+                    dep_rel = node.dep_rel = "ROOT"
+                else:
+                    dep_rel = node.dep_rel = nodes[node.dep_parent].dep_rel
+                    node.dep_parent = nodes[node.dep_parent].dep_parent
+    t = tock("make_rsd/heads", t)
 
     # Get height distance from dependency parent to child's attachment point in the phrase structure (number of spans)
     for nid in nodes:
@@ -368,6 +480,7 @@ def make_rsd(rstfile, xml_dep_root="", as_text=False, docname=None, out_mode="co
             node.dist = get_distance(node, parent, nodes)
 
     out_graph.sort(key=lambda x: int(x.id))
+    t = tock("make_rsd/distance", t)
 
     output = []
 
@@ -376,6 +489,7 @@ def make_rsd(rstfile, xml_dep_root="", as_text=False, docname=None, out_mode="co
             output.append(node.out_conll(feats=feats,document_tokens=document_tokens, output_const_nid=output_const_nid))
         else:
             output.append(node.out_malt())
+    t = tock("make_rsd/serialize", t)
 
     # Insert secedges if any
     src2secedges = collections.defaultdict(set)
@@ -399,11 +513,11 @@ def make_rsd(rstfile, xml_dep_root="", as_text=False, docname=None, out_mode="co
     for i, line in enumerate(output):
         if str(i+1) in src2secedges:
             fields = line.split("\t")
-            secstr = "|".join(src2secedges[str(i+1)])
+            secstr = "|".join(sorted(src2secedges[str(i+1)]))
             fields[8] = secstr
             if output_const_nid:
                 mapping = []
-                for sec in src2secedges[str(i+1)]:
+                for sec in sorted(src2secedges[str(i+1)]):
                     src = fields[0]
                     trg = sec.split(":")[0]
                     if src + "-" + trg in secedge_mapping:
@@ -413,46 +527,23 @@ def make_rsd(rstfile, xml_dep_root="", as_text=False, docname=None, out_mode="co
         temp.append(line)
 
     output = "\n".join(temp) + "\n"
+    tock("make_rsd/secedges", t)
 
     return output
 
 
-if __name__ == "__main__":
-    desc = "Script to convert Rhetorical Structure Theory trees \n from .rs3 format to a dependency representation.\nExample usage:\n\n" + \
-            "python rst2dep.py <INFILES>"
-    parser = ArgumentParser(description=desc)
-    parser.add_argument("infiles",action="store",help="file name or glob pattern, e.g. *.rs3")
-    parser.add_argument("-c","--corpus_root",action="store",dest="root",default="",help="optional: path to corpus root folder containing a directory dep/ and \n"+
-                                                           "a directory xml/ containing additional corpus formats")
-    parser.add_argument("-p","--print",dest="prnt",action="store_true",help="print output instead of serializing to a file")
-    parser.add_argument("-a","--algorithm",choices=["li","chain","hirao"],help="dependency head algorithm (default: li)",default="li")
-    parser.add_argument("-s","--same_unit",action="store_true",help="retain same-unit multinucs in hirao algorithm / attach them as in li algorithm for chain")
-    parser.add_argument("-n","--node_ids",action="store_true",help="output constituent node IDs in rsd dependency format")
-
-    options = parser.parse_args()
 
-    inpath = options.infiles
-
-    if "*" in inpath:
-        from glob import glob
-        files = glob(inpath)
-    else:
-        files = [inpath]
-
-    for file_ in files:
-        output = make_rsd(file_, options.root, algorithm=options.algorithm, keep_same_unit=options.same_unit, output_const_nid=options.node_ids)
-        if options.prnt:
-            print(output)
-        else:
-            newname = file_.replace("rs3", "rsd").replace("rs4", "rsd")
-            if newname == file_:
-                newname = file_ + ".rsd"
-            with io.open(newname, 'w', encoding="utf8", newline="\n") as f:
-                f.write(output)
-
-
-def make_conllu(rsd, conllu):
-    """Add rsd dependency relations to conllu file in the MISC column Discourse attribute"""
+def make_conllu(rsd, conllu, output_signals=True, output_secedges=True, relation_set=None):
+    """
+    Add rsd dependency relations to conllu data in the MISC column Discourse attribute
+
+    :param rsd: string with the .rsd dependency representation of one document
+    :param conllu: string with the .conllu parse of the same document; tokens must match the EDU tokens of the rsd
+    :param output_signals: whether to append abbreviated signals to each Discourse relation
+    :param output_secedges: whether to add secondary edges as additional ;-separated Discourse relations
+    :param relation_set: optional dictionary mapping relation names to a different relation inventory
+    :return: the conllu string with Discourse annotations at the first token of each EDU
+    """
 
     rsd_spans = {}
     rsd_lines = rsd.split("\n")
@@ -462,7 +553,7 @@ def make_conllu(rsd, conllu):
         if "\t" in line:
             fields = line.split("\t")
             edu_id, content, depth, _, _, _, parent, relname, secedges, signals = fields
-            rsd_spans[toknum] = (content, relname, parent, depth, secedges, signals)
+            rsd_spans[toknum] = (edu_id, relname, parent, depth, secedges, signals)
             toknum += content.strip().count(" ") + 1
 
     output = []
@@ -473,8 +564,8 @@ def make_conllu(rsd, conllu):
             if not "-" in fields[0] and not "." in fields[0]:  # Regular token, not an ellipsis token or supertok
                 if toknum in rsd_spans:
                     rsd_data = rsd_spans[toknum]
-                    sig_data = ":" + "+".join([abbreviate_signals(sig) for sig in rsd_data[5].split(";")]) if output_signals else ""
-                    relname = convert_rel(rsd_data[1], version=relation_set)
+                    sig_data = ":" + "+".join([abbreviate_signals(sig) for sig in rsd_data[5].split(";")]) if output_signals and rsd_data[5] != "_" else ""
+                    relname = convert_rel(rsd_data[1], relation_set=relation_set)
                     if rsd_data[2] == "0":  # ROOT
                         disc = "Discourse=" + relname + ":" + rsd_data[0] + ":" + rsd_data[3]
                     else:
@@ -482,12 +573,77 @@ def make_conllu(rsd, conllu):
                     if rsd_data[4] != "_" and output_secedges:  # Secedges found
                         for secedge in sorted(rsd_data[4].split("|")):
                             secparts = secedge.split(":")
-                            sig_data = ":" + "+".join(sorted([abbreviate_signals(sig) for sig in secparts[-1].split(";")])) if output_signals else ""
-                            disc += ";" + secparts[1] + ":" + rsd_data[0] + "->" + secparts[0] + ":" + secparts[2] + ":" + secparts[3] + sig_data
+                            sig_data = ":" + "+".join(sorted([abbreviate_signals(sig) for sig in secparts[-1].split(";")])) if output_signals and secparts[-1] != "_" else ""
+                            disc += ";" + convert_rel(secparts[1], relation_set=relation_set) + ":" + rsd_data[0] + "->" + secparts[0] + ":" + secparts[2] + ":" + secparts[3] + sig_data
                     misc = add_feat(fields[-1], disc)
                     fields[-1] = misc
                     line = "\t".join(fields)
                 toknum += 1
         output.append(line)
 
-    return "\n".join(output)
\ No newline at end of file
+    return "\n".join(output)
+
+
+def _merge_conllu_doc(job):
+    docname, conllu, rsd_file, kwargs = job
+    if rsd_file is None:
+        return docname, conllu, False
+    with open_file(rsd_file) as f:
+        rsd = f.read()
+    return docname, make_conllu(rsd, conllu, **kwargs), True
+
+
+def merge_discourse(conllu, rsd_files, processes=1, output_signals=True, output_secedges=True, relation_set=None):
+    """
+    Stream multi-document conllu data and add Discourse annotations from a matching .rsd file for each document
+
+    :param conllu: path, file object or string with one or more conllu documents separated by '# newdoc id' comments
+    :param rsd_files: directory containing <docname>.rsd files, or a list of .rsd file paths; either may be compressed
+    :param processes: number of worker processes used to annotate documents in parallel
+    :return: generator of (docname, annotated_conllu, found) tuples in input order; documents without an
+             .rsd file are passed through unchanged with found=False
+    """
+    if isinstance(rsd_files, str):
+        rsd_files = [os.path.join(rsd_files, f) for f in os.listdir(rsd_files) if split_compression(f)[0].endswith(".rsd")]
+    rsd_by_doc = {}
+    for f in rsd_files:
+        name = os.path.basename(split_compression(f)[0])
+        rsd_by_doc[name[:-len(".rsd")] if name.endswith(".rsd") else name] = f
+    kwargs = {"output_signals": output_signals, "output_secedges": output_secedges, "relation_set": relation_set}
+    jobs = ((docname, doc, rsd_by_doc.get(docname), kwargs) for docname, doc in iter_conllu_docs(conllu))
+    for result in bounded_imap(_merge_conllu_doc, jobs, processes=processes):
+        yield result
+
+
+if __name__ == "__main__":
+    desc = "Script to convert Rhetorical Structure Theory trees \n from .rs3 format to a dependency representation.\nExample usage:\n\n" + \
+            "python rst2dep.py <INFILES>"
+    parser = ArgumentParser(description=desc)
+    parser.add_argument("infiles",action="store",help="file name or glob pattern, e.g. *.rs3")
+    parser.add_argument("-c","--corpus_root",action="store",dest="root",default="",help="optional: path to corpus root folder containing a directory dep/ and \n"+
+                                                           "a directory xml/ containing additional corpus formats")
+    parser.add_argument("-p","--print",dest="prnt",action="store_true",help="print output instead of serializing to a file")
+    parser.add_argument("-a","--algorithm",choices=["li","chain","hirao"],help="dependency head algorithm (default: li)",default="li")
+    parser.add_argument("-s","--same_unit",action="store_true",help="retain same-unit multinucs in hirao algorithm / attach them as in li algorithm for chain")
+    parser.add_argument("-n","--node_ids",action="store_true",help="output constituent node IDs in rsd dependency format")
+
+    options = parser.parse_args()
+
+    inpath = options.infiles
+
+    if "*" in inpath:
+        from glob import glob
+        files = glob(inpath)
+    else:
+        files = [inpath]
+
+    for file_ in files:
+        output = make_rsd(file_, options.root, algorithm=options.algorithm, keep_same_unit=options.same_unit, output_const_nid=options.node_ids)
+        if options.prnt:
+            print(output)
+        else:
+            newname = file_.replace("rs3", "rsd").replace("rs4", "rsd")
+            if newname == file_:
+                newname = file_ + ".rsd"
+            with io.open(newname, 'w', encoding="utf8", newline="\n") as f:
+                f.write(output)
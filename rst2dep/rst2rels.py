@@ -2,14 +2,22 @@ from stanza.pipeline.core import UnsupportedProcessorError
 
 try:
 	from .rst2dep import make_rsd
+	from .classes import bounded_imap, open_file, get_docname
+	from .feature_extraction import get_dep_file
+	from .profiling import tick, tock
+	from .batch import shard_tag, in_shard, atomic_open
 except:
 	from rst2dep import make_rsd
+	from classes import bounded_imap, open_file, get_docname
+	from feature_extraction import get_dep_file
+	from profiling import tick, tock
+	from batch import shard_tag, in_shard, atomic_open
 from stanza.utils.conll import CoNLL
 from collections import defaultdict
 from argparse import ArgumentParser
 from depedit import DepEdit
 import stanza
-import re
+import re, io, os, sys
 
 stanza_tokenizer = None
 nlp = None
@@ -94,20 +102,27 @@ def format_sent(arg1_sid, sents):
 	return " ".join(output)
 
 
-def make_rels(rsd_str, conll_str, docname, corpus="eng.erst.gum", include_secedges=True, outmode="standoff",
-			  coarse_rels=False, dedup=True, whitespace_tokenize=False):
+def get_rels_header(outmode="standoff"):
+	"""
+	:return: list of the .rels column names written by make_rels in outmode
+	"""
 	if outmode == "standoff":
-		header = ["doc", "unit1_toks", "unit2_toks", "unit1_txt", "unit2_txt", "s1_toks", "s2_toks", "unit1_sent",
-				  "unit2_sent", "dir", "orig_label", "label"]
+		return ["doc", "unit1_toks", "unit2_toks", "unit1_txt", "unit2_txt", "s1_toks", "s2_toks", "unit1_sent",
+				"unit2_sent", "dir", "orig_label", "label"]
 	elif outmode == "standoff_reltype":
-		header = ["doc", "unit1_toks", "unit2_toks", "unit1_txt", "unit2_txt", "u1_raw", "u2_raw", "s1_toks", "s2_toks", "unit1_sent",
-					"unit2_sent", "dir", "rel_type", "orig_label", "label"]
+		return ["doc", "unit1_toks", "unit2_toks", "unit1_txt", "unit2_txt", "u1_raw", "u2_raw", "s1_toks", "s2_toks", "unit1_sent",
+				"unit2_sent", "dir", "rel_type", "orig_label", "label"]
 	elif outmode == "standoff_key":
-		header = ["doc", "unit1_toks", "unit2_toks", "unit1_txt", "unit2_txt", "s1_toks", "s2_toks", "unit1_sent",
-				  "unit2_sent", "dir", "rel_key", "label"]
-	else:
-		header = ["doc", "start_toks", "pre", "arg1", "mid", "arg2", "post", "dir", "label"]
+		return ["doc", "unit1_toks", "unit2_toks", "unit1_txt", "unit2_txt", "s1_toks", "s2_toks", "unit1_sent",
+				"unit2_sent", "dir", "rel_key", "label"]
+	return ["doc", "start_toks", "pre", "arg1", "mid", "arg2", "post", "dir", "label"]
+
+
+def make_rels(rsd_str, conll_str, docname, corpus="eng.erst.gum", include_secedges=True, outmode="standoff",
+			  coarse_rels=False, dedup=True, whitespace_tokenize=False):
+	header = get_rels_header(outmode)
 
+	t0 = t = tick()
 	seen_keys = set([])
 
 	sent_map = {}
@@ -144,7 +159,7 @@ def make_rels(rsd_str, conll_str, docname, corpus="eng.erst.gum", include_secedg
 					continue
 				if toknum not in no_space_after:
 					no_space_after[toknum] = False
-				if fields[9] == "SpaceAfter=No":
+				if "SpaceAfter=No" in fields[9].split("|"):
 					no_space_after[toknum] = True
 				conllu_toks.append(fields[1])
 				if fields[0] == "1":
@@ -154,6 +169,7 @@ def make_rels(rsd_str, conll_str, docname, corpus="eng.erst.gum", include_secedg
 				toknum += 1
 		s_ends[snum] = toknum - 1
 		snum += 1
+	t = tock("make_rels/read_conllu", t)
 
 	rsd_lines = rsd_str.split("\n")
 
@@ -245,6 +261,7 @@ def make_rels(rsd_str, conll_str, docname, corpus="eng.erst.gum", include_secedg
 					same_unit_data[parent] = (start,int(edu_id)," ".join([text,more_text]))
 				else:
 					raise IOError("LTR same unit!\n")
+	t = tock("make_rels/read_rsd", t)
 
 	output = ["\t".join(header)]
 	for edu_id in parents:
@@ -391,6 +408,8 @@ def make_rels(rsd_str, conll_str, docname, corpus="eng.erst.gum", include_secedg
 
 				indices = ";".join([pre_toks, arg1_toks, mid_toks, arg2_toks, post_toks])
 				output.append("\t".join([docname,indices,pre,arg1,mid,arg2,post,direction,rel]))
+	tock("make_rels/pairs", t)
+	tock("make_rels", t0, edus=len(texts))
 
 	return output
 
@@ -490,12 +509,92 @@ def get_mwt_rewrites(conll_sents):
 	return mwt_rewrites
 
 
-def rst2conllu(rst, docname, lang_code="en", whitespace_tokenize=False):
+def set_seg_label(misc, label):
+	# Replace any existing Seg= annotation and keep MISC attributes sorted alphabetically
+	if misc == "_":
+		return label
+	misc_segments = [m for m in misc.split("|") if not m.startswith("Seg=")]
+	misc_segments.append(label)
+	misc_segments.sort()
+	return "|".join(misc_segments)
+
+
+def segment_gold_conllu(rsd, conll_str):
+	"""
+	Add Seg=B-seg/Seg=O labels from rsd EDUs to existing gold conllu data, aligning EDUs and tokens by their
+	non-whitespace characters. Multiword token ranges are matched against their surface form.
+
+	:param rsd: .rsd string for the document
+	:param conll_str: gold .conllu string for the same document, e.g. from a corpus root dep/ directory
+	:return: tuple of the segmented conllu string and a list of (word, seg_label) pairs
+	"""
+	edu_list = [line.split("\t")[1] for line in rsd.split("\n") if "\t" in line]
+	edu_index = 0
+	current_edu = None
+	mwt_surface = {}
+	words = []
+	output = []
+	for line in conll_str.replace("\r", "").strip().split("\n"):
+		if "\t" in line:
+			fields = line.split("\t")
+			if "-" in fields[0]:
+				start, end = fields[0].split("-")
+				mwt_surface[start] = fields[1]
+				for i in range(int(start) + 1, int(end) + 1):
+					mwt_surface[str(i)] = ""
+			elif "." not in fields[0]:
+				text = mwt_surface[fields[0]] if fields[0] in mwt_surface else fields[1]
+				if current_edu is None or current_edu == "":
+					if edu_index >= len(edu_list):
+						raise IOError("EDU error: conllu has more tokens than rsd EDUs at token " + fields[1] + "\n")
+					current_edu = re.sub(r'\s', "", edu_list[edu_index])
+					edu_index += 1
+					label = "Seg=B-seg"
+				else:
+					label = "Seg=O"
+				if not current_edu.startswith(text):
+					raise IOError("EDU error: ", current_edu, text)
+				current_edu = current_edu[len(text):]
+				fields[9] = set_seg_label(fields[9], label)
+				words.append((fields[1], label))
+				line = "\t".join(fields)
+		elif line.strip() == "":
+			mwt_surface = {}
+		output.append(line)
+	if edu_index < len(edu_list) or (current_edu is not None and current_edu != ""):
+		raise IOError("EDU error: rsd EDUs extend beyond the end of the gold conllu tokens\n")
+	return "\n".join(output) + "\n\n", words
+
+
+def get_gold_conllu(rst, docname, corpus_root):
+	rsd_from_rst = make_rsd(rst,"", as_text=True, algorithm="chain", keep_same_unit=True)
+	rsd_from_rst = filter_string(rsd_from_rst)
+	with open_file(get_dep_file(docname, corpus_root)) as f:
+		conll_str = f.read()
+	return segment_gold_conllu(rsd_from_rst, conll_str)
+
+
+def rst2conllu(rst, docname, lang_code="en", whitespace_tokenize=False, corpus_root=""):
+	"""
+	Convert an RST document to .conllu with Seg= EDU boundary labels
+
+	If corpus_root is given, the gold tokenization, multiword tokens, sentence splits and parses in
+	corpus_root/dep/<docname>.conllu (or .conll10) are used and no NLP is run; otherwise stanza is used.
+	"""
+
+	t0 = t = tick()
+	if corpus_root != "":
+		conll_str, words = get_gold_conllu(rst, docname, corpus_root)
+		tock("rst2conllu/gold_conllu", t)
+		tock("rst2conllu", t0, edus=sum(1 for _, label in words if label == "Seg=B-seg"))
+		return conll_str
 
 	rsd_from_rst = make_rsd(rst,"", as_text=True, algorithm="chain", keep_same_unit=True)
 	rsd_from_rst = filter_string(rsd_from_rst)
+	t = tock("rst2conllu/make_rsd", t)
 
 	merged_sentences, edu_list = get_ssplit(rsd_from_rst, lang_code=lang_code, whitespace_tokenize=whitespace_tokenize)
+	t = tock("rst2conllu/ssplit", t)
 
 	global nlp
 	if nlp is None:
@@ -512,7 +611,9 @@ def rst2conllu(rst, docname, lang_code="en", whitespace_tokenize=False):
 
 	if whitespace_tokenize:
 		merged_sentences = [s.strip().split(" ") for s in merged_sentences]
+	t = tock("rst2conllu/stanza_load", t)
 	proccessed_document = nlp(merged_sentences)
+	t = tock("rst2conllu/stanza", t)
 
 	# returnable object
 	dicts = proccessed_document.to_dict()
@@ -575,12 +676,20 @@ def rst2conllu(rst, docname, lang_code="en", whitespace_tokenize=False):
 		sentence_string = "\n".join(token_lines)
 		sentence_strings.append(sentence_string)
 	conll_str = "\n\n".join(sentence_strings) # conll format string
+	t = tock("rst2conllu/seg_labels", t)
 	conll_str = d.run_depedit(conll_str, sent_id=True, sent_text=True, docname=docname, filename=docname)
 	conll_str += "\n\n"
+	tock("rst2conllu/depedit", t)
+	tock("rst2conllu", t0, edus=len(edu_list))
 	return conll_str
 
 
-def rst2tok(rst, docname, lang_code="en", whitespace_tokenize=False):
+def rst2tok(rst, docname, lang_code="en", whitespace_tokenize=False, corpus_root=""):
+
+	if corpus_root != "":  # Use gold tokenization instead of stanza
+		_, words = get_gold_conllu(rst, docname, corpus_root)
+		tok_format = [str(i + 1) + "\t" + word + "\t_\t_\t_\t_\t_\t_\t_\t" + label for i, (word, label) in enumerate(words)]
+		return "# newdoc id = " + docname + "\n" + "\n".join(tok_format) + "\n\n"
 
 	rsd_from_rst = make_rsd(rst,"", as_text=True, algorithm="chain")
 	rsd_from_rst = filter_string(rsd_from_rst)
@@ -639,11 +748,27 @@ def rst2tok(rst, docname, lang_code="en", whitespace_tokenize=False):
 	return tok_str
 
 
-def rst2rels(rst, docname="document", lang_code="en", whitespace_tokenize=False):
+def conllu2tok(conll_str, docname):
+	"""
+	Derive the .tok format of a document from its rst2conllu output, keeping the words and their Seg= labels
+	"""
+	tok_format = []
+	for line in conll_str.split("\n"):
+		if "\t" not in line:
+			continue
+		fields = line.split("\t")
+		if "." in fields[0] or "-" in fields[0]:  # supertok or ellipsis token
+			continue
+		labels = [m for m in fields[9].split("|") if m.startswith("Seg=")]
+		tok_format.append(str(len(tok_format) + 1) + "\t" + fields[1] + "\t_\t_\t_\t_\t_\t_\t_\t" + (labels[0] if len(labels) > 0 else "Seg=O"))
+	return "# newdoc id = " + docname + "\n" + "\n".join(tok_format) + "\n\n"
+
+
+def rst2rels(rst, docname="document", lang_code="en", whitespace_tokenize=False, corpus_root=""):
 
 	rsd_from_rst = make_rsd(rst,"", as_text=True, algorithm="chain")
 	rsd_from_rst = filter_string(rsd_from_rst)
-	conll_str = rst2conllu(rst, docname, lang_code=lang_code, whitespace_tokenize=whitespace_tokenize)
+	conll_str = rst2conllu(rst, docname, lang_code=lang_code, whitespace_tokenize=whitespace_tokenize, corpus_root=corpus_root)
 	rels_format = make_rels(rsd_from_rst, conll_str, docname, outmode="standoff_reltype", whitespace_tokenize=whitespace_tokenize)
 	rels_str = "\n".join(rels_format) # rels format string
 
@@ -670,6 +795,86 @@ def filter_string(string):
 	return string
 
 
+
+def read_splits(split_file):
+	"""
+	Read a split list with one 'docname split' pair per line, e.g. 'GUM_news_worship train'
+
+	:return: dictionary of split names to lists of document names, in the order they are listed
+	"""
+	splits = defaultdict(list)
+	with open_file(split_file) as f:
+		lines = f.read().split("\n")
+	for line in lines:
+		line = line.split("#")[0].strip()
+		if line == "":
+			continue
+		docname, split = line.split()
+		splits[split].append(docname)
+	return splits
+
+
+def _export_doc(job):
+	rst_file, docname, corpus, coarse_rels, lang_code, whitespace_tokenize, corpus_root = job
+	with open_file(rst_file) as f:
+		rst = f.read()
+	conll_str = rst2conllu(rst, docname, lang_code=lang_code, whitespace_tokenize=whitespace_tokenize, corpus_root=corpus_root)
+	# Reuse the conllu parse for .tok and .rels instead of parsing again as rst2tok and rst2rels would
+	tok_str = conllu2tok(conll_str, docname)
+	rsd_from_rst = filter_string(make_rsd(rst, "", as_text=True, algorithm="chain"))
+	rels_format = make_rels(rsd_from_rst, conll_str, docname, corpus=corpus, outmode="standoff_reltype", coarse_rels=coarse_rels,
+							whitespace_tokenize=whitespace_tokenize)
+	return rels_format, tok_str, conll_str
+
+
+def export_disrpt(rst_files, splits, outdir, corpus="eng.erst.gum", lang_code="en", whitespace_tokenize=False,
+				  processes=1, buffer_size=1 << 20, corpus_root="", shard=None, coarse_rels=False):
+	"""
+	Write DISRPT .rels, .tok and .conllu split files for a corpus of .rs3/.rs4 files
+
+	:param rst_files: list of .rs3/.rs4 file paths, optionally compressed; document names are the file names without extensions
+	:param splits: dictionary of split names to ordered lists of document names, or a split list file for read_splits()
+	:param outdir: directory for the output files, named <corpus>_<split>.<ext>
+	:param corpus: DISRPT corpus name, used for file names and passed to make_rels for relation mappings in rel_mapping
+	:param coarse_rels: use the relations mapped for the corpus as the .rels label column, as in make_rels
+	:param processes: number of worker processes; each worker loads its own stanza pipelines
+	:param corpus_root: optional corpus root with gold dep/*.conllu parses to use instead of stanza
+	:param buffer_size: write buffer size in bytes for the streamed output files
+	:param shard: optional tuple (i, N) if rst_files is shard i of N; outputs are then named
+				  <corpus>_<split>.shard<i>of<N>.<ext> for merging with batch.merge_shards()
+	:return: dictionary of split names to the number of documents written
+	"""
+	if isinstance(splits, str):
+		splits = read_splits(splits)
+	files_by_doc = {}
+	for file_ in rst_files:
+		files_by_doc[get_docname(file_)] = file_
+
+	written = {}
+	for split in sorted(splits):
+		docnames = [d for d in splits[split] if d in files_by_doc]
+		for docname in splits[split]:
+			if docname not in files_by_doc and (shard is None or in_shard(docname, shard)):
+				sys.stderr.write("! Document " + docname + " listed in split " + split + " not found, skipping\n")
+		jobs = ((files_by_doc[d], d, corpus, coarse_rels, lang_code, whitespace_tokenize, corpus_root) for d in docnames)
+		prefix = os.path.join(outdir, corpus + "_" + split)
+		if shard is not None:
+			prefix += "." + shard_tag(shard)
+		with atomic_open(prefix + ".rels", buffering=buffer_size) as rels_out, \
+				atomic_open(prefix + ".tok", buffering=buffer_size) as tok_out, \
+				atomic_open(prefix + ".conllu", buffering=buffer_size) as conllu_out:
+			rels_out.write("\t".join(get_rels_header("standoff_reltype")) + "\n")  # Header row only once per split, even if empty
+			for rels_format, tok_str, conll_str in bounded_imap(_export_doc, jobs, processes=processes):
+				if len(rels_format) > 1:
+					rels_out.write("\n".join(rels_format[1:]) + "\n")
+				tok_out.write(tok_str)
+				conllu_out.write(conll_str)
+		written[split] = len(docnames)
+		sys.stderr.write("o Wrote " + str(len(docnames)) + " documents to " + prefix + ".{rels,tok,conllu}\n")
+
+	return written
+
+
 if __name__ == "__main__":
 	desc = "Script to convert Rhetorical Structure Theory trees \n in the .rs3 format to the disrpt .rels format, .tok format, and .conllu format.\nExample usage:\n\n" + "python rst2rels.py <INFILES>"
 	parser = ArgumentParser(description=desc)
@@ -1,6 +1,20 @@
-from rst2dep import make_rsd
-from dep2rst import rsd2rs3, conllu2rsd
-import io
+from rst2dep import make_rsd, make_conllu
+from rst2rels import export_disrpt, get_rels_header, rel_mapping, rst2conllu, rst2tok, rst2rels, segment_gold_conllu
+from dep2rst import rsd2rs3, conllu2rsd, stream_conllu2rsd, stream_rsd2rs3, iter_documents, find_crossing_edges
+from profiling import enable_profiling, disable_profiling
+from validate import validate_document
+from evaluate import evaluate_pair, evaluate_corpus, match_files, score_constituents
+from synthetic import make_synthetic_rs3
+from feature_extraction import CorpusIndex, load_corpus_index, get_tok_info, CORPUS_INDEXES
+from classes import read_rst, get_parse_cache_stats, open_file, get_docname
+from incremental import IncrementalDocument
+from docindex import DocumentIndex
+from corpus import save_corpus, load_corpus
+from search import SearchIndex, build_index, document_postings
+from tensors import RelationVocab, document_arrays, write_shards, load_shard, get_document
+from intervals import IntervalIndex, extract_subtree
+from batch import Manifest, Journal, DocumentBundle, atomic_open, limited_imap, options_fingerprint, get_shard, merge_disrpt_shards
+import io, re, os, sys, json, time, random, tempfile, shutil
 
 # Basic RST
 rsd = io.open("example.rsd",encoding="utf8").read()
@@ -17,6 +31,439 @@ print("o conllu conversion success")
 assert rsd == rsd_c
 print("o rsd conversion success")
 
+# Projectivity
+assert find_crossing_edges(rsd) == []
+assert find_crossing_edges([(1, 0), (2, 4), (3, 1), (4, 1)]) == [((2, 4), (3, 1))]
+print("o projectivity check success")
+
+# Deep trees beyond the recursion limit
+deep = make_synthetic_rs3(3000, multinuc=0, split="right")
+assert make_rsd(deep,"",as_text=True).count("\n") == 3000
+print("o deep tree success")
+
+# Multi-document conllu streaming
+multidoc = conllu + conllu.replace("# newdoc id = GUM_news_worship", "# newdoc id = second_doc")
+docs = list(stream_conllu2rsd(multidoc, processes=2))
+assert [d[0] for d in docs] == ["GUM_news_worship", "second_doc"]
+assert all(d[1] == rsd for d in docs)
+print("o multi-document conllu success")
+
+# Discourse annotation of conllu from rsd
+no_discourse = re.sub(r'Discourse=[^|\t\n]*(\||(?=\n))', '', conllu).replace("\t\n", "\t_\n")
+assert make_conllu(rsd, no_discourse) == conllu
+print("o rsd to conllu merge success")
+
+# Gold tokenization and parses from a corpus root with dep/ and xml/ files
+gum_xml = ['<text id="GUM_news_worship">']
+for sent in conllu.strip().split("\n\n"):
+    gum_xml.append('<s type="' + re.search(r'# s_type = (\S+)', sent).group(1) + '">')
+    gum_xml += [f[1] + "\t" + f[4] + "\t" + f[2] for f in [line.split("\t") for line in sent.split("\n")] if f[0].isdigit()]
+    gum_xml.append("</s>")
+gum_xml = "\n".join(gum_xml + ["</text>"]) + "\n"
+corpus_root = tempfile.mkdtemp()
+for subdir, ext, data in [("dep", ".conllu", conllu), ("xml", ".xml", gum_xml), ("rst", ".rs3", rs3_b)]:
+    os.makedirs(os.path.join(corpus_root, subdir))
+    with io.open(os.path.join(corpus_root, subdir, "GUM_news_worship" + ext), "w", encoding="utf8", newline="\n") as f:
+        f.write(data)
+gold = rst2conllu(rs3_b, "GUM_news_worship", corpus_root=corpus_root)
+gold_rows = [line.split("\t") for line in gold.split("\n") if "\t" in line]
+conllu_rows = [line.split("\t") for line in conllu.split("\n") if "\t" in line]
+assert [row[:9] for row in gold_rows] == [row[:9] for row in conllu_rows]  # Gold tokens and parses are kept
+assert all([m for m in row[9].split("|") if not m.startswith("Seg=")] == [m for m in gold_row[9].split("|") if m != "_"]
+           for gold_row, row in zip(conllu_rows, gold_rows) if "-" not in row[0])
+labels = [row[9].split("Seg=")[1].split("|")[0] for row in gold_rows if "-" not in row[0] and "." not in row[0]]
+assert labels.count("B-seg") == len(re.findall(r'<segment', rs3_b)) and labels[0] == "B-seg"
+tok = rst2tok(rs3_b, "GUM_news_worship", corpus_root=corpus_root)
+assert [line.split("\t")[9] for line in tok.split("\n") if "\t" in line] == ["Seg=" + label for label in labels]
+assert rst2rels(rs3_b, "GUM_news_worship", corpus_root=corpus_root).split("\n")[1].split("\t")[:3] == ["GUM_news_worship", "1-3", "4-10"]
+try:  # EDUs which do not match the gold tokens are an error
+    segment_gold_conllu(rsd.replace("Greek court rules", "Greek court rules now"), conllu)
+    assert False
+except IOError:
+    pass
+feats = make_rsd(rs3_b, corpus_root, as_text=True, docname="GUM_news_worship").split("\n")[0].split("\t")[5]
+assert "head_tok=rule" in feats and "stype=decl" in feats  # Token features from dep/ and xml/
+print("o gold corpus root success")
+
+# Indexed and cached corpus root features
+cache_file = os.path.join(corpus_root, "tokens.cache")
+unindexed = [(t.text, t.pos, t.lemma, t.s_type, t.abs_head) for t in get_tok_info("GUM_news_worship", corpus_root)]
+index = load_corpus_index(corpus_root, cache_file=cache_file)
+try:
+    assert index.from_cache == set() and os.path.exists(cache_file)
+    assert [(t.text, t.pos, t.lemma, t.s_type, t.abs_head) for t in get_tok_info("GUM_news_worship", corpus_root)] == unindexed
+    assert make_rsd(rs3_b, corpus_root, as_text=True, docname="GUM_news_worship").split("\n")[0].split("\t")[5] == feats
+    index = CorpusIndex(corpus_root, cache_file=cache_file)  # Reloaded from the cache
+    assert index.from_cache == {"GUM_news_worship"}
+    assert [(t.text, t.pos, t.lemma, t.s_type, t.abs_head) for t in index.get_tokens("GUM_news_worship")] == unindexed
+    with io.open(cache_file, "rb") as f:
+        cached = f.read()
+    with io.open(cache_file, "wb") as f:  # A cache written by another Python version is ignored and rewritten
+        f.write(cached.replace(sys.implementation.cache_tag.encode("utf8"), b"cpython-00", 1))
+    assert CorpusIndex(corpus_root, cache_file=cache_file).from_cache == set()
+    assert CorpusIndex(corpus_root, cache_file=cache_file).from_cache == {"GUM_news_worship"}
+    # A dep/ file without its xml/ file is left out of the index, and only fails when that document is converted
+    io.open(os.path.join(corpus_root, "dep", "orphan.conllu"), "w", encoding="utf8").write(conllu)
+    index = load_corpus_index(corpus_root, cache_file=cache_file)
+    assert "orphan" not in index and index.from_cache == {"GUM_news_worship"}
+    try:
+        get_tok_info("orphan", corpus_root)
+        assert False
+    except IOError:
+        pass
+    assert "orphan" not in load_corpus_index(corpus_root, docnames=["GUM_news_worship"], cache_file=cache_file)
+finally:
+    os.remove(os.path.join(corpus_root, "dep", "orphan.conllu"))
+    del CORPUS_INDEXES[os.path.normpath(corpus_root)]
+print("o corpus root index success")
+
+# DISRPT split export from the corpus root
+try:
+    rst_file = os.path.join(corpus_root, "rst", "GUM_news_worship.rs3")
+    rel_mapping["tst.rst.test"] = {"attribution": "attribution", "background": "background", "circumstance": "background",
+                                   "concession": "contrast", "contrast": "contrast", "preparation": "organization", "result": "cause"}
+    outdir = os.path.join(corpus_root, "out")
+    os.makedirs(outdir)
+    written = export_disrpt([rst_file], {"dev": ["GUM_news_worship", "missing"], "test": []}, outdir, corpus="tst.rst.test",
+                            corpus_root=corpus_root, coarse_rels=True)
+    assert written == {"dev": 1, "test": 0}
+    with io.open(os.path.join(outdir, "tst.rst.test_test.rels"), encoding="utf8") as f:  # Empty splits keep the header
+        assert f.read() == "\t".join(get_rels_header("standoff_reltype")) + "\n"
+    with io.open(os.path.join(outdir, "tst.rst.test_dev.conllu"), encoding="utf8") as f:
+        assert f.read() == rst2conllu(rs3_b, "GUM_news_worship", corpus_root=corpus_root)
+    with io.open(os.path.join(outdir, "tst.rst.test_dev.tok"), encoding="utf8") as f:
+        assert f.read() == rst2tok(rs3_b, "GUM_news_worship", corpus_root=corpus_root)
+    with io.open(os.path.join(outdir, "tst.rst.test_dev.rels"), encoding="utf8") as f:
+        rows = [line.split("\t") for line in f.read().strip().split("\n")]
+    assert rows[0][-2:] == ["orig_label", "label"] and len(rows) > 1
+    assert all(row[-1] == rel_mapping["tst.rst.test"][row[-2]] for row in rows[1:])
+    assert any(row[-2] == "circumstance" and row[-1] == "background" for row in rows[1:])
+    try:  # Relations missing from a corpus mapping are an error
+        export_disrpt([rst_file], {"dev": ["GUM_news_worship"]}, outdir, corpus="eng.rst.rstdt", corpus_root=corpus_root)
+        assert False
+    except IOError:
+        pass
+finally:
+    del rel_mapping["tst.rst.test"]
+    shutil.rmtree(corpus_root)
+print("o DISRPT export success")
+
+# Profiling hooks do not change output
+profiler = enable_profiling()
+assert make_rsd(rs3,"",as_text=True) == rsd and rsd2rs3(rsd) == rs3_b
+disable_profiling()
+assert profiler.calls["make_rsd"] == 1 and profiler.edus["rsd2rs3"] == 14 and "make_rsd/heads" in profiler.seconds
+print("o profiling success")
+
+# Structural round trip validation
+assert validate_document(rs3_b)["status"] == "ok"
+print("o round trip validation success")
+
+# Several algorithms from one parse
+outputs = make_rsd(rs3, "", as_text=True, algorithm=["li", "chain", "hirao"], keep_same_unit=[False, True])
+assert outputs[("li", False)] == rsd and len(outputs) == 6
+assert all(outputs[(a, su)] == make_rsd(rs3, "", as_text=True, algorithm=a, keep_same_unit=su) for a, su in outputs)
+print("o multi-algorithm conversion success")
+
+# Cached parses are not affected by conversions modifying nodes
+hits = get_parse_cache_stats()["hits"]
+nodes = read_rst(rs3_b, {}, as_text=True)
+nodes["1"].dep_rel = "changed"
+nodes["1"].children.append("x")
+assert make_rsd(rs3_b, "", as_text=True) == rsd and read_rst(rs3_b, {}, as_text=True)["1"].children == []
+assert get_parse_cache_stats()["hits"] == hits + 3
+print("o parse cache success")
+
+# Incremental conversion after edits
+doc = IncrementalDocument(rs3_b, as_text=True, algorithm="chain")
+assert doc.rsd() == make_rsd(rs3_b, "", as_text=True, algorithm="chain")
+satellites = [nid for nid in doc.nodes if doc.nodes[nid].relname.endswith("_r")]
+for nid in satellites[:3]:
+    assert len(doc.relabel(nid, "cause")) > 0 and doc.verify() == []
+changed = doc.reparent(satellites[-1], doc.nodes[satellites[0]].parent, "elaboration")
+doc.add_signal(satellites[0], "dm", "dm", "1")
+assert doc.verify() == []
+doc = IncrementalDocument(make_synthetic_rs3(8, seed=0), as_text=True)
+doc.reparent("10", "9")  # Moves the ancestors of EDU 2's dependency head
+assert doc.verify() == []
+extra = doc.to_rs3().replace("</body>", '<segment id="99">extra words</segment></body>', 1)
+doc.to_rs3 = lambda: extra  # An EDU missing from the incremental output is a difference too
+assert [(nid, line) for nid, line, _ in doc.verify()] == [(None, None)]
+
+def is_contiguous(doc, nid, parent):
+    # Whether attaching nid to parent keeps a single tree whose nodes all dominate contiguous EDUs
+    parents = {n: doc.nodes[n].parent for n in doc.nodes}
+    parents[nid] = parent
+    edus = {n: [] for n in parents}
+    for edu in doc.edus:
+        probe = edu
+        while probe != "0":
+            edus[probe].append(int(edu))
+            probe = parents[probe]
+    return list(parents.values()).count("0") == 1 and all(len(e) > 0 and max(e) - min(e) + 1 == len(e) for e in edus.values())
+
+for seed in range(10):
+    rng = random.Random(seed)
+    for algorithm in ["li", "chain", "hirao"]:
+        doc = IncrementalDocument(make_synthetic_rs3(12, secedges=3, signals=6, seed=seed), as_text=True, algorithm=algorithm)
+        rels = {"_r": sorted(r[:-2] for r in doc.rel_hash if doc.rel_hash[r] == "rst"),
+                "_m": sorted(r[:-2] for r in doc.rel_hash if doc.rel_hash[r] == "multinuc" and r != "same-unit_m")}
+        for _ in range(20):
+            nid = rng.choice(list(doc.nodes))
+            suffix = doc.nodes[nid].relname[-2:]
+            if suffix not in rels or doc.nodes[nid].relname == "same-unit_m":
+                continue
+            parent = rng.choice(list(doc.nodes))
+            try:
+                if suffix == "_r" and rng.random() < 0.5 and nid not in doc.get_ancestors([parent]) and is_contiguous(doc, nid, parent):
+                    doc.reparent(nid, parent)
+                else:
+                    doc.relabel(nid, rng.choice(rels[suffix]))
+            except IOError:  # Edits leaving a secedge without a head EDU are undone
+                pass
+            assert doc.verify() == []
+print("o incremental conversion success")
+
+# Incremental build manifest
+tmp = tempfile.mkdtemp()
+try:
+    out_file = os.path.join(tmp, "example.rsd")
+    io.open(out_file, "w", encoding="utf8").write(rsd)
+    fingerprint = options_fingerprint({"algorithm": "li"})
+    manifest = Manifest(tmp)
+    assert not manifest.is_current("example.rs3", [out_file], fingerprint)
+    manifest.record("example.rs3", [out_file], fingerprint)
+    assert Manifest(tmp).is_current("example.rs3", [out_file], fingerprint)
+    assert not Manifest(tmp).is_current("example.rs3", [out_file], options_fingerprint({"algorithm": "chain"}))
+    # Later entries are appended as lines, and an entry cut off by a crash is ignored
+    manifest.record("example.rsd", [out_file], fingerprint)
+    with io.open(manifest.path, "a", encoding="utf8") as f:
+        f.write('{"file": "example.conllu", "hash"')
+    assert len(io.open(manifest.path, encoding="utf8").read().split("\n")) == 3
+    assert sorted(Manifest(tmp).entries) == sorted(os.path.abspath(f) for f in ["example.rs3", "example.rsd"])
+    manifest.save()
+    assert io.open(manifest.path, encoding="utf8").read().count("\n") == 1 and Manifest(tmp).is_current("example.rsd", [out_file], fingerprint)
+    with io.open(manifest.path, "w", encoding="utf8") as f:  # Indented JSON as written by earlier versions
+        f.write(json.dumps({"version": "dev", "files": manifest.entries}, indent=1))
+    assert Manifest(tmp).is_current("example.rs3", [out_file], fingerprint)
+finally:
+    shutil.rmtree(tmp)
+print("o incremental build manifest success")
+
+# Sharded conversion and merging in canonical document order
+files = ["corpus/doc" + str(i) + ".rs3" for i in range(20)]
+shards = [get_shard(files, (i, 3)) for i in range(1, 4)]
+assert sorted(sum(shards, [])) == sorted(files) and get_shard(list(reversed(files)), (2, 3)) == list(reversed(shards[1]))
+tmp = tempfile.mkdtemp()
+try:
+    tok = "# newdoc id = a\n1\tGreek\n\n"
+    io.open(os.path.join(tmp, "c.shard1of2.tok"), "w", encoding="utf8").write(tok.replace("= a", "= b"))
+    io.open(os.path.join(tmp, "c.shard2of2.tok"), "w", encoding="utf8").write(tok + tok.replace("= a", "= c"))
+    shard_files = [os.path.join(tmp, "c.shard" + str(i) + "of2.tok") for i in [1, 2]]
+    assert merge_disrpt_shards(shard_files, os.path.join(tmp, "c.tok"), "tok", order=["c", "a", "b"]) == 3
+    assert io.open(os.path.join(tmp, "c.tok"), encoding="utf8").read() == tok.replace("= a", "= c") + tok + tok.replace("= a", "= b")
+finally:
+    shutil.rmtree(tmp)
+print("o sharding success")
+
+# Resumable runs with atomic outputs
+tmp = tempfile.mkdtemp()
+try:
+    out_file = os.path.join(tmp, "example.rsd")
+    try:
+        with atomic_open(out_file) as f:
+            f.write(rsd[:100])
+            raise MemoryError
+    except MemoryError:
+        pass
+    assert os.listdir(tmp) == []
+    journal = Journal(tmp, "options")
+    with atomic_open(out_file) as f:
+        f.write(rsd)
+    journal.complete("example.rs3", [out_file])
+    journal.fail("example.rs4", "KeyError: '9'")
+    with io.open(journal.path, "a", encoding="utf8") as f:  # Cut off by a crash
+        f.write('{"file": "example.rsd", "outputs": [')
+    assert len(io.open(journal.path, encoding="utf8").read().split("\n")) == 3
+    assert Journal(tmp, "options", resume=True).is_done("example.rs3")
+    assert list(Journal(tmp, "options", resume=True).failed) == [os.path.abspath("example.rs4")]
+    assert not Journal(tmp, "options", resume=True).is_done("example.rs4")
+    assert not Journal(tmp, "other options", resume=True).is_done("example.rs3")
+    assert journal.finish() == 1 and os.path.exists(journal.retry_path)
+    assert io.open(journal.path, encoding="utf8").read().count("\n") == 1
+finally:
+    shutil.rmtree(tmp)
+print("o resume journal success")
+
+# Per-document time and memory limits
+results = list(limited_imap(time.sleep, [0, 30, 0], processes=2, timeout=0.5))
+assert results[0] == results[2] == (None, None) and results[1][1].startswith("Timeout")
+results = list(limited_imap(bytearray, [10, 10 ** 10], memory=500 * 1024 * 1024))
+assert len(results[0][0]) == 10 and results[1][1].startswith("MemoryError")
+print("o document limits success")
+
+# Compressed input and output
+tmp = tempfile.mkdtemp()
+try:
+    for ext in [".gz", ".bz2", ".xz"]:
+        rs3_file = os.path.join(tmp, "example.rs3" + ext)
+        with atomic_open(rs3_file) as f:
+            f.write(rs3_b)
+        assert make_rsd(rs3_file, "") == rsd and get_docname(rs3_file) == "example"
+        with open_file(rs3_file) as f:
+            assert f.read() == rs3_b
+    conllu_file = os.path.join(tmp, "multidoc.conllu.gz")
+    with open_file(conllu_file, "w") as f:
+        f.write(multidoc)
+    assert [d[1] for d in stream_conllu2rsd(conllu_file)] == [rsd, rsd]
+finally:
+    shutil.rmtree(tmp)
+print("o compressed files success")
+
+# Concatenated and bundled multi-document output
+tmp = tempfile.mkdtemp()
+try:
+    for name in ["corpus.rsd.gz", "corpus.zip", "corpus.tar.xz"]:
+        with DocumentBundle(os.path.join(tmp, name)) as bundle:
+            bundle.write("doc1", "doc1.rsd", rsd)
+            bundle.write("doc2", "doc2.rsd", rsd)
+        assert [d for d, _ in iter_documents(os.path.join(tmp, name))] == ["doc1", "doc2"]
+        assert list(stream_rsd2rs3(os.path.join(tmp, name))) == [("doc1", rs3_b), ("doc2", rs3_b)]
+    assert sorted(os.listdir(tmp)) == ["corpus.rsd.gz", "corpus.tar.xz", "corpus.zip"]
+finally:
+    shutil.rmtree(tmp)
+print("o multi-document bundle success")
+
+# Offset index for random access into multi-document files
+tmp = tempfile.mkdtemp()
+try:
+    rsd_file = os.path.join(tmp, "corpus.rsd")
+    with DocumentBundle(rsd_file) as bundle:
+        for docname in ["doc1", "doc2", "doc3"]:
+            bundle.write(docname, docname + ".rsd", rsd)
+    with DocumentIndex(rsd_file) as index:
+        assert index.docnames() == ["doc1", "doc2", "doc3"] and "doc4" not in index
+        assert rsd2rs3(index["doc2"]) == rs3_b
+    assert os.path.exists(rsd_file + ".idx")
+    with DocumentIndex(rsd_file) as index:  # Loaded from the sidecar
+        assert [d for d, _ in iter_documents(index)] == ["doc1", "doc2", "doc3"]
+    pairs = match_files(rsd_file, rsd_file)
+    assert pairs[1] == ((rsd_file, "doc2"), (rsd_file, "doc2"))
+    assert evaluate_pair(*pairs[1])["uas"] == len(rsd.strip().split("\n"))
+    scores = evaluate_corpus(pairs + [("example.rs3", "missing.rsd")])  # Counts summed over documents, one error
+    assert scores["docs"] == 3 and scores["edus"] == 3 * len(rsd.strip().split("\n")) and scores["las"] == 1.0
+    assert scores["full"] == {"p": 1.0, "r": 1.0, "f1": 1.0} and len(scores["errors"]) == 1
+    assert "edus" not in evaluate_corpus(pairs, dependencies=False) and evaluate_corpus([])["docs"] == 0
+finally:
+    shutil.rmtree(tmp)
+print("o offset index success")
+
+# Binary corpus files
+tmp = tempfile.mkdtemp()
+try:
+    rel_hash = {}
+    nodes = read_rst(make_synthetic_rs3(40, secedges=3, signals=10, seed=2), rel_hash, as_text=True)
+    corpus_file = os.path.join(tmp, "corpus.npz")
+    assert save_corpus([("synthetic", (nodes, rel_hash)), ("example", "example.rs3"), ("example_rsd", "example.rsd")], corpus_file) == 3
+    loaded_hash = {}
+    corpus = load_corpus(corpus_file, loaded_hash)
+    assert list(corpus) == ["synthetic", "example", "example_rsd"] and rel_hash.items() <= loaded_hash.items()
+    for nid in nodes:
+        node, loaded = nodes[nid], corpus["synthetic"][nid]
+        assert [str(s) for s in node.signals] == [str(s) for s in loaded.signals]
+        assert {k: v for k, v in node.__dict__.items() if k != "signals"} == {k: v for k, v in loaded.__dict__.items() if k != "signals"}
+    assert [n.kind for n in corpus["synthetic"].values()].count("secedge") == 3
+    assert [n.text for n in corpus["example"].values() if n.kind == "edu"] == [n.text for n in corpus["example_rsd"].values() if n.kind == "edu"]
+    assert list(load_corpus(corpus_file, docnames={"example"})) == ["example"]
+finally:
+    shutil.rmtree(tmp)
+print("o binary corpus success")
+
+# NumPy array export
+tmp = tempfile.mkdtemp()
+try:
+    vocab = RelationVocab()
+    arrays = document_arrays(rs3_b, vocab, as_text=True)
+    assert arrays["heads"].tolist() == [int(line.split("\t")[6]) for line in rsd.strip().split("\n")]
+    assert [vocab.labels[r] for r in arrays["rels"]] == [line.split("\t")[7] for line in rsd.strip().split("\n")]
+    assert arrays["edu_offsets"][-1] == len(" ".join(line.split("\t")[1] for line in rsd.strip().split("\n")).split(" "))
+    assert arrays["parents"][arrays["node_ids"].tolist().index(1)] >= 0 and (arrays["parents"] == -1).sum() == 1
+    shards = write_shards([("doc1", arrays), ("doc2", document_arrays(rsd, vocab, as_text=True)), ("doc3", arrays)], tmp, vocab, shard_size=2)
+    assert len(shards) == 2 and RelationVocab.load(os.path.join(tmp, "vocab.json")).labels == vocab.labels
+    shard = load_shard(shards[0])
+    assert shard["docnames"] == ["doc1", "doc2"] and (get_document(shard, 1)["heads"] == arrays["heads"]).all()
+    assert RelationVocab(vocab.labels, frozen=True).get_id("unseen_r") == -1
+finally:
+    shutil.rmtree(tmp)
+print("o array export success")
+
+# Relation and signal search index
+tmp = tempfile.mkdtemp()
+try:
+    sig_rsd = "1\tAlthough the dog barked\t0\t_\t_\t_\t2\tconcession_r\t3:cause:1:0:dm-because-8-_\tdm-although-1-_;graphical-layout-_-_\n" + \
+              "2\tthe cat slept\t0\t_\t_\t_\t0\tROOT\t_\t_\n" + "3\tbecause it was tired\t0\t_\t_\t_\t2\tcause_r\t_\t_\n"
+    postings = document_postings(sig_rsd)
+    assert ("dm:although", 1, 2, 1, 1) in postings and ("signal:graphical-layout", 1, 2, 1, 4) in postings
+    assert ("secedge:cause", 1, 3, 1, 4) in postings and ("dm:because", 1, 3, 8, 8) in postings and ("rel:ROOT", 2, 0, 5, 7) in postings
+    for name, data in [("sig.rsd", sig_rsd), ("example.rsd", rsd)]:
+        with io.open(os.path.join(tmp, name), "w", encoding="utf8", newline="\n") as f:
+            f.write(data)
+    files = [os.path.join(tmp, "sig.rsd"), os.path.join(tmp, "example.rsd")]
+    index_file = os.path.join(tmp, "index.npz")
+    index = build_index(files[:1], index_file)
+    assert index.query(["dm:although", "rel:concession", "signal:graphical-layout"]) == [("sig", 1, 2, 1, 1)]
+    assert index.query(["rel:concession", "dm:because"]) == [] and index.query(["secedge:cause", "dm:because"]) == [("sig", 1, 3, 1, 4)]
+    assert index.query(["rel:concession_r", "secedge:*"], by="edu") == [("sig", 1, 2, 1, 4)]
+    index = build_index(files, index_file)  # Only example.rsd is added
+    assert sorted(index.sources) == ["example", "sig"] and len(SearchIndex.load(index_file).query("rel:attribution")) == 3
+    index = build_index(files, index_file)  # Nothing changed, so postings are not unpacked
+    assert index.docs is None and index.query(["dm:Although", "rel:concession"]) == [("sig", 1, 2, 1, 1)]
+    index = build_index(files[1:], index_file)  # sig.rsd is dropped
+    assert sorted(index.sources) == ["example"] and SearchIndex.load(index_file).query("dm:although") == []
+    assert len(index.query("rel:attribution")) == 3
+finally:
+    shutil.rmtree(tmp)
+print("o search index success")
+
+# Interval index and sub-document extraction
+idx = IntervalIndex("example.rs3")
+assert [n.id for n in idx.covering(1, 14)] == idx.rows[:2] and idx.smallest_covering(3).kind == "edu"
+assert all(idx.coverage[n.id][0] <= 10 and idx.coverage[n.id][1] >= 12 for n in idx.covering(10, 12))
+assert all(10 <= idx.coverage[n.id][0] and idx.coverage[n.id][1] <= 14 for n in idx.contained(10, 14))
+assert idx.edu_range(1, idx.tok_offsets[-1]) == (1, 14)
+full = extract_subtree(idx, 1, 14)
+assert validate_document(full)["status"] == "ok" and make_rsd(full, "", as_text=True) == make_rsd(rs3_b, "", as_text=True)
+assert validate_document(extract_subtree(rs3_b, 10, 14))["status"] == "ok"
+assert len(extract_subtree(idx, 10, 14, output="rsd").strip().split("\n")) == 5
+assert "<segment id=\"1\">" + idx.edus[2].text + "</segment>" in rsd2rs3(extract_subtree(idx, 3, 3, output="rsd"))
+# Secondary edges refer to XML IDs, which need not be the ones read_rst assigns
+sec_rs3 = re.sub(r'(id|parent|source|target)="([0-9]+)"', lambda m: m.group(1) + '="' + str(int(m.group(2)) + 100) + '"', make_synthetic_rs3(12, secedges=3, seed=1))
+sec_full = extract_subtree(sec_rs3, 1, 12)
+assert sec_full.count("<secedge ") == 3 and validate_document(sec_full)["status"] == "ok"
+for start, end in [(0, 3), (5, 4), (1, 15)]:
+    try:
+        extract_subtree(idx, start, end)
+        assert False
+    except IOError:
+        pass
+try:
+    IntervalIndex(read_rst(sec_rs3, {}, as_text=True))
+    assert False
+except IOError:
+    pass
+print("o interval index success")
+
+# Evaluation of identical parses
+scores = evaluate_pair("example.rs3", "example.rsd")
+assert scores["uas"] == scores["las"] == scores["edus"] == 14 and scores["relation"] == scores["full"] == scores["gold"] == scores["pred"]
+joint_rs3 = '<rst><header><relations><rel name="joint" type="TYPE"/></relations></header><body>SEGMENTS</body></rst>'
+gold_rs3 = joint_rs3.replace("TYPE", "multinuc").replace("SEGMENTS", '<segment id="1" parent="3" relname="joint">a</segment>'
+                                                         '<segment id="2" parent="3" relname="joint">b</segment><group id="3" type="multinuc"/>')
+pred_rs3 = joint_rs3.replace("TYPE", "rst").replace("SEGMENTS", '<segment id="1">a</segment><segment id="2" parent="1" relname="joint">b</segment>')
+# EDU 1 only matches in nuclearity and EDU 2 only in relation, so neither matches fully
+assert score_constituents(gold_rs3, pred_rs3) == {"gold": 2, "pred": 2, "span": 2, "nuclearity": 1, "relation": 1, "full": 0}
+print("o evaluation success")
+
 # eRST
 rs4 = io.open("example.rs4",encoding="utf8").read()
 rsd = make_rsd(rs4,"",as_text=True)
@@ -0,0 +1,346 @@
+"""
+search.py
+
+Inverted index over the relations, signals and secondary edges of a corpus, for queries such as all concession
+relations signaled by the DM 'although', or all EDU pairs with a graphical-layout signal. Documents are indexed from
+their .rsd representation, and each indexed term maps to postings of (document, EDU, head EDU, token range), where
+EDU and head are the dependent and head of the relation or secondary edge. Terms are:
+
+  rel:<relation>            primary relation of an EDU, without the _r/_m suffix, e.g. rel:concession or rel:ROOT
+  secedge:<relation>        secondary edge from an EDU to its target EDU
+  signal:<type>             any signal of a given type, e.g. signal:graphical
+  signal:<type>-<subtype>   e.g. signal:graphical-layout
+  dm:<tokens>               lowercased tokens of a dm or orphan signal, e.g. dm:although
+
+The index is built incrementally, skipping files which have not changed since the last build, and persisted as a
+.npz file of typed arrays. Example usage:
+
+python search.py build gum.index.npz "rst/*.rs3"
+python search.py query gum.index.npz rel:concession dm:although
+python search.py query gum.index.npz rel:concession dm:although "secedge:*" --by edu
+"""
+
+import io, os, sys
+from collections import defaultdict
+from glob import glob
+from argparse import ArgumentParser
+import numpy as np
+try:
+    from .rst2dep import make_rsd
+    from .dep2rst import conllu2rsd, iter_documents, sig2dict
+    from .classes import open_file, get_docname, split_compression, bounded_imap
+    from .corpus import StringTable, unpack_strings
+    from .docindex import file_signature
+except ImportError:
+    from rst2dep import make_rsd
+    from dep2rst import conllu2rsd, iter_documents, sig2dict
+    from classes import open_file, get_docname, split_compression, bounded_imap
+    from corpus import StringTable, unpack_strings
+    from docindex import file_signature
+
+INDEX_MAGIC = "rst2dep-search"
+INDEX_VERSION = 1
+POSTING_COLUMNS = ["doc", "term", "edu", "head", "tok_start", "tok_end"]
+
+
+def strip_suffix(relname):
+    return relname[:-2] if relname.endswith(("_r", "_m")) else relname
+
+
+def signal_terms(signal_string):
+    """
+    :return: tuple of the terms for one rsd signal string, and the first and last token it covers (0 if none)
+    """
+    sig = sig2dict(signal_string)
+    terms = ["signal:" + sig["type"]]
+    if sig["type"] in ["dm", "orphan"]:
+        terms.append("dm:" + sig["subtype"].lower())
+    else:
+        terms.append("signal:" + sig["type"] + "-" + sig["subtype"])
+    toks = [int(t) for t in sig["toks"].split(",")] if sig["toks"] not in ["", "_"] else [0]
+    return terms, min(toks), max(toks)
+
+
+def document_postings(rsd):
+    """
+    :param rsd: rsd string of one document
+    :return: list of (term, edu, head, tok_start, tok_end) postings; token numbers are 1-based document token
+             positions, and postings without signal tokens use the token range of the dependent EDU
+    """
+    postings = []
+    tok_start = 1
+    for line in rsd.split("\n"):
+        if "\t" not in line:
+            continue
+        fields = line.split("\t")
+        edu, head = int(fields[0]), int(fields[6])
+        tok_end = tok_start + fields[1].count(" ")
+        postings.append(("rel:" + strip_suffix(fields[7]), edu, head, tok_start, tok_end))
+        relations = [(head, fields[9])]
+        if fields[8] != "_":
+            for secedge in fields[8].split("|"):
+                target, secrel, _, _, sec_signals = secedge.split(":", 4)
+                postings.append(("secedge:" + strip_suffix(secrel), edu, int(target), tok_start, tok_end))
+                relations.append((int(target), sec_signals))
+        for pair_head, signals in relations:
+            if signals in ["_", ""]:
+                continue
+            for signal_string in signals.split(";"):
+                terms, sig_start, sig_end = signal_terms(signal_string)
+                if sig_start == 0:
+                    sig_start, sig_end = tok_start, tok_end
+                for term in terms:
+                    postings.append((term, edu, pair_head, sig_start, sig_end))
+        tok_start = tok_end + 1
+    return postings
+
+
+def read_rsd_documents(path, algorithm="li"):
+    """
+    :return: list of (docname, rsd) tuples for an .rs3, .rs4, .rsd or .conllu file, which may contain several
+             documents with '# newdoc id' comments
+    """
+    base = split_compression(path)[0]
+    with open_file(path) as f:
+        data = f.read()
+    if base.endswith((".rs3", ".rs4")):
+        return [(get_docname(path), make_rsd(data, "", algorithm=algorithm, as_text=True))]
+    docs = []
+    for docname, doc in iter_documents(data):
+        docname = docname if docname is not None else get_docname(path)
+        docs.append((docname, conllu2rsd(doc) if base.endswith(".conllu") else doc))
+    return docs
+
+
+def _index_file(job):
+    path, algorithm = job
+    return [(docname, document_postings(rsd)) for docname, rsd in read_rsd_documents(path, algorithm)]
+
+
+class SearchIndex:
+    """
+    Inverted index from relation, signal and secondary edge terms to postings
+
+    Documents are added or replaced with add_document; query arrays are rebuilt on the next query after a change.
+    """
+    def __init__(self):
+        self.docs = {}  # docname -> list of postings, or None for a loaded index until get_docs unpacks its arrays
+        self.sources = {}  # docname -> (source file, file signature)
+        self.arrays = None
+
+    def get_docs(self):
+        """
+        :return: dictionary of docname -> list of postings, unpacked from the arrays of a loaded index on first use
+        """
+        if self.docs is None:
+            terms = sorted(self.terms, key=self.terms.get)
+            docs = {docname: [] for docname in self.docnames}
+            cols = [self.arrays[name].tolist() for name in POSTING_COLUMNS]
+            for doc, term, edu, head, tok_start, tok_end in zip(*cols):
+                docs[self.docnames[doc]].append((terms[term], edu, head, tok_start, tok_end))
+            self.docs = docs
+        return self.docs
+
+    def add_document(self, docname, postings, source="", signature=""):
+        """
+        :param postings: list of postings from document_postings, replacing any earlier postings of docname
+        """
+        self.get_docs()[docname] = postings
+        self.sources[docname] = (source, signature)
+        self.arrays = None
+
+    def remove_document(self, docname):
+        if docname in self.sources:
+            del self.get_docs()[docname]
+            del self.sources[docname]
+            self.arrays = None
+
+    def build_arrays(self):
+        strings = StringTable()
+        docs = self.get_docs()
+        docnames = list(docs)
+        columns = {name: [] for name in POSTING_COLUMNS}
+        for doc_id, docname in enumerate(docnames):
+            for term, edu, head, tok_start, tok_end in docs[docname]:
+                for name, val in zip(POSTING_COLUMNS, [doc_id, strings.add(term), edu, head, tok_start, tok_end]):
+                    columns[name].append(val)
+        arrays = {name: np.array(columns[name], dtype=np.int32) for name in POSTING_COLUMNS}
+        # Rows sorted by term, so that the postings of term t are order[term_offsets[t]:term_offsets[t + 1]]
+        arrays["order"] = np.argsort(arrays["term"], kind="stable").astype(np.int32)
+        arrays["term_offsets"] = np.searchsorted(arrays["term"][arrays["order"]], np.arange(len(strings.strings) + 1)).astype(np.int64)
+        self.arrays = arrays
+        self.terms = {term: i for i, term in enumerate(strings.strings)}
+        self.docnames = docnames
+
+    def get_arrays(self):
+        if self.arrays is None:
+            self.build_arrays()
+        return self.arrays
+
+    def get_terms(self, prefix=""):
+        """
+        :return: dictionary of indexed terms starting with prefix and their posting counts
+        """
+        arrays = self.get_arrays()
+        counts = np.diff(arrays["term_offsets"])
+        return {term: int(counts[i]) for term, i in self.terms.items() if term.startswith(prefix)}
+
+    def postings(self, term):
+        """
+        :param term: indexed term, or field:* for all terms of a field, e.g. secedge:*
+        :return: array of posting row numbers
+        """
+        arrays = self.get_arrays()
+        if term.endswith(":*"):
+            ids = [i for t, i in self.terms.items() if t.startswith(term[:-1])]
+        else:
+            field, _, value = term.partition(":")
+            if field in ["rel", "secedge"]:
+                value = strip_suffix(value)
+            elif field == "dm":
+                value = value.lower()
+            ids = [self.terms[field + ":" + value]] if field + ":" + value in self.terms else []
+        parts = [arrays["order"][arrays["term_offsets"][i]:arrays["term_offsets"][i + 1]] for i in ids]
+        return np.concatenate(parts) if len(parts) > 0 else np.zeros(0, dtype=np.int32)
+
+    def join_keys(self, rows, by):
+        arrays = self.get_arrays()
+        keys = (arrays["doc"][rows].astype(np.int64) << 42) | (arrays["edu"][rows].astype(np.int64) << 21)
+        if by == "pair":
+            keys |= arrays["head"][rows].astype(np.int64)
+        return keys
+
+    def query(self, terms, by="pair"):
+        """
+        Find relations matching all terms
+
+        :param terms: list of terms, see the module docstring; field:* matches any term of a field
+        :param by: 'pair' to require all terms on the same EDU pair, i.e. the same relation or secondary edge, or
+                   'edu' to require them on relations from the same dependent EDU
+        :return: list of (docname, edu, head, tok_start, tok_end) tuples from the postings of the first term
+        """
+        if isinstance(terms, str):
+            terms = [terms]
+        rows = self.postings(terms[0])
+        keys = self.join_keys(rows, by)
+        for term in terms[1:]:
+            keys_found = self.join_keys(self.postings(term), by)
+            mask = np.isin(keys, keys_found)
+            rows, keys = rows[mask], keys[mask]
+        arrays = self.arrays
+        return [(self.docnames[doc], edu, head, tok_start, tok_end) for doc, edu, head, tok_start, tok_end in
+                zip(*[arrays[name][rows].tolist() for name in ["doc", "edu", "head", "tok_start", "tok_end"]])]
+
+    def save(self, path):
+        """
+        Write the index to a .npz file, atomically
+        """
+        arrays = dict(self.get_arrays())
+        strings = StringTable()
+        for term in sorted(self.terms, key=self.terms.get):
+            strings.add(term)
+        arrays["terms"], arrays["term_string_offsets"] = strings.to_arrays()
+        docs = StringTable()
+        for docname in self.docnames:
+            docs.add(docname)
+        arrays["docnames"], arrays["docname_offsets"] = docs.to_arrays()
+        sources = StringTable()
+        for docname in self.docnames:
+            sources.strings.append("\t".join(self.sources[docname]))
+        arrays["sources"], arrays["source_offsets"] = sources.to_arrays()
+        arrays["magic"] = np.array(list(INDEX_MAGIC.encode("ascii")), dtype=np.uint8)
+        arrays["version"] = np.array([INDEX_VERSION], dtype=np.int32)
+        tmp_file = path + ".tmp"
+        try:
+            with io.open(tmp_file, "wb") as f:
+                np.savez(f, **arrays)
+        except BaseException:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+        os.replace(tmp_file, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read an index written by save; queries use the stored arrays directly, and per-document postings are only
+        unpacked if documents are added or removed
+        """
+        with np.load(path, allow_pickle=False) as data:
+            if "magic" not in data.files or data["magic"].tobytes() != INDEX_MAGIC.encode("ascii"):
+                raise IOError(path + " is not an rst2dep search index\n")
+            if int(data["version"][0]) > INDEX_VERSION:
+                raise IOError(path + " has index format version " + str(int(data["version"][0])) + ", but this rst2dep version reads up to " + str(INDEX_VERSION) + "\n")
+            arrays = {name: data[name] for name in POSTING_COLUMNS + ["order", "term_offsets"]}
+            terms = unpack_strings(data["terms"], data["term_string_offsets"])
+            docnames = unpack_strings(data["docnames"], data["docname_offsets"])
+            sources = unpack_strings(data["sources"], data["source_offsets"])
+        index = cls()
+        index.arrays = arrays
+        index.terms = {term: i for i, term in enumerate(terms)}
+        index.docnames = docnames
+        index.docs = None
+        index.sources = {docname: tuple(source.split("\t", 1)) for docname, source in zip(docnames, sources)}
+        return index
+
+
+def build_index(files, path=None, algorithm="li", processes=1):
+    """
+    Build or update a search index
+
+    :param files: list of .rs3, .rs4, .rsd or .conllu files; multi-document .rsd and .conllu files are supported
+    :param path: optional index file; if it exists, only new or changed files are indexed, documents of files which are
+                 no longer in files are removed, and the result is saved to it
+    :param algorithm: dependency conversion algorithm for constituent inputs, one of {li,chain,hirao}
+    :return: SearchIndex
+    """
+    index = SearchIndex.load(path) if path is not None and os.path.exists(path) else SearchIndex()
+    indexed = set(index.sources.values())
+    source_docs = defaultdict(list)
+    for docname, (source, signature) in index.sources.items():
+        source_docs[source].append(docname)
+    file_set = set(files)
+    dropped = [source for source in source_docs if source not in file_set]
+    for source in dropped:
+        for docname in source_docs[source]:
+            index.remove_document(docname)
+    jobs = [f for f in files if (f, file_signature(f)) not in indexed]
+    for f, docs in zip(jobs, bounded_imap(_index_file, ((f, algorithm) for f in jobs), processes=processes)):
+        signature = file_signature(f)
+        for docname in source_docs[f]:
+            if docname in index.sources and index.sources[docname][0] == f:  # Not re-indexed from another file since
+                index.remove_document(docname)
+        for docname, postings in docs:
+            index.add_document(docname, postings, source=f, signature=signature)
+    if len(dropped) > 0:
+        sys.stderr.write("o Removed the documents of " + str(len(dropped)) + " files which are no longer indexed\n")
+    if len(jobs) > 0:
+        sys.stderr.write("o Indexed " + str(len(jobs)) + " new or changed files\n")
+    if path is not None and (len(jobs) + len(dropped) > 0 or not os.path.exists(path)):
+        index.save(path)
+    return index
+
+
+if __name__ == "__main__":
+    p = ArgumentParser(description="Build and query an index of relations, signals and secondary edges")
+    p.add_argument("command", choices=["build", "query", "terms"], help="build or update an index, query it, or list its terms")
+    p.add_argument("index", help="index file, e.g. gum.index.npz")
+    p.add_argument("args", nargs="*", help="input files or glob patterns for build, terms for query, or a term prefix for terms")
+    p.add_argument("-a", "--algorithm", choices=["li", "chain", "hirao"], default="li", help="dependency conversion algorithm for .rs3/.rs4 inputs")
+    p.add_argument("-j", "--processes", type=int, default=1, help="number of worker processes for build")
+    p.add_argument("--by", choices=["pair", "edu"], default="pair", help="whether query terms must match the same EDU pair or the same dependent EDU")
+    opts = p.parse_args()
+
+    if opts.command == "build":
+        files = []
+        for pattern in opts.args:
+            files += sorted(glob(pattern)) if "*" in pattern else [pattern]
+        index = build_index(files, opts.index, algorithm=opts.algorithm, processes=opts.processes)
+        sys.stderr.write("o " + str(len(index.sources)) + " documents in " + opts.index + "\n")
+    elif opts.command == "terms":
+        prefix = opts.args[0] if len(opts.args) > 0 else ""
+        for term, count in sorted(SearchIndex.load(opts.index).get_terms(prefix).items()):
+            print(term + "\t" + str(count))
+    else:
+        for docname, edu, head, tok_start, tok_end in SearchIndex.load(opts.index).query(opts.args, by=opts.by):
+            print("\t".join([docname, str(edu), str(head), str(tok_start) + "-" + str(tok_end)]))
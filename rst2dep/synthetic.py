@@ -0,0 +1,202 @@
+"""
+synthetic.py
+
+Generates random but well-formed synthetic RST documents in the .rs3/.rs4 formats for benchmarking
+and stress testing. Trees are built iteratively, so very large and very deep documents can be produced.
+Example usage:
+
+python synthetic.py -n 500 --multinuc 0.3 --secedges 10 --signals 50 > synthetic.rs4
+"""
+
+import random
+from collections import deque
+from argparse import ArgumentParser
+try:
+    from .rst2dep import make_rsd
+except ImportError:
+    from rst2dep import make_rsd
+
+RST_RELATIONS = ["elaboration", "attribution", "background", "cause", "concession", "condition", "purpose", "evaluation"]
+MULTINUC_RELATIONS = ["joint", "contrast", "sequence", "same-unit"]
+SIGNAL_TYPES = [("dm", "dm"), ("graphical", "layout"), ("lexical", "indicative_word"), ("reference", "personal_reference"),
+                ("semantic", "repetition"), ("syntactic", "relative_clause")]
+WORDS = ["the", "court", "ruled", "that", "people", "may", "worship", "ancient", "gods", "at", "sites", "but", "church",
+         "is", "critical", "of", "this", "because", "it", "was", "banned", "today", "many", "religions", "use", "aspects"]
+
+
+def make_synthetic_rs3(n_edus=100, max_depth=None, multinuc=0.2, secedges=0, signals=0, split="random",
+                       min_edu_len=3, max_edu_len=12, seed=42):
+    """
+    Generate a synthetic RST document
+
+    :param n_edus: number of EDUs
+    :param max_depth: maximum nesting depth; deeper ranges are flattened into a single multinuc (default: unlimited)
+    :param multinuc: probability that a multi-EDU range becomes a multinuc rather than a nucleus-satellite span
+    :param secedges: number of secondary edges to add (produces eRST .rs4 style output)
+    :param signals: number of signals to add to randomly chosen relations (produces eRST .rs4 style output)
+    :param split: how ranges are split, one of {random,balanced,right}; 'right' produces maximally deep right-branching chains
+    :param seed: random seed, so the same parameters always produce the same document
+    :return: string with the .rs3 (or .rs4) XML
+    """
+    rand = random.Random(seed)
+    edu_lengths = [rand.randint(min_edu_len, max_edu_len) for _ in range(n_edus)]
+    edu_texts = [" ".join(rand.choice(WORDS) for _ in range(length)) for length in edu_lengths]
+
+    segments = {}  # EDU id -> (parent, relname)
+    groups = {}  # group id -> (type, parent, relname)
+    first_children = set()  # Leftmost multinuc children, which share their relation with the multinuc in .rsd
+    next_group = [n_edus + 1]
+
+    def node_for(lo, hi):
+        if lo == hi:
+            return lo
+        next_group[0] += 1
+        return next_group[0] - 1
+
+    def attach(nid, parent, relname):
+        if nid <= n_edus:
+            segments[nid] = (parent, relname)
+        else:
+            groups[nid] = [None, parent, relname]
+
+    def split_point(lo, hi):
+        if split == "right":
+            return lo
+        elif split == "balanced":
+            return (lo + hi - 1) // 2
+        return rand.randint(lo, hi - 1)
+
+    root = node_for(1, n_edus)
+    attach(root, None, None)
+    tasks = deque([(1, n_edus, root, 0)])
+    while len(tasks) > 0:
+        lo, hi, nid, depth = tasks.popleft()
+        if lo == hi:
+            continue
+        if (max_depth is not None and depth >= max_depth) or rand.random() < multinuc:
+            if max_depth is not None and depth >= max_depth:
+                bounds = list(range(lo, hi + 1))
+            else:
+                n_children = min(hi - lo + 1, rand.randint(2, 3))
+                bounds = sorted(rand.sample(range(lo + 1, hi + 1), n_children - 1))
+                bounds = [lo] + bounds
+            groups[nid][0] = "multinuc"
+            relname = rand.choice(MULTINUC_RELATIONS)
+            ends = bounds[1:] + [hi + 1]
+            for start, end in zip(bounds, ends):
+                child = node_for(start, end - 1)
+                attach(child, nid, relname)
+                if start == lo:
+                    first_children.add(child)
+                tasks.append((start, end - 1, child, depth + 1))
+        else:
+            groups[nid][0] = "span"
+            mid = split_point(lo, hi)
+            left = node_for(lo, mid)
+            right = node_for(mid + 1, hi)
+            if split == "right" or rand.random() < 0.6:  # Nucleus first
+                nucleus, satellite = left, right
+            else:
+                nucleus, satellite = right, left
+            attach(nucleus, nid, "span")
+            attach(satellite, nucleus, rand.choice(RST_RELATIONS))
+            tasks.append((lo, mid, left, depth + 1))
+            tasks.append((mid + 1, hi, right, depth + 1))
+
+    # Secondary edges between random distinct nodes which are not directly attached to each other
+    all_nodes = list(range(1, next_group[0]))
+    parents = {n: segments[n][0] if n <= n_edus else groups[n][1] for n in all_nodes}
+    secedge_list = []
+    seen = set()
+    attempts = 0
+    while len(secedge_list) < secedges and attempts < secedges * 20 and len(all_nodes) > 2:
+        attempts += 1
+        src, trg = rand.sample(all_nodes, 2)
+        if parents[src] == trg or parents[trg] == src or (src, trg) in seen or parents[src] is None:
+            continue
+        seen.add((src, trg))
+        secedge_list.append((src, trg, rand.choice(RST_RELATIONS)))
+
+    # Signals on nodes with a non-span relation, or on secedges
+    n_tokens = sum(edu_lengths)
+    signal_list = []
+    sources = [n for n in all_nodes if parents[n] is not None and n not in first_children and
+               (segments[n][1] if n <= n_edus else groups[n][2]) != "span"]
+    sources += [str(s) + "-" + str(t) for s, t, _ in secedge_list]
+    for _ in range(signals if len(sources) > 0 else 0):
+        source = rand.choice(sources)
+        sigtype, subtype = rand.choice(SIGNAL_TYPES)
+        start = rand.randint(1, n_tokens)
+        tokens = ",".join(str(t) for t in range(start, min(n_tokens, start + rand.randint(0, 2)) + 1))
+        if sigtype == "graphical" and rand.random() < 0.5:
+            tokens = ""
+        signal_list.append((str(source), sigtype, subtype, tokens))
+    # Canonical signal order as in rsd2rs3 output: by source, then by first token
+    signal_list.sort(key=lambda x: (int(x[0].split("-")[0]), int(x[3].split(",")[0]) if x[3] != "" else 0))
+
+    lines = ["<rst>", "\t<header>", "\t\t<relations>"]
+    for rel in RST_RELATIONS:
+        lines.append('\t\t\t<rel name="' + rel + '" type="rst"/>')
+    for rel in MULTINUC_RELATIONS:
+        lines.append('\t\t\t<rel name="' + rel + '" type="multinuc"/>')
+    lines.append("\t\t</relations>")
+    if len(signal_list) > 0:
+        lines.append("\t\t<sigtypes>")
+        subtypes = {}
+        for sigtype, subtype in SIGNAL_TYPES:
+            subtypes.setdefault(sigtype, []).append(subtype)
+        for sigtype in sorted(subtypes):
+            lines.append('\t\t\t<sig type="' + sigtype + '" subtypes="' + ";".join(subtypes[sigtype]) + '"/>')
+        lines.append("\t\t</sigtypes>")
+    lines += ["\t</header>", "\t<body>"]
+    for eid in range(1, n_edus + 1):
+        parent, relname = segments[eid]
+        if parent is None:
+            lines.append('\t\t<segment id="' + str(eid) + '">' + edu_texts[eid - 1] + '</segment>')
+        else:
+            lines.append('\t\t<segment id="' + str(eid) + '" parent="' + str(parent) + '" relname="' + relname + '">' + edu_texts[eid - 1] + '</segment>')
+    for gid in sorted(groups):
+        kind, parent, relname = groups[gid]
+        if parent is None:
+            lines.append('\t\t<group id="' + str(gid) + '" type="' + kind + '"/>')
+        else:
+            lines.append('\t\t<group id="' + str(gid) + '" type="' + kind + '" parent="' + str(parent) + '" relname="' + relname + '"/>')
+    if len(secedge_list) > 0:
+        lines.append("\t\t<secedges>")
+        for src, trg, relname in secedge_list:
+            lines.append('\t\t\t<secedge id="' + str(src) + "-" + str(trg) + '" source="' + str(src) + '" target="' + str(trg) + '" relname="' + relname + '"/>')
+        lines.append("\t\t</secedges>")
+    if len(signal_list) > 0:
+        lines.append("\t\t<signals>")
+        for source, sigtype, subtype, tokens in signal_list:
+            lines.append('\t\t\t<signal source="' + source + '" type="' + sigtype + '" subtype="' + subtype + '" tokens="' + tokens + '"/>')
+        lines.append("\t\t</signals>")
+    lines += ["\t</body>", "</rst>"]
+    return "\n".join(lines) + "\n"
+
+
+def make_synthetic_rsd(n_edus=100, algorithm="li", **kwargs):
+    """
+    Generate a synthetic RST document with make_synthetic_rs3 and convert it to .rsd
+    """
+    return make_rsd(make_synthetic_rs3(n_edus, **kwargs), "", as_text=True, algorithm=algorithm)
+
+
+if __name__ == "__main__":
+    p = ArgumentParser(description="Generate a synthetic RST document")
+    p.add_argument("-n", "--edus", type=int, default=100, help="number of EDUs")
+    p.add_argument("--max_depth", type=int, default=None, help="maximum nesting depth")
+    p.add_argument("--multinuc", type=float, default=0.2, help="multinuc probability per constituent")
+    p.add_argument("--secedges", type=int, default=0, help="number of secondary edges")
+    p.add_argument("--signals", type=int, default=0, help="number of signals")
+    p.add_argument("--split", choices=["random", "balanced", "right"], default="random", help="tree shape")
+    p.add_argument("-f", "--format", choices=["rs3", "rsd"], default="rs3", help="output format")
+    p.add_argument("--seed", type=int, default=42, help="random seed")
+    opts = p.parse_args()
+
+    rs3 = make_synthetic_rs3(opts.edus, max_depth=opts.max_depth, multinuc=opts.multinuc, secedges=opts.secedges,
+                             signals=opts.signals, split=opts.split, seed=opts.seed)
+    if opts.format == "rsd":
+        print(make_rsd(rs3, "", as_text=True))
+    else:
+        print(rs3)
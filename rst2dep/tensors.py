@@ -0,0 +1,234 @@
+"""
+tensors.py
+
+Export discourse structure as NumPy arrays for training parsers. Each document yields dependency heads, relation
+ids, attachment heights (dist) and EDU token offsets from its .rsd representation, and constituent parent/left/right
+arrays from read_rst. Relation ids come from a RelationVocab, which is stable across runs when it is saved and
+reloaded. Documents can be batched and written as shards of .npy files, which load with mmap_mode for zero-copy
+access in data loaders. Example usage:
+
+python tensors.py "rst/*.rs3" -o tensors/ --shard_size 500
+python tensors.py "rsd/*.rsd" -o tensors_test/ --vocab tensors/vocab.json --freeze
+"""
+
+import io, os, sys, json
+from glob import glob
+from argparse import ArgumentParser
+import numpy as np
+try:
+    from .rst2dep import make_rsd
+    from .dep2rst import rsd2rs3, conllu2rsd, DEFAULT_RELATIONS
+    from .classes import read_rst, open_file, get_docname, split_compression
+except ImportError:
+    from rst2dep import make_rsd
+    from dep2rst import rsd2rs3, conllu2rsd, DEFAULT_RELATIONS
+    from classes import read_rst, open_file, get_docname, split_compression
+
+# Per-EDU arrays are indexed by EDU, per-node arrays by constituent node row; edu_offsets has one extra entry
+EDU_ARRAYS = ["heads", "rels", "dist"]
+NODE_ARRAYS = ["node_ids", "parents", "lefts", "rights", "kinds", "node_rels"]
+ARRAY_NAMES = EDU_ARRAYS + ["edu_offsets"] + NODE_ARRAYS
+NODE_KINDS = ["edu", "span", "multinuc"]
+
+
+class RelationVocab:
+    """
+    Stable mapping of relation labels to integer ids
+
+    Id 0 is ROOT, which is also used for constituent nodes without a relation. DEFAULT_RELATIONS follow in sorted
+    order with their _r/_m suffixes, then span, and unseen labels are appended in order of appearance unless the
+    vocabulary is frozen, in which case they map to -1.
+
+    :param labels: optional list of labels in id order, e.g. from a saved vocabulary
+    :param frozen: whether to stop adding new labels
+    """
+    def __init__(self, labels=None, frozen=False):
+        if labels is None:
+            labels = ["ROOT"] + sorted(rel + "_r" for rel in DEFAULT_RELATIONS["rst"]) + \
+                     sorted(rel + "_m" for rel in DEFAULT_RELATIONS["multinuc"]) + ["span"]
+        self.labels = list(labels)
+        self.ids = {label: i for i, label in enumerate(self.labels)}
+        self.frozen = frozen
+
+    def get_id(self, label):
+        if label == "":
+            label = "ROOT"
+        if label not in self.ids:
+            if self.frozen:
+                return -1
+            self.ids[label] = len(self.labels)
+            self.labels.append(label)
+        return self.ids[label]
+
+    def __len__(self):
+        return len(self.labels)
+
+    def save(self, path):
+        with io.open(path, "w", encoding="utf8", newline="\n") as f:
+            f.write(json.dumps(self.labels, indent=1) + "\n")
+
+    @classmethod
+    def load(cls, path, frozen=False):
+        with io.open(path, encoding="utf8") as f:
+            return cls(json.load(f), frozen=frozen)
+
+
+def rsd_arrays(rsd, vocab):
+    """
+    :param rsd: rsd string of one document
+    :return: dictionary of int32 heads (1-based EDU numbers, 0 for the root), rels and dist arrays, and int64
+             edu_offsets with the index of each EDU's first token and the total token count as the last entry
+    """
+    heads = []
+    rels = []
+    dist = []
+    lengths = [0]
+    for line in rsd.split("\n"):
+        if "\t" in line:
+            fields = line.split("\t")
+            heads.append(int(fields[6]))
+            rels.append(vocab.get_id(fields[7]))
+            dist.append(int(fields[2]))
+            lengths.append(fields[1].count(" ") + 1)
+    return {"heads": np.array(heads, dtype=np.int32), "rels": np.array(rels, dtype=np.int32),
+            "dist": np.array(dist, dtype=np.int32), "edu_offsets": np.cumsum(lengths, dtype=np.int64)}
+
+
+def tree_arrays(nodes, vocab):
+    """
+    :param nodes: dictionary of nodes from read_rst or load_corpus; secondary edges are skipped
+    :return: dictionary of int32 arrays with one row per constituent node in document order: node_ids, parents (row
+             index of the parent node, -1 for the root), lefts and rights (1-based EDU span), kinds (index in
+             NODE_KINDS) and node_rels
+    """
+    rows = [nid for nid in nodes if nodes[nid].kind != "secedge"]
+    row_index = {nid: i for i, nid in enumerate(rows)}
+    row_nodes = [nodes[nid] for nid in rows]
+    return {"node_ids": np.array([int(nid) for nid in rows], dtype=np.int32),
+            "parents": np.array([row_index.get(n.parent, -1) for n in row_nodes], dtype=np.int32),
+            "lefts": np.array([n.left for n in row_nodes], dtype=np.int32),
+            "rights": np.array([n.right for n in row_nodes], dtype=np.int32),
+            "kinds": np.array([NODE_KINDS.index(n.kind) for n in row_nodes], dtype=np.int32),
+            "node_rels": np.array([vocab.get_id(n.relname) for n in row_nodes], dtype=np.int32)}
+
+
+def document_arrays(data, vocab, algorithm="li", as_text=False, input_format=None):
+    """
+    Export one document as NumPy arrays
+
+    :param data: path to an .rs3, .rs4, .rsd or .conllu file, optionally compressed, or the document if as_text is True
+    :param vocab: RelationVocab for relation ids, updated with new labels unless frozen
+    :param algorithm: dependency conversion algorithm for constituent inputs, one of {li,chain,hirao}
+    :param input_format: one of {rs3,rsd,conllu}; detected from the file name, or from the contents of text input
+    :return: dictionary of arrays, see rsd_arrays and tree_arrays
+    """
+    if not as_text:
+        if input_format is None:
+            input_format = split_compression(data)[0].rsplit(".", 1)[-1].replace("rs4", "rs3")
+        with open_file(data) as f:
+            data = f.read()
+    elif input_format is None:
+        input_format = "rs3" if data.lstrip().startswith("<") else "conllu" if data.startswith("#") else "rsd"
+    if input_format == "rs3":
+        rsd = make_rsd(data, "", as_text=True, algorithm=algorithm)
+        rs3 = data
+    else:
+        rsd = conllu2rsd(data) if input_format == "conllu" else data
+        rs3 = rsd2rs3(rsd)
+    nodes = read_rst(rs3, {}, as_text=True)
+    if isinstance(nodes, str):
+        raise IOError(nodes)
+    arrays = rsd_arrays(rsd, vocab)
+    arrays.update(tree_arrays(nodes, vocab))
+    return arrays
+
+
+def batch_arrays(docs):
+    """
+    Concatenate the arrays of several documents
+
+    :param docs: list of dictionaries from document_arrays
+    :return: dictionary of concatenated arrays, plus an int64 <name>_offsets array for each, where document i is
+             <name>[<name>_offsets[i]:<name>_offsets[i + 1]]
+    """
+    batch = {}
+    for name in ARRAY_NAMES:
+        parts = [doc[name] for doc in docs]
+        batch[name] = np.concatenate(parts) if len(parts) > 0 else np.zeros(0, dtype=np.int32)
+        batch[name + "_offsets"] = np.cumsum([0] + [len(part) for part in parts], dtype=np.int64)
+    return batch
+
+
+def get_document(batch, i):
+    """
+    :return: dictionary of the arrays of document i in a batch or loaded shard; these are views, not copies
+    """
+    return {name: batch[name][batch[name + "_offsets"][i]:batch[name + "_offsets"][i + 1]] for name in ARRAY_NAMES}
+
+
+def write_shard(shard_dir, docnames, docs):
+    os.makedirs(shard_dir, exist_ok=True)
+    for name, array in batch_arrays(docs).items():
+        np.save(os.path.join(shard_dir, name + ".npy"), array)
+    with io.open(os.path.join(shard_dir, "docnames.txt"), "w", encoding="utf8", newline="\n") as f:
+        f.write("".join(docname + "\n" for docname in docnames))
+
+
+def write_shards(docs, outdir, vocab, shard_size=1000):
+    """
+    Write documents as shards of .npy files, with one subdirectory per shard and the vocabulary in vocab.json
+
+    :param docs: iterable of (docname, arrays) pairs, e.g. from document_arrays
+    :param outdir: output directory
+    :param shard_size: maximum number of documents per shard
+    :return: list of shard directories
+    """
+    shards = []
+    docnames = []
+    batch = []
+    for docname, arrays in docs:
+        docnames.append(docname)
+        batch.append(arrays)
+        if len(batch) == shard_size:
+            shards.append(os.path.join(outdir, "shard" + str(len(shards)).zfill(5)))
+            write_shard(shards[-1], docnames, batch)
+            docnames, batch = [], []
+    if len(batch) > 0:
+        shards.append(os.path.join(outdir, "shard" + str(len(shards)).zfill(5)))
+        write_shard(shards[-1], docnames, batch)
+    os.makedirs(outdir, exist_ok=True)
+    vocab.save(os.path.join(outdir, "vocab.json"))
+    return shards
+
+
+def load_shard(shard_dir, mmap=True):
+    """
+    :param mmap: memory-map the arrays instead of reading them into memory
+    :return: dictionary of arrays as written by write_shards, and the list of document names under "docnames"
+    """
+    shard = {}
+    for name in ARRAY_NAMES:
+        for key in [name, name + "_offsets"]:
+            shard[key] = np.load(os.path.join(shard_dir, key + ".npy"), mmap_mode="r" if mmap else None, allow_pickle=False)
+    with io.open(os.path.join(shard_dir, "docnames.txt"), encoding="utf8") as f:
+        shard["docnames"] = f.read().split("\n")[:-1]
+    return shard
+
+
+if __name__ == "__main__":
+    p = ArgumentParser(description="Export .rs3/.rs4/.rsd/.conllu documents as sharded NumPy arrays")
+    p.add_argument("files", nargs="+", help="input files or glob patterns")
+    p.add_argument("-o", "--outdir", required=True, help="output directory for shards and vocab.json")
+    p.add_argument("-a", "--algorithm", choices=["li", "chain", "hirao"], default="li", help="dependency conversion algorithm for .rs3/.rs4 inputs")
+    p.add_argument("--shard_size", type=int, default=1000, help="maximum number of documents per shard")
+    p.add_argument("--vocab", default=None, help="existing vocab.json to keep relation ids stable")
+    p.add_argument("--freeze", action="store_true", help="map relations missing from --vocab to -1 instead of adding them")
+    opts = p.parse_args()
+
+    vocab = RelationVocab.load(opts.vocab, frozen=opts.freeze) if opts.vocab is not None else RelationVocab()
+    files = []
+    for pattern in opts.files:
+        files += sorted(glob(pattern)) if "*" in pattern else [pattern]
+    docs = ((get_docname(f), document_arrays(f, vocab, algorithm=opts.algorithm)) for f in files)
+    shards = write_shards(docs, opts.outdir, vocab, shard_size=opts.shard_size)
+    sys.stderr.write("o Wrote " + str(len(files)) + " documents in " + str(len(shards)) + " shards to " + opts.outdir + "\n")
@@ -0,0 +1,259 @@
+"""
+validate.py
+
+Checks that RST documents round-trip exactly through make_rsd and rsd2rs3. Each document is converted to .rsd and back,
+and the original and reconstructed trees are compared structurally after canonicalization, so that differences in group
+IDs or element order do not count as failures. Documents whose constituents do not cover contiguous EDU ranges are
+reported as non-projective, since they cannot be reversed. For .rsd and .conllu input, documents are checked
+for crossing dependency edges instead. Example usage:
+
+python validate.py "corpus/rst/*.rs3" -j 8
+python validate.py "corpus/dep/*.conllu" -j 8
+"""
+
+import io, os, re, sys, json, collections
+from argparse import ArgumentParser
+try:
+    from .rst2dep import make_rsd
+    from .dep2rst import rsd2rs3, conllu2rsd, iter_conllu_docs, find_crossing_edges, format_crossing
+    from .classes import read_rst, bounded_imap, open_file, split_compression
+except ImportError:
+    from rst2dep import make_rsd
+    from dep2rst import rsd2rs3, conllu2rsd, iter_conllu_docs, find_crossing_edges, format_crossing
+    from classes import read_rst, bounded_imap, open_file, split_compression
+
+
+def get_raw_ids(rst_xml):
+    # read_rst renumbers nodes by order of appearance, segments first, while secedges keep the IDs in the XML
+    raw_ids = re.findall(r'<segment[^>]*?\sid="([^"]+)"', rst_xml) + re.findall(r'<group[^>]*?\sid="([^"]+)"', rst_xml)
+    return {raw: str(i + 1) for i, raw in enumerate(raw_ids)}
+
+
+def canonical_signals(signals):
+    output = []
+    for sig in signals:
+        tokens = tuple(sorted(int(t) for t in sig.tokens.split(",") if t != ""))
+        output.append((sig.type, sig.subtype, tokens))
+    return sorted(output)
+
+
+def get_coverage(tree):
+    """
+    Find the EDUs actually dominated by each node in an RST tree, without recursion
+
+    Satellites may attach directly to EDUs, so EDUs can dominate more than themselves, and NODE.left/right
+    do not reflect this.
+
+    :param tree: dictionary of NODE objects from read_rst, without secedges
+    :return: tuple of a post-order list of node IDs, visiting children ordered by their EDU span, kind and
+             relation, and a dictionary of node ID -> (first EDU, last EDU, number of EDUs)
+    """
+    children = collections.defaultdict(list)
+    for nid in tree:
+        children[tree[nid].parent].append(nid)
+    order = lambda nid: (tree[nid].left, tree[nid].right, tree[nid].kind, tree[nid].relname)
+    for nid in children:
+        children[nid].sort(key=order)
+
+    postorder = []
+    coverage = {}
+    stack = [(nid, False) for nid in reversed(children["0"])]
+    while len(stack) > 0:
+        nid, expanded = stack.pop()
+        if not expanded:
+            stack.append((nid, True))
+            for child in reversed(children[nid]):
+                stack.append((child, False))
+        else:
+            postorder.append(nid)
+            if tree[nid].kind == "edu":
+                first = last = int(tree[nid].left)
+                count = 1
+            else:
+                first, last, count = None, None, 0
+            for child in children[nid]:
+                c_first, c_last, c_count = coverage[child]
+                first = c_first if first is None else min(first, c_first)
+                last = c_last if last is None else max(last, c_last)
+                count += c_count
+            coverage[nid] = (first, last, count)
+    return postorder, coverage
+
+
+def read_tree(rst_xml):
+    """
+    :return: tuple of a dictionary of tree NODEs and a list of SECEDGEs read from an .rs3/.rs4 string
+    """
+    nodes = read_rst(rst_xml, {}, as_text=True)
+    if isinstance(nodes, str):
+        raise IOError("Invalid RST document: " + re.sub(r'<[^>]+>', '', nodes))
+    secedges = [nodes[nid] for nid in nodes if nodes[nid].kind == "secedge"]
+    tree = {nid: nodes[nid] for nid in nodes if nodes[nid].kind != "secedge"}
+    return tree, secedges
+
+
+def canonicalize(rst_xml):
+    """
+    Build a canonical representation of an RST tree which does not depend on group IDs or XML element order
+
+    Nodes are numbered in post-order, visiting children ordered by their EDU span, kind and relation.
+
+    :param rst_xml: .rs3 or .rs4 string
+    :return: tuple of a dictionary with sorted 'nodes', 'signals' and 'secedges' rows, and a list of non-contiguous
+             node descriptions (empty if the tree is projective)
+    """
+    tree, secedges = read_tree(rst_xml)
+    postorder, coverage = get_coverage(tree)
+    canon_id = {nid: i + 1 for i, nid in enumerate(postorder)}
+
+    rows = []
+    signals = []
+    non_contiguous = []
+    for nid in tree:
+        node = tree[nid]
+        if nid not in canon_id:  # Part of a cycle, not reachable from the root
+            raise IOError("Invalid RST document: node " + nid + " is not connected to the root")
+        parent = canon_id[node.parent] if node.parent != "0" else 0
+        text = node.text if node.kind == "edu" else ""
+        rows.append((canon_id[nid], parent, node.kind, node.relname, node.left, node.right, text))
+        for sig in canonical_signals(node.signals):
+            signals.append((canon_id[nid],) + sig)
+        first, last, count = coverage[nid]
+        if count > 0 and count != last - first + 1:
+            non_contiguous.append(node.kind + " " + nid + " (" + str(count) + " EDUs in " + str(first) + "-" + str(last) + ")")
+
+    raw_ids = get_raw_ids(rst_xml)
+    secedge_rows = []
+    for secedge in secedges:
+        src = canon_id[raw_ids.get(secedge.source, secedge.source)]
+        trg = canon_id[raw_ids.get(secedge.target, secedge.target)]
+        secedge_rows.append((src, trg, secedge.relname, tuple(canonical_signals(secedge.signals))))
+
+    canon = {"nodes": sorted(rows), "signals": sorted(signals), "secedges": sorted(secedge_rows)}
+    return canon, non_contiguous
+
+
+def compare_trees(canon_a, canon_b, max_diffs=5):
+    """
+    :return: list of human readable differences between two canonicalized trees (empty if identical)
+    """
+    diffs = []
+    for key in ["nodes", "signals", "secedges"]:
+        rows_a = set(canon_a[key])
+        rows_b = set(canon_b[key])
+        if len(canon_a[key]) != len(canon_b[key]):
+            diffs.append(key + ": " + str(len(canon_a[key])) + " in original vs. " + str(len(canon_b[key])) + " after round trip")
+        for row in sorted(rows_a - rows_b)[:max_diffs]:
+            diffs.append(key + ": missing " + str(row))
+        for row in sorted(rows_b - rows_a)[:max_diffs]:
+            diffs.append(key + ": added " + str(row))
+    return diffs
+
+
+def validate_document(rst_xml, ordering="dist"):
+    """
+    Round-trip one RST document through make_rsd and rsd2rs3 and compare the trees structurally
+
+    :param rst_xml: .rs3 or .rs4 string
+    :return: dictionary with 'status' (one of ok, mismatch, nonprojective, error), 'edus' and 'diffs'
+    """
+    try:
+        canon, non_contiguous = canonicalize(rst_xml)
+        edus = sum(1 for row in canon["nodes"] if row[2] == "edu")
+        if len(non_contiguous) > 0:
+            return {"status": "nonprojective", "edus": edus, "diffs": non_contiguous}
+        rsd = make_rsd(rst_xml, "", as_text=True)
+        canon_b, _ = canonicalize(rsd2rs3(rsd, ordering=ordering))
+    except Exception as e:
+        return {"status": "error", "edus": 0, "diffs": [type(e).__name__ + ": " + str(e).strip().split("\n")[0]]}
+    diffs = compare_trees(canon, canon_b)
+    return {"status": "ok" if len(diffs) == 0 else "mismatch", "edus": edus, "diffs": diffs}
+
+
+def check_projective(rsd):
+    """
+    :return: dictionary with 'status' (ok or nonprojective), 'edus' and the crossing edges under 'diffs'
+    """
+    crossing = find_crossing_edges(rsd)
+    edus = rsd.count("\t") // 9
+    if len(crossing) > 0:
+        return {"status": "nonprojective", "edus": edus, "diffs": [format_crossing(crossing)]}
+    return {"status": "ok", "edus": edus, "diffs": []}
+
+
+def _validate_file(job):
+    file_, ordering = job
+    base = split_compression(file_)[0]
+    if base.endswith(".conllu"):
+        results = []
+        for docname, conllu in iter_conllu_docs(file_):
+            result = check_projective(conllu2rsd(conllu))
+            result["doc"] = file_ + ":" + docname if docname is not None else file_
+            results.append(result)
+        return results
+    with open_file(file_) as f:
+        data = f.read()
+    if base.endswith(".rsd"):
+        result = check_projective(data)
+    else:
+        result = validate_document(data, ordering=ordering)
+    result["doc"] = file_
+    return [result]
+
+
+def validate_corpus(files, processes=1, ordering="dist"):
+    """
+    Validate round-tripping for many RST documents, or projectivity for dependency files, optionally on a process pool
+
+    :param files: list of .rs3/.rs4 file paths to round-trip, or .rsd/.conllu file paths to check for crossing edges
+    :param processes: number of worker processes
+    :return: generator of per-document result dictionaries in input order, with the file path under 'doc'
+    """
+    jobs = ((file_, ordering) for file_ in files)
+    for results in bounded_imap(_validate_file, jobs, processes=processes):
+        for result in results:
+            yield result
+
+
+def summarize(results):
+    """
+    :return: report dictionary with counts per status and the non-ok documents
+    """
+    counts = collections.Counter()
+    problems = []
+    edus = 0
+    for result in results:
+        counts[result["status"]] += 1
+        edus += result["edus"]
+        if result["status"] != "ok":
+            problems.append(result)
+    return {"docs": sum(counts.values()), "edus": edus, "ok": counts["ok"], "mismatch": counts["mismatch"],
+            "nonprojective": counts["nonprojective"], "error": counts["error"], "problems": problems}
+
+
+if __name__ == "__main__":
+    p = ArgumentParser(description="Check that RST documents round-trip exactly through rsd and back, or that rsd/conllu dependencies are projective")
+    p.add_argument("infiles", help="file name or glob pattern, e.g. *.rs3 or *.conllu")
+    p.add_argument("-j", "--processes", type=int, default=1, help="number of worker processes")
+    p.add_argument("-d", "--depth", choices=["ltr", "rtl", "dist"], default="dist", help="how to order depth in rsd2rs3")
+    p.add_argument("--json", default=None, help="file to write the full report to as JSON")
+    opts = p.parse_args()
+
+    if "*" in opts.infiles:
+        from glob import glob
+        files = sorted(glob(opts.infiles))
+    else:
+        files = [opts.infiles]
+
+    report = summarize(validate_corpus(files, processes=opts.processes, ordering=opts.depth))
+    for result in report["problems"]:
+        sys.stderr.write("! " + result["status"] + ": " + os.path.basename(result["doc"]) + "\n")
+        for diff in result["diffs"]:
+            sys.stderr.write("  " + diff + "\n")
+    sys.stderr.write("o " + str(report["docs"]) + " documents (" + str(report["edus"]) + " EDUs): " + str(report["ok"]) +
+                     " ok, " + str(report["mismatch"]) + " mismatched, " + str(report["nonprojective"]) +
+                     " non-projective, " + str(report["error"]) + " errors\n")
+    if opts.json is not None:
+        with io.open(opts.json, "w", encoding="utf8", newline="\n") as f:
+            f.write(json.dumps(report, indent=2) + "\n")
+    sys.exit(1 if report["mismatch"] + report["error"] > 0 else 0)
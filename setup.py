@@ -15,7 +15,7 @@ setup(
   author = 'Amir Zeldes',
   author_email = 'amir.zeldes@georgetown.edu',
   package_data = {'':['README.md','LICENSE','requirements.txt'],'rst2dep':['*']},
-  install_requires=['depedit>=4.0.0.0','stanza>=1.10.1'],
+  install_requires=['depedit>=4.0.0.0','stanza>=1.10.1','numpy'],
   url = 'https://github.com/amir-zeldes/rst2dep',
   license='Apache License, Version 2.0',
   download_url = 'https://github.com/amir-zeldes/rst2dep/releases/tag/v1.4.0.1',